@@ -0,0 +1,73 @@
+"""
+用户确认中转 - 工作流在user_confirmation节点中断后，SSE连接挂起等待 /api/confirm 的结果
+"""
+import asyncio
+import logging
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ConfirmationBroker:
+    """
+    按会话ID中转用户确认结果
+
+    SSE连接在工作流开始时open，工作流中断后wait（不占用CPU）；
+    /api/confirm 调用resolve唤醒等待方。确认可能早于wait到达（前端在知识库评估后
+    就弹出确认框），结果会先保存在future中，wait时立即返回。
+    """
+
+    def __init__(self):
+        self._futures: Dict[str, asyncio.Future] = {}
+
+    def open(self, conversation_id: str) -> asyncio.Future:
+        """
+        登记一个正在执行的工作流，同一会话之前的等待方会得到None
+
+        Returns:
+            本次执行的等待凭据，传给wait和close
+        """
+        previous = self._futures.get(conversation_id)
+        if previous and not previous.done():
+            previous.set_result(None)
+        waiter = asyncio.get_running_loop().create_future()
+        self._futures[conversation_id] = waiter
+        return waiter
+
+    def close(self, conversation_id: str, waiter: Optional[asyncio.Future]):
+        """注销工作流（完成、出错或连接断开时调用），不影响同一会话之后开始的执行"""
+        if waiter is not None and self._futures.get(conversation_id) is waiter:
+            del self._futures[conversation_id]
+
+    def is_open(self, conversation_id: str) -> bool:
+        """会话是否有正在执行（或等待确认）的工作流"""
+        return conversation_id in self._futures
+
+    async def wait(self, waiter: asyncio.Future, timeout: Optional[float] = None) -> Optional[bool]:
+        """
+        等待用户确认
+
+        Returns:
+            用户是否同意搜索；超时或被同一会话新的执行取代时为None
+        """
+        try:
+            return await asyncio.wait_for(asyncio.shield(waiter), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def resolve(self, conversation_id: str, confirmed: bool) -> bool:
+        """
+        提交用户确认结果
+
+        Returns:
+            是否有正在执行的工作流接收了结果；为False时需要由调用方恢复已中断的工作流
+        """
+        waiter = self._futures.get(conversation_id)
+        if waiter is None or waiter.done():
+            return False
+        waiter.set_result(confirmed)
+        logger.info(f"已转交用户确认: conversation_id={conversation_id}, confirmed={confirmed}")
+        return True
+
+
+confirmation_broker = ConfirmationBroker()
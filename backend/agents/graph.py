@@ -1,5 +1,8 @@
 from langgraph.graph import StateGraph, END
+from backend.agents.checkpoint import SqliteCheckpointSaver
+from backend.config import settings
 from backend.models.schemas import WorkState
+from typing import List, Union
 from backend.agents.nodes import (
     intent_recognizer_node, planner_node, knowledge_base_search_node, 
     executor_node, verifier_node, report_generator_node, 
@@ -7,6 +10,7 @@ from backend.agents.nodes import (
     user_confirmation_node
 )
 import logging
+import os
 
 logger = logging.getLogger(__name__)
 
@@ -25,18 +29,22 @@ def should_retry(state: WorkState) -> str:
     return "generate_report"
 
 
-def route_by_operation(state: WorkState) -> str:
+# 生成报告时意图识别（LLM调用）和知识库检索互不依赖，并行执行后再汇合
+GENERATE_ENTRY = ["intent_recognizer", "knowledge_base_search"]
+
+
+def route_by_operation(state: WorkState) -> Union[str, List[str]]:
     """根据操作类型路由到不同处理节点"""
     op_type = state.get("operation_type", "generate")
     
     routing_map = {
-        "generate": "intent_recognizer",  # v5.0: 首先进行意图识别
+        "generate": GENERATE_ENTRY,
         "follow_up": "qa_handler",
         "modify": "modify_handler",
         "supplement": "expand_handler"
     }
     
-    route = routing_map.get(op_type, "intent_recognizer")
+    route = routing_map.get(op_type, GENERATE_ENTRY)
     logger.info(f"操作类型: {op_type}, 路由到: {route}")
     return route
 
@@ -103,29 +111,10 @@ def should_use_api_search(state: WorkState) -> str:
         return "generate_template_only"
 
 
-def check_user_confirmation(state: WorkState) -> str:
-    """
-    v5.0 检查用户确认状态
-    
-    返回:
-        - "wait": 等待用户确认
-        - "proceed": 继续执行
-    """
-    needs_confirmation = state.get("needs_user_confirmation", False)
-    confirmation_status = state.get("user_confirmation_status")
-    
-    if not needs_confirmation:
-        # 不需要确认，直接继续
-        return "proceed"
-    
-    if confirmation_status is None:
-        # 需要确认但还未确认，等待
-        logger.info("等待用户确认...")
-        return "wait"
-    
-    # 已经确认过了，继续执行
-    logger.info(f"用户已确认: {confirmation_status}")
-    return "proceed"
+def create_checkpointer() -> SqliteCheckpointSaver:
+    """创建工作流检查点存储"""
+    project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    return SqliteCheckpointSaver(os.path.join(project_root, settings.workflow_checkpoint_db_path))
 
 
 def create_graph() -> StateGraph:
@@ -134,7 +123,7 @@ def create_graph() -> StateGraph:
     # 添加所有节点
     graph.add_node("intent_recognizer", intent_recognizer_node)
     graph.add_node("knowledge_base_search", knowledge_base_search_node)
-    graph.add_node("user_confirmation", user_confirmation_node)  # v5.0: 用户确认等待节点
+    graph.add_node("user_confirmation", user_confirmation_node)  # v5.0: 用户确认节点（中断等待）
     graph.add_node("planner", planner_node)
     graph.add_node("executor", executor_node)
     graph.add_node("verifier", verifier_node)
@@ -148,18 +137,20 @@ def create_graph() -> StateGraph:
         route_by_operation,
         {
             "intent_recognizer": "intent_recognizer",
+            "knowledge_base_search": "knowledge_base_search",
             "qa_handler": "qa_handler",
             "modify_handler": "modify_handler",
             "expand_handler": "expand_handler"
         }
     )
     
-    # v5.0: 意图识别 → 知识库检索
-    graph.add_edge("intent_recognizer", "knowledge_base_search")
+    # 意图识别和知识库检索都完成后汇合（空操作，用于路由）
+    graph.add_node("retrieval_join", lambda state: {})
+    graph.add_edge(GENERATE_ENTRY, "retrieval_join")
     
     # v5.0: 知识库检索后条件分支
     graph.add_conditional_edges(
-        "knowledge_base_search",
+        "retrieval_join",
         should_use_knowledge_base,
         {
             "generate_from_kb": "report_generator",      # 路径A：直接生成
@@ -168,15 +159,8 @@ def create_graph() -> StateGraph:
         }
     )
     
-    # v5.0: 用户确认等待节点循环检查
-    graph.add_conditional_edges(
-        "user_confirmation",
-        check_user_confirmation,
-        {
-            "wait": "user_confirmation",    # 继续等待
-            "proceed": "post_confirmation_router"  # 用户已确认，进入后续路由
-        }
-    )
+    # v5.0: 用户确认节点中断等待，恢复后进入后续路由
+    graph.add_edge("user_confirmation", "post_confirmation_router")
     
     # v5.0: 添加 post_confirmation_router 节点（空操作，用于路由）
     graph.add_node("post_confirmation_router", lambda state: state)
@@ -213,7 +197,8 @@ def create_graph() -> StateGraph:
     graph.add_edge("modify_handler", END)
     graph.add_edge("expand_handler", END)
     
-    return graph.compile()
+    # 每个节点完成后保存检查点（thread_id为会话ID），用于确认后继续以及断线/重启后恢复
+    return graph.compile(checkpointer=create_checkpointer())
 
 
 workflow = create_graph()
@@ -1,17 +1,41 @@
+from backend.config import settings
 from backend.models.schemas import WorkState
 from backend.models.llm import deepseek_client
 from backend.tools.search import search_tool
+from backend.tools import report_editor
 from backend.conversation import conversation_manager
 from backend.knowledge_base import knowledge_base_manager
 from backend.templates import get_template, get_default_template
+from langgraph.config import get_stream_writer
+from langgraph.types import interrupt
 from typing import Dict, Any, List
+import asyncio
 import logging
 import json
 
 logger = logging.getLogger(__name__)
 
 
-def intent_recognizer_node(state: WorkState) -> Dict[str, Any]:
+async def _stream_completion(messages: list, content_type: str) -> str:
+    """
+    流式调用LLM，并将增量内容作为report_delta自定义事件推送给SSE
+    
+    Args:
+        messages: 对话消息
+        content_type: 内容类型（report/modification/supplement/follow_up）
+        
+    Returns:
+        拼接后的完整文本
+    """
+    writer = get_stream_writer()
+    parts = []
+    async for delta in deepseek_client.astream_chat_completion(messages):
+        parts.append(delta)
+        writer({"event": "report_delta", "type": content_type, "content": delta})
+    return "".join(parts)
+
+
+async def intent_recognizer_node(state: WorkState) -> Dict[str, Any]:
     """
     意图识别节点 (v5.0 新增)
     
@@ -47,7 +71,7 @@ intent_type说明：
             {"role": "user", "content": f"用户问题: {user_query}"}
         ]
         
-        response = deepseek_client.chat_completion(messages)
+        response = await deepseek_client.achat_completion(messages, use_cache=True)
         
         # 解析JSON结果
         try:
@@ -64,9 +88,9 @@ intent_type说明：
         
         logger.info(f"意图识别完成: {intent_analysis.get('intent_type')}, 置信度: {intent_analysis.get('confidence')}")
         
+        # 与知识库检索并行执行，只写入intent_analysis，避免同一步内重复更新user_query
         return {
-            "intent_analysis": intent_analysis,
-            "user_query": user_query
+            "intent_analysis": intent_analysis
         }
         
     except Exception as e:
@@ -83,7 +107,7 @@ intent_type说明：
         }
 
 
-def planner_node(state: WorkState) -> Dict[str, Any]:
+async def planner_node(state: WorkState) -> Dict[str, Any]:
     user_query = state["user_query"]
     template_id = state.get("template_id")
     
@@ -109,7 +133,7 @@ def planner_node(state: WorkState) -> Dict[str, Any]:
         }
     ]
     
-    response = deepseek_client.chat_completion(messages)
+    response = await deepseek_client.achat_completion(messages, use_cache=True)
     
     plan_steps = [step.strip() for step in response.split("\n") if step.strip()]
     
@@ -135,14 +159,13 @@ def knowledge_base_search_node(state: WorkState) -> Dict[str, Any]:
     """
     user_query = state["user_query"]
     document_id = state.get("document_id")
-    intent_analysis = state.get("intent_analysis")
     
     logger.info(f"开始知识库检索: {user_query[:50]}..., 指定文档: {document_id}")
     
     try:
         # 如果指定了document_id，直接使用该文档
         if document_id:
-            document = knowledge_base_manager.get_document(document_id)
+            document = knowledge_base_manager.get_document(document_id, with_content=True)
             if document and document.status.value == "completed":
                 logger.info(f"使用指定文档: {document.filename}")
                 search_results = []
@@ -247,11 +270,12 @@ def knowledge_base_search_node(state: WorkState) -> Dict[str, Any]:
         }
 
 
-def executor_node(state: WorkState) -> Dict[str, Any]:
+async def executor_node(state: WorkState) -> Dict[str, Any]:
     """
     执行器节点
     
-    根据知识库检索结果决定是否需要API搜索
+    根据知识库检索结果决定是否需要API搜索，
+    各搜索步骤并发执行（受并发上限和总时限约束），结果按计划顺序合并
     """
     plan_steps = state["plan_steps"]
     all_results = state.get("search_results", [])
@@ -270,8 +294,28 @@ def executor_node(state: WorkState) -> Dict[str, Any]:
     # 知识库不足，执行API搜索
     logger.info("知识库内容不足，执行API搜索补充")
     
-    for step in plan_steps:
-        results = search_tool.search(step, num_results=3)
+    semaphore = asyncio.Semaphore(settings.search_max_concurrency)
+    
+    async def run_step(step: str) -> List[Dict[str, Any]]:
+        async with semaphore:
+            return await search_tool.asearch(step, num_results=3)
+    
+    tasks = [asyncio.create_task(run_step(step)) for step in plan_steps]
+    if tasks:
+        _, pending = await asyncio.wait(tasks, timeout=settings.search_deadline)
+        for task in pending:
+            task.cancel()
+        if pending:
+            logger.warning(f"{len(pending)} 个搜索步骤超过时限 {settings.search_deadline}s，已放弃")
+    
+    # 按计划顺序合并结果
+    for step, task in zip(plan_steps, tasks):
+        if task.cancelled():
+            continue
+        if task.exception():
+            logger.error(f"搜索步骤失败: {step}, 错误: {task.exception()}")
+            continue
+        results = task.result()
         # 标记来源
         for r in results:
             r['source'] = 'api_search'
@@ -286,7 +330,7 @@ def executor_node(state: WorkState) -> Dict[str, Any]:
     }
 
 
-def verifier_node(state: WorkState) -> Dict[str, Any]:
+async def verifier_node(state: WorkState) -> Dict[str, Any]:
     user_query = state["user_query"]
     search_results = state["search_results"]
     kb_sufficient = state.get("kb_sufficient", False)
@@ -323,7 +367,7 @@ def verifier_node(state: WorkState) -> Dict[str, Any]:
         }
     ]
 
-    response = deepseek_client.chat_completion(messages)
+    response = await deepseek_client.achat_completion(messages, use_cache=True)
 
     # 放宽验证条件：只要有搜索结果且AI没有明确说"无法回答"或"不相关"，就视为通过
     negative_keywords = ["无法回答", "不相关", "完全不", "没有任何", "未能找到", "no relevant", "cannot answer", "unrelated"]
@@ -339,7 +383,134 @@ def verifier_node(state: WorkState) -> Dict[str, Any]:
     }
 
 
-def report_generator_node(state: WorkState) -> Dict[str, Any]:
+def _format_reference_info(kb_results: List[Dict[str, Any]], api_results: List[Dict[str, Any]]) -> str:
+    """把知识库内容和搜索结果整理为提示词中的参考信息"""
+    reference_info = ""
+    if kb_results:
+        reference_info += "【知识库内容】\n"
+        reference_info += "\n".join([f"来源：{r['title']}\n{r['snippet']}\n" for r in kb_results])
+    
+    if api_results:
+        reference_info += "\n【网络搜索结果】\n"
+        reference_info += "\n".join([f"标题：{r['title']}\n摘要：{r['snippet']}\n" for r in api_results])
+    
+    return reference_info
+
+
+_CHINESE_DIGITS = "零一二三四五六七八九"
+
+
+def _chinese_number(n: int) -> str:
+    """1-99转中文数字，用于章节编号"""
+    if n < 10:
+        return _CHINESE_DIGITS[n]
+    tens, ones = divmod(n, 10)
+    return ("" if tens == 1 else _CHINESE_DIGITS[tens]) + "十" + (_CHINESE_DIGITS[ones] if ones else "")
+
+
+def _bigrams(text: str) -> set:
+    """提取文本的字符二元组（去掉空白和标点），用于粗略的相关度计算"""
+    chars = [c for c in text.lower() if c.isalnum()]
+    return {a + b for a, b in zip(chars, chars[1:])}
+
+
+def _select_results_for_section(
+    section: Dict[str, Any],
+    results: List[Dict[str, Any]],
+    limit: int
+) -> List[Dict[str, Any]]:
+    """按与章节标题和说明的字符重合度挑选该章节使用的参考资料，保持原有顺序"""
+    if len(results) <= limit:
+        return results
+    
+    section_grams = _bigrams(f"{section.get('title', '')}{section.get('description', '')}")
+    scored = [
+        (len(section_grams & _bigrams(f"{r.get('title', '')}{r.get('snippet', '')}")), i)
+        for i, r in enumerate(results)
+    ]
+    # 得分相同时优先排在前面的结果
+    chosen = sorted(scored, key=lambda x: (-x[0], x[1]))[:limit]
+    return [results[i] for _, i in sorted(chosen, key=lambda x: x[1])]
+
+
+async def _generate_report_sections(
+    user_query: str,
+    template,
+    system_prompt: str,
+    source_note: str,
+    kb_results: List[Dict[str, Any]],
+    api_results: List[Dict[str, Any]]
+) -> str:
+    """
+    按模板章节并行生成报告
+    
+    每个章节只带与其相关的参考资料单独调用LLM，所有章节同时生成；
+    章节按顺序拼接，前面的章节都完成后立即通过report_delta推送
+    
+    Returns:
+        拼接后的完整报告
+    """
+    sections = template.structure
+    outline = "\n".join(
+        f"{_chinese_number(i)}、{section['title']}：{section.get('description', '')}"
+        for i, section in enumerate(sections, start=1)
+    )
+    limit = settings.report_section_max_results
+    requirements = f"【报告要求】\n{template.report_prompt}\n\n" if template.report_prompt else ""
+    
+    async def generate(index: int, section: Dict[str, Any]) -> str:
+        section_kb = _select_results_for_section(section, kb_results, limit)
+        section_api = _select_results_for_section(section, api_results, limit)
+        optional_note = "" if section.get("required", True) else "本节为可选内容，参考信息不足时简要说明即可。\n"
+        user_prompt = (
+            f"主题：{user_query}{source_note}\n\n"
+            f"【报告大纲】\n{outline}\n\n"
+            f"{requirements}"
+            f"你只负责撰写第{_chinese_number(index)}部分「{section['title']}」（{section.get('description', '')}）。\n"
+            f"{optional_note}"
+            "只输出本节正文，不要输出报告标题和本节标题，不要撰写其他章节的内容。\n\n"
+            f"参考信息：\n{_format_reference_info(section_kb, section_api)}"
+        )
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
+        # 失败时重试一次，仍失败则抛出：节点失败会推送error事件并保留检查点，不产出缺章节的报告
+        for attempt in range(2):
+            try:
+                content = await deepseek_client.achat_completion(messages)
+                break
+            except Exception as e:
+                if attempt:
+                    logger.error(f"章节「{section['title']}」生成失败: {str(e)}")
+                    raise
+                logger.warning(f"章节「{section['title']}」生成失败，重试一次: {str(e)}")
+        return f"{_chinese_number(index)}、{section['title']}\n\n{content.strip()}\n\n"
+    
+    writer = get_stream_writer()
+    title = user_query.strip() if len(user_query.strip()) <= 30 else template.name
+    header = f"{title}\n\n"
+    writer({"event": "report_delta", "type": "report", "content": header})
+    
+    tasks = [asyncio.create_task(generate(i, section)) for i, section in enumerate(sections, start=1)]
+    parts = [header]
+    # 按章节顺序等待：后面的章节可能先完成，但要等前面的章节推送后再推送
+    try:
+        for task in tasks:
+            part = await task
+            parts.append(part)
+            writer({"event": "report_delta", "type": "report", "content": part})
+    finally:
+        # 节点被取消（连接断开、中断）、章节生成失败或推送出错时，不再为剩余章节继续调用LLM
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+    
+    logger.info(f"分章节生成完成，共 {len(sections)} 个章节")
+    return "".join(parts).rstrip() + "\n"
+
+
+async def report_generator_node(state: WorkState) -> Dict[str, Any]:
     """
     增强版报告生成节点 (v5.0)
     
@@ -401,14 +572,7 @@ def report_generator_node(state: WorkState) -> Dict[str, Any]:
         source_note = "（基于网络搜索生成）"
     
     # 构建参考信息
-    reference_info = ""
-    if kb_results:
-        reference_info += "【知识库内容】\n"
-        reference_info += "\n".join([f"来源：{r['title']}\n{r['snippet']}\n" for r in kb_results])
-    
-    if api_results:
-        reference_info += "\n【网络搜索结果】\n"
-        reference_info += "\n".join([f"标题：{r['title']}\n摘要：{r['snippet']}\n" for r in api_results])
+    reference_info = _format_reference_info(kb_results, api_results)
     
     # 构建系统提示，加入模板特定的报告提示
     system_prompt = f"""你是一个专业报告生成专家。请基于搜索结果生成纯文本格式的结构化报告。
@@ -452,7 +616,14 @@ def report_generator_node(state: WorkState) -> Dict[str, Any]:
         }
     ]
     
-    report = deepseek_client.chat_completion(messages)
+    # 模板定义了章节结构时按章节并行生成，耗时取决于最长的章节而不是全文
+    sections = template.structure if template and template.id != "general" else []
+    if settings.report_sectioned_generation and len(sections) >= 2:
+        report = await _generate_report_sections(
+            user_query, template, system_prompt, source_note, kb_results, api_results
+        )
+    else:
+        report = await _stream_completion(messages, "report")
     
     logger.info(f"报告生成完成{source_note}，模式: {generation_mode}，使用模板: {template.name if template else '默认'}")
     
@@ -507,7 +678,7 @@ def generate_template_only(template, query: str) -> str:
     return report
 
 
-def qa_handler_node(state: WorkState) -> Dict[str, Any]:
+async def qa_handler_node(state: WorkState) -> Dict[str, Any]:
     """处理用户追问 - 基于上下文回答，不修改报告"""
     conversation_id = state.get("conversation_id")
     user_query = state["user_query"]
@@ -520,7 +691,7 @@ def qa_handler_node(state: WorkState) -> Dict[str, Any]:
     # 先尝试从知识库获取相关信息
     kb_context = ""
     try:
-        relevance_result = knowledge_base_manager.check_relevance(user_query, top_k=3)
+        relevance_result = await asyncio.to_thread(knowledge_base_manager.check_relevance, user_query, top_k=3)
         if relevance_result.relevant_chunks:
             kb_context = "\n\n【知识库相关信息】\n"
             kb_context += "\n".join([f"- {r.chunk.content[:200]}..." for r in relevance_result.relevant_chunks[:2]])
@@ -540,7 +711,7 @@ def qa_handler_node(state: WorkState) -> Dict[str, Any]:
         }
     ]
     
-    answer = deepseek_client.chat_completion(messages)
+    answer = await _stream_completion(messages, "follow_up")
     
     logger.info(f"QA回答生成完成，问题：{user_query[:30]}...")
     
@@ -550,7 +721,7 @@ def qa_handler_node(state: WorkState) -> Dict[str, Any]:
     }
 
 
-def modify_handler_node(state: WorkState) -> Dict[str, Any]:
+async def modify_handler_node(state: WorkState) -> Dict[str, Any]:
     """处理报告修改 - 精准修改选中段落"""
     conversation_id = state.get("conversation_id")
     user_query = state["user_query"]  # 修改要求
@@ -567,6 +738,47 @@ def modify_handler_node(state: WorkState) -> Dict[str, Any]:
             "operation_type": "modify"
         }
     
+    # 局部修改：只把选中段落及其上下文发给LLM，返回的新段落拼接回原报告
+    span = report_editor.locate_text(current_report, selected_text)
+    if span:
+        start, end = span
+        before, after = report_editor.context_window(
+            current_report, start, end, settings.report_edit_context_chars
+        )
+        messages = [
+            {
+                "role": "system",
+                "content": """你是一个专业的文档编辑助手。根据用户的修改要求改写报告中的一个段落。
+
+【修改规则】
+1. 只改写【需要修改的段落】，上文和下文仅供参考
+2. 保持原文档的格式（Markdown标题、列表等）和风格
+3. 确保修改后的内容与上下文衔接自然
+4. 只输出修改后的段落本身，不要输出上下文、说明或代码块标记"""
+            },
+            {
+                "role": "user",
+                "content": f"【上文】\n{before}\n\n" +
+                          f"【需要修改的段落】\n{current_report[start:end]}\n\n" +
+                          f"【下文】\n{after}\n\n" +
+                          f"修改要求：{user_query}\n\n" +
+                          "请只输出修改后的段落。"
+            }
+        ]
+        
+        replacement = await _stream_completion(messages, "modification")
+        modified_report = report_editor.splice(current_report, start, end, replacement)
+        
+        logger.info(f"报告局部修改完成，替换 {end - start} 字为 {len(replacement)} 字，修改要求：{user_query[:30]}...")
+        
+        return {
+            "final_report": modified_report,
+            "modification": f"已修改段落：{selected_text[:50]}...",
+            "operation_type": "modify"
+        }
+    
+    # 报告中找不到选中内容时，退回整篇改写
+    logger.warning("未在报告中定位到选中段落，改为整篇改写")
     messages = [
         {
             "role": "system",
@@ -587,7 +799,7 @@ def modify_handler_node(state: WorkState) -> Dict[str, Any]:
         }
     ]
     
-    modified_report = deepseek_client.chat_completion(messages)
+    modified_report = await _stream_completion(messages, "modification")
     
     logger.info(f"报告修改完成，修改要求：{user_query[:30]}...")
     
@@ -598,7 +810,7 @@ def modify_handler_node(state: WorkState) -> Dict[str, Any]:
     }
 
 
-def expand_handler_node(state: WorkState) -> Dict[str, Any]:
+async def expand_handler_node(state: WorkState) -> Dict[str, Any]:
     """处理内容补充 - 在指定位置添加内容"""
     conversation_id = state.get("conversation_id")
     user_query = state["user_query"]  # 补充要求
@@ -612,37 +824,44 @@ def expand_handler_node(state: WorkState) -> Dict[str, Any]:
     # 尝试从知识库获取补充信息
     kb_supplement = ""
     try:
-        relevance_result = knowledge_base_manager.check_relevance(user_query, top_k=3)
+        relevance_result = await asyncio.to_thread(knowledge_base_manager.check_relevance, user_query, top_k=3)
         if relevance_result.relevant_chunks:
             kb_supplement = "\n\n【知识库参考信息】\n"
             kb_supplement += "\n".join([f"- {r.chunk.content[:300]}..." for r in relevance_result.relevant_chunks[:2]])
     except Exception as e:
         logger.warning(f"补充时知识库检索失败: {str(e)}")
     
+    # 局部补充：LLM只生成新增内容，按插入位置拼接回原报告
+    insert_at = report_editor.find_insert_position(current_report, position, state.get("selected_text"))
+    before, after = report_editor.context_window(
+        current_report, insert_at, insert_at, settings.report_edit_context_chars
+    )
+    
     messages = [
         {
             "role": "system",
-            "content": """你是一个专业的内容扩展助手。根据用户的要求，在报告的指定位置添加新内容。
+            "content": """你是一个专业的内容扩展助手。根据用户的要求，生成需要插入到报告中的新内容。
 
 【补充规则】
 1. 新内容要与原文风格一致
-2. 确保补充内容与上下文衔接自然
-3. 输出包含新内容的完整报告
-4. 保持原文档的格式规范"""
+2. 确保补充内容与插入位置的上下文衔接自然
+3. 保持原文档的格式规范（Markdown标题层级、列表等）
+4. 只输出新增的内容，不要重复上下文，不要输出说明或代码块标记"""
         },
         {
             "role": "user",
-            "content": f"当前报告：\n{current_report}\n\n" +
-                      f"插入位置：{position}\n\n" +
+            "content": f"【插入位置之前的内容】\n{before}\n\n" +
+                      f"【插入位置之后的内容】\n{after}\n\n" +
                       f"补充要求：{user_query}\n\n" +
                       (f"参考信息：\n{search_results[:3]}{kb_supplement}\n\n" if search_results or kb_supplement else "") +
-                      "请生成需要补充的内容，并输出包含新内容的完整报告。"
+                      "请只输出需要插入的新内容。"
         }
     ]
     
-    expanded_report = deepseek_client.chat_completion(messages)
+    addition = await _stream_completion(messages, "supplement")
+    expanded_report = report_editor.insert(current_report, insert_at, addition) if current_report else addition
     
-    logger.info(f"内容补充完成，补充要求：{user_query[:30]}...")
+    logger.info(f"内容补充完成，新增 {len(addition)} 字，补充要求：{user_query[:30]}...")
     
     return {
         "final_report": expanded_report,
@@ -653,34 +872,19 @@ def expand_handler_node(state: WorkState) -> Dict[str, Any]:
 
 def user_confirmation_node(state: WorkState) -> Dict[str, Any]:
     """
-    用户确认等待节点 (v5.0 新增)
+    用户确认节点 (v5.0 新增)
     
-    从会话管理器中读取最新的用户确认状态
-    这样当用户通过API确认后，工作流能够获取到最新状态
+    通过interrupt挂起工作流并保存检查点，/api/confirm 提交结果后以
+    Command(resume=是否同意搜索) 从这里继续执行
     """
-    conversation_id = state.get("conversation_id")
-    
-    if conversation_id:
-        # 从会话管理器获取最新状态
-        conversation = conversation_manager.get_conversation(conversation_id)
-        if conversation:
-            # 从metadata中检查是否有用户确认状态更新
-            metadata = conversation.metadata if conversation.metadata else {}
-            user_confirmed = metadata.get("user_confirmed_search") if isinstance(metadata, dict) else None
-            confirmation_status = metadata.get("user_confirmation_status") if isinstance(metadata, dict) else None
-            
-            # 如果metadata中有确认状态，更新状态
-            if user_confirmed is not None or confirmation_status is not None:
-                logger.info(f"从会话读取到用户确认状态: confirmed={user_confirmed}, status={confirmation_status}")
-                return {
-                    "user_confirmed_search": user_confirmed,
-                    "user_confirmation_status": confirmation_status,
-                    "needs_user_confirmation": False  # 已经确认过了
-                }
+    confirmed = interrupt({
+        "prompt": state.get("confirmation_prompt"),
+        "sufficiency_level": state.get("kb_sufficiency_level")
+    })
     
-    # 如果没有更新，返回当前状态（继续等待）
+    logger.info(f"收到用户确认: confirmed={confirmed}")
     return {
-        "user_confirmed_search": state.get("user_confirmed_search"),
-        "user_confirmation_status": state.get("user_confirmation_status"),
-        "needs_user_confirmation": state.get("needs_user_confirmation", False)
+        "user_confirmed_search": bool(confirmed),
+        "user_confirmation_status": "confirmed" if confirmed else "declined",
+        "needs_user_confirmation": False
     }
@@ -13,6 +13,56 @@ class Settings(BaseSettings):
     ollama_base_url: str = "http://localhost:11434"
     ollama_embed_model: str = "quentinz/bge-small-zh-v1.5:latest"  # 默认使用中文嵌入模型
     ollama_embed_model_fallback: str = "dengcao/Qwen3-Embedding-0.6B:F16"  # 备用模型
+    ollama_embed_batch_size: int = 32  # 每次/api/embed请求的文本数
+    ollama_embed_max_inflight: int = 2  # 同时进行的批量嵌入请求数
+    kb_ingest_workers: int = 2  # 后台文档处理（解析、分块、嵌入）线程数
+    kb_hybrid_candidates: int = 20  # 混合检索时向量和关键词各取的候选数
+    kb_rrf_k: int = 60  # 倒数排名融合的平滑常数
+    kb_vector_backend: str = "chroma"  # 向量存储后端：chroma，或 numpy（进程内矩阵精确检索，适合10万块以内）
+    kb_numpy_index_dir: str = "./vector_index"  # numpy后端的向量矩阵和ID表目录
+    kb_numpy_dtype: str = "float32"  # numpy后端的向量精度：float32 或 float16（内存和磁盘减半）
+    kb_retrieval_cache_enabled: bool = True  # 是否缓存知识库检索结果（文档增删时自动失效）
+    kb_retrieval_cache_ttl: int = 300  # 检索结果缓存有效期（秒）
+    kb_retrieval_cache_max_entries: int = 256  # 最多缓存的检索数
+    embedding_cache_enabled: bool = True  # 是否缓存嵌入向量
+    embedding_cache_db_path: str = "./cache/embedding_cache.db"  # 嵌入缓存SQLite文件（留空仅用内存）
+    embedding_cache_memory_entries: int = 4096  # 内存LRU保留的向量数
+
+    # LLM客户端配置
+    llm_max_concurrency: int = 16  # 同时进行的LLM请求数上限
+    llm_max_connections: int = 32  # HTTP连接池大小（keep-alive复用）
+    llm_timeout: float = 120.0  # 单次请求超时（秒）
+    llm_cache_enabled: bool = True  # 是否允许调用方使用LLM响应缓存
+    llm_cache_ttl: int = 24 * 3600  # LLM响应缓存有效期（秒）
+    llm_cache_max_entries: int = 2000  # 内存中最多缓存的响应数
+    llm_cache_db_path: str = ""  # 非空时将LLM响应缓存持久化到该SQLite文件
+    report_edit_context_chars: int = 1500  # 局部修改/补充时发送给LLM的前后文字数（各）
+    report_sectioned_generation: bool = True  # 模板有章节结构时按章节并行生成报告
+    report_section_max_results: int = 8  # 每个章节最多使用的参考资料条数（知识库和搜索结果各）
+
+    # 搜索配置
+    search_max_concurrency: int = 5  # 执行器并发搜索步骤数上限
+    search_deadline: float = 40.0  # 单次执行器运行的搜索总时限（秒）
+    search_timeout: float = 30.0  # 单次搜索请求超时（秒）
+    search_pool_size: int = 10  # 搜索连接池大小
+    search_http2: bool = True  # 安装h2时启用HTTP/2
+    search_cache_enabled: bool = True  # 是否缓存搜索结果
+    search_cache_ttl: int = 6 * 3600  # 搜索缓存有效期（秒）
+    search_cache_max_entries: int = 1000  # 内存中最多缓存的查询数
+    search_cache_db_path: str = ""  # 非空时将搜索缓存持久化到该SQLite文件
+
+    # 会话存储配置
+    conversation_store_backend: str = "sqlite"  # sqlite 或 json（旧版单文件存储）
+    conversation_db_path: str = "conversations.db"  # 相对项目根目录，首次启动时自动导入conversations.json
+    conversation_write_behind: bool = True  # 后台合并写入，请求路径不直接写盘
+    conversation_flush_interval: float = 1.0  # 后台写入间隔（秒）
+    conversation_flush_batch_size: int = 20  # 脏会话达到该数量时立即写入
+    conversation_cache_size: int = 200  # 内存中保留的完整会话数（LRU），列表只读索引
+
+    # 工作流检查点
+    workflow_checkpoint_db_path: str = "checkpoints.db"  # 相对项目根目录，断线或重启后从最后完成的节点恢复
+    workflow_checkpoint_ttl: int = 7 * 24 * 3600  # 超过该时间（秒）未继续的工作流检查点在启动时清理
+    confirmation_timeout: float = 600.0  # 等待用户确认的最长时间（秒），超时后结束连接，检查点保留可恢复
 
     class Config:
         env_file = ".env"
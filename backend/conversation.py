@@ -2,13 +2,24 @@
 对话管理模块 - 支持多轮对话的会话管理
 """
 import uuid
-import json
 import os
+import json
+import base64
+import bisect
+import difflib
+import threading
+from collections import OrderedDict
 from datetime import datetime
-from typing import List, Dict, Optional, Literal
+from typing import Any, Callable, List, Dict, Optional, Literal, Tuple
 from pydantic import BaseModel
 from enum import Enum
 
+from backend.config import settings
+from backend.conversation_store import (
+    ConversationStore, JsonConversationStore, SqliteConversationStore, WriteBehindPersister,
+    migrate_json_to_sqlite
+)
+
 
 class MessageType(str, Enum):
     QUERY = "query"
@@ -40,17 +51,156 @@ class Conversation(BaseModel):
     metadata: Dict = {}
 
 
+def make_report_delta(base: str, target: str) -> List[Any]:
+    """
+    生成从base还原target的按行差异
+    
+    结果为操作列表：[起始行, 结束行] 表示复制base中的这些行，字符串表示插入的文本
+    """
+    base_lines = base.splitlines(keepends=True)
+    target_lines = target.splitlines(keepends=True)
+    delta: List[Any] = []
+    matcher = difflib.SequenceMatcher(None, base_lines, target_lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            delta.append([i1, i2])
+        elif j2 > j1:
+            delta.append("".join(target_lines[j1:j2]))
+    return delta
+
+
+def apply_report_delta(base: str, delta: List[Any]) -> str:
+    """用make_report_delta生成的差异从base还原目标文本"""
+    base_lines = base.splitlines(keepends=True)
+    parts = []
+    for op in delta:
+        if isinstance(op, str):
+            parts.append(op)
+        else:
+            parts.extend(base_lines[op[0]:op[1]])
+    return "".join(parts)
+
+
+def encode_cursor(key: Tuple[str, str]) -> str:
+    """把 (updated_at, id) 编码为分页游标"""
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    """解析分页游标，格式错误时抛出ValueError"""
+    try:
+        updated_at, conversation_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return str(updated_at), str(conversation_id)
+    except Exception as e:
+        raise ValueError(f"无效的分页游标: {cursor}") from e
+
+
 class ConversationManager:
     """对话管理器 - 管理会话的创建、更新、查询"""
     
-    def __init__(self, storage_file: str = "conversations.json"):
-        self.conversations: Dict[str, Conversation] = {}
+    def __init__(self, storage_file: str = "conversations.json", store: Optional[ConversationStore] = None):
+        # 最近使用的完整会话（LRU），其余会话按需从存储加载
+        self.conversations: "OrderedDict[str, Conversation]" = OrderedDict()
+        # 全部会话的索引: id -> {id, title, created_at, updated_at, message_count}
+        self._index: Dict[str, Dict] = {}
+        # 按 (updated_at, id) 升序排列的键，分页时二分定位
+        self._order: List[Tuple[str, str]] = []
         self.max_messages = 20  # 最多保留20条消息（10轮对话）
         self.max_versions = 5   # 最多保留5个报告版本
+        self.max_cached = settings.conversation_cache_size
         # 使用绝对路径，确保文件保存在项目根目录
-        self.storage_file = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), storage_file)
-        print(f"会话存储文件路径: {self.storage_file}")
-        self.load_from_file()  # 启动时从文件加载
+        project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self.storage_file = os.path.join(project_root, storage_file)
+        self.store = store or self._create_store(project_root)
+        # 保护内存中的会话，后台写入线程取快照时不会读到修改一半的数据
+        self._lock = threading.RLock()
+        self.persister: Optional[WriteBehindPersister] = None
+        self.load_from_file()  # 启动时只加载索引
+        
+        # 后台合并写入：请求路径只标记脏会话，不直接写盘
+        if settings.conversation_write_behind:
+            self.persister = WriteBehindPersister(
+                self.store,
+                self._snapshot,
+                interval=settings.conversation_flush_interval,
+                batch_size=settings.conversation_flush_batch_size
+            )
+    
+    def _create_store(self, project_root: str) -> ConversationStore:
+        """根据配置创建存储后端"""
+        if settings.conversation_store_backend == "json":
+            print(f"会话存储文件路径: {self.storage_file}")
+            return JsonConversationStore(self.storage_file)
+        
+        db_path = os.path.join(project_root, settings.conversation_db_path)
+        print(f"会话存储数据库路径: {db_path}")
+        store = SqliteConversationStore(db_path)
+        # 首次启动时导入旧的JSON文件
+        migrated = migrate_json_to_sqlite(self.storage_file, store)
+        if migrated:
+            print(f"已从 {self.storage_file} 迁移 {migrated} 个会话")
+        return store
+    
+    def _snapshot(self, conversation_id: str) -> Optional[Dict]:
+        """取会话当前状态的字典副本（后台写入线程调用）"""
+        with self._lock:
+            conversation = self.conversations.get(conversation_id)
+            return conversation.model_dump(mode="json") if conversation else None
+    
+    def _persist(self, conversation_id: str, write: Callable[[], None]):
+        """持久化一次修改：启用后台写入时只标记脏会话，否则立即执行write"""
+        if self.persister is not None:
+            self.persister.mark_dirty(conversation_id)
+        else:
+            write()
+    
+    def _remove_from_order(self, entry: Dict):
+        key = (entry["updated_at"], entry["id"])
+        i = bisect.bisect_left(self._order, key)
+        if i < len(self._order) and self._order[i] == key:
+            del self._order[i]
+    
+    def _update_index(self, conversation: Conversation):
+        """同步会话索引"""
+        old = self._index.get(conversation.id)
+        if old is not None:
+            self._remove_from_order(old)
+        bisect.insort(self._order, (conversation.updated_at, conversation.id))
+        self._index[conversation.id] = {
+            "id": conversation.id,
+            "title": conversation.title,
+            "created_at": conversation.created_at,
+            "updated_at": conversation.updated_at,
+            "message_count": len(conversation.messages)
+        }
+    
+    def _cache(self, conversation: Conversation):
+        """放入LRU，超出容量时淘汰最久未用且已落盘的会话"""
+        self.conversations[conversation.id] = conversation
+        self.conversations.move_to_end(conversation.id)
+        
+        if len(self.conversations) <= self.max_cached:
+            return
+        for conv_id in list(self.conversations.keys()):
+            if len(self.conversations) <= self.max_cached:
+                break
+            if conv_id == conversation.id:
+                continue
+            # 还有修改未写入存储的会话不能淘汰，否则修改会丢失
+            if self.persister is not None and self.persister.is_pending(conv_id):
+                continue
+            del self.conversations[conv_id]
+    
+    def flush(self):
+        """立即写入所有待保存的修改"""
+        if self.persister is not None:
+            self.persister.flush()
+    
+    def close(self):
+        """写入剩余修改并释放存储（应用关闭时调用）"""
+        if self.persister is not None:
+            self.persister.stop()
+        self.store.close()
     
     def create_conversation(self, query: str) -> Conversation:
         """创建新会话"""
@@ -71,75 +221,206 @@ class ConversationManager:
             search_results=[]
         )
         
-        self.conversations[conversation_id] = conversation
-        self.save_to_file()  # 自动保存
+        self.add_conversation(conversation)
         return conversation
     
+    def add_conversation(self, conversation: Conversation):
+        """加入一个已构造好的会话（如撤销删除时恢复）"""
+        with self._lock:
+            self._cache(conversation)
+            self._update_index(conversation)
+            self._persist(conversation.id, lambda: self.store.upsert_conversation(conversation.model_dump(mode="json")))
+    
     def get_conversation(self, conversation_id: str) -> Optional[Conversation]:
-        """获取会话"""
-        return self.conversations.get(conversation_id)
+        """获取会话（不在内存中时从存储加载）"""
+        with self._lock:
+            conversation = self.conversations.get(conversation_id)
+            if conversation is not None:
+                self.conversations.move_to_end(conversation_id)
+                return conversation
+            
+            if conversation_id not in self._index:
+                return None
+            
+            data = self.store.load_conversation(conversation_id)
+            if data is None:
+                return None
+            try:
+                conversation = Conversation(**data)
+            except Exception as e:
+                print(f"加载会话 {conversation_id} 失败: {e}")
+                return None
+            # 旧数据的版本号可能重复（按列表长度编号），重新编号保证唯一递增
+            numbers = [v.get("version") for v in conversation.report_versions]
+            if any(not isinstance(n, int) for n in numbers) or numbers != sorted(set(numbers)):
+                for i, version in enumerate(conversation.report_versions, start=1):
+                    version["version"] = i
+            self._cache(conversation)
+            return conversation
     
     def add_message(self, conversation_id: str, role: str, content: str, 
                     msg_type: MessageType, metadata: Dict = None) -> Optional[Message]:
         """添加消息到会话"""
-        conversation = self.get_conversation(conversation_id)
-        if not conversation:
-            return None
-        
-        message = Message(
-            id=f"msg_{uuid.uuid4().hex[:8]}",
-            role=role,
-            content=content,
-            type=msg_type,
-            timestamp=datetime.now().isoformat(),
-            metadata=metadata or {}
-        )
-        
-        conversation.messages.append(message)
-        
-        # 限制消息数量，保留最近的
-        if len(conversation.messages) > self.max_messages:
-            conversation.messages = conversation.messages[-self.max_messages:]
-        
-        conversation.updated_at = datetime.now().isoformat()
-        self.save_to_file()  # 自动保存
-        return message
+        with self._lock:
+            conversation = self.get_conversation(conversation_id)
+            if not conversation:
+                return None
+            
+            message = Message(
+                id=f"msg_{uuid.uuid4().hex[:8]}",
+                role=role,
+                content=content,
+                type=msg_type,
+                timestamp=datetime.now().isoformat(),
+                metadata=metadata or {}
+            )
+            
+            conversation.messages.append(message)
+            
+            # 限制消息数量，保留最近的
+            if len(conversation.messages) > self.max_messages:
+                conversation.messages = conversation.messages[-self.max_messages:]
+            
+            conversation.updated_at = datetime.now().isoformat()
+            self._update_index(conversation)
+            
+            def write():
+                self.store.append_message(conversation_id, message.model_dump(mode="json"), self.max_messages)
+                self.store.update_conversation(conversation_id, {"updated_at": conversation.updated_at})
+            
+            self._persist(conversation_id, write)
+            return message
     
     def update_report(self, conversation_id: str, report: str, 
                       operation_type: str = "generate") -> bool:
         """更新报告并保存版本历史"""
-        conversation = self.get_conversation(conversation_id)
-        if not conversation:
-            return False
-        
-        # 保存当前版本到历史
-        if conversation.current_report:
-            version = {
-                "version": len(conversation.report_versions) + 1,
-                "content": conversation.current_report,
-                "timestamp": datetime.now().isoformat(),
-                "operation": operation_type
-            }
-            conversation.report_versions.append(version)
-            
-            # 限制版本数量
-            if len(conversation.report_versions) > self.max_versions:
-                conversation.report_versions = conversation.report_versions[-self.max_versions:]
+        with self._lock:
+            conversation = self.get_conversation(conversation_id)
+            if not conversation:
+                return False
+            
+            # 保存当前版本到历史：只记录从新报告还原旧报告的差异，
+            # 更早的版本依次相对后一个版本存储，淘汰最旧版本不影响其余版本
+            version = None
+            if conversation.current_report:
+                version = {
+                    "version": self._current_version_number(conversation),
+                    "timestamp": datetime.now().isoformat(),
+                    "operation": operation_type
+                }
+                delta = make_report_delta(report, conversation.current_report)
+                if len(json.dumps(delta, ensure_ascii=False)) < len(conversation.current_report):
+                    version["delta"] = delta
+                else:
+                    # 改动很大时差异并不比全文小，直接保存全文
+                    version["content"] = conversation.current_report
+                conversation.report_versions.append(version)
+                
+                # 限制版本数量
+                if len(conversation.report_versions) > self.max_versions:
+                    conversation.report_versions = conversation.report_versions[-self.max_versions:]
+            
+            # 更新当前报告
+            conversation.current_report = report
+            conversation.updated_at = datetime.now().isoformat()
+            self._update_index(conversation)
+            
+            def write():
+                if version is not None:
+                    self.store.append_report_version(conversation_id, version, self.max_versions)
+                self.store.update_conversation(conversation_id, {
+                    "current_report": report,
+                    "updated_at": conversation.updated_at
+                })
+            
+            self._persist(conversation_id, write)
+            return True
+    
+    @staticmethod
+    def _current_version_number(conversation: Conversation) -> int:
+        """当前报告的版本号（历史版本号+1）"""
+        if conversation.report_versions:
+            return conversation.report_versions[-1].get("version", len(conversation.report_versions)) + 1
+        return 1
+    
+    def _reconstruct_versions(self, conversation: Conversation) -> Dict[int, str]:
+        """从当前报告开始向前依次还原所有历史版本，返回 {版本号: 内容}"""
+        contents = {self._current_version_number(conversation): conversation.current_report}
+        newer = conversation.current_report
+        for version in reversed(conversation.report_versions):
+            if "delta" in version:
+                newer = apply_report_delta(newer, version["delta"])
+            else:
+                newer = version.get("content", "")
+            contents[version.get("version")] = newer
+        return contents
+    
+    def list_report_versions(self, conversation_id: str) -> Optional[List[Dict]]:
+        """
+        列出报告的所有版本（含当前版本）
         
-        # 更新当前报告
-        conversation.current_report = report
-        conversation.updated_at = datetime.now().isoformat()
-        self.save_to_file()  # 自动保存
-        return True
+        Returns:
+            版本信息列表（版本号、时间、操作类型、长度），会话不存在时为None
+        """
+        with self._lock:
+            conversation = self.get_conversation(conversation_id)
+            if not conversation:
+                return None
+            contents = self._reconstruct_versions(conversation)
+            versions = [
+                {
+                    "version": v.get("version"),
+                    "timestamp": v.get("timestamp"),
+                    "operation": v.get("operation"),
+                    "length": len(contents[v.get("version")]),
+                    "current": False
+                }
+                for v in conversation.report_versions
+            ]
+            current = self._current_version_number(conversation)
+            versions.append({
+                "version": current,
+                "timestamp": conversation.updated_at,
+                "operation": "current",
+                "length": len(conversation.current_report),
+                "current": True
+            })
+            return versions
+    
+    def get_report_version(self, conversation_id: str, version: int) -> Optional[str]:
+        """获取指定版本的报告全文，会话或版本不存在时返回None"""
+        with self._lock:
+            conversation = self.get_conversation(conversation_id)
+            if not conversation:
+                return None
+            return self._reconstruct_versions(conversation).get(version)
+    
+    def diff_report_versions(self, conversation_id: str, from_version: int, to_version: int) -> Optional[str]:
+        """获取两个版本之间的unified diff，会话或版本不存在时返回None"""
+        with self._lock:
+            conversation = self.get_conversation(conversation_id)
+            if not conversation:
+                return None
+            contents = self._reconstruct_versions(conversation)
+        if from_version not in contents or to_version not in contents:
+            return None
+        return "".join(difflib.unified_diff(
+            contents[from_version].splitlines(keepends=True),
+            contents[to_version].splitlines(keepends=True),
+            fromfile=f"v{from_version}",
+            tofile=f"v{to_version}"
+        ))
     
     def save_search_results(self, conversation_id: str, results: List[Dict]) -> bool:
         """保存搜索结果到会话"""
-        conversation = self.get_conversation(conversation_id)
-        if not conversation:
-            return False
-        
-        conversation.search_results = results
-        return True
+        with self._lock:
+            conversation = self.get_conversation(conversation_id)
+            if not conversation:
+                return False
+            
+            conversation.search_results = results
+            self._persist(conversation_id, lambda: self.store.update_conversation(conversation_id, {"search_results": results}))
+            return True
     
     def get_context_for_llm(self, conversation_id: str, max_tokens: int = 4000) -> Dict:
         """获取用于LLM的上下文信息"""
@@ -167,86 +448,131 @@ class ConversationManager:
         return context
     
     def list_conversations(self) -> List[Dict]:
-        """列出所有会话（用于前端展示列表）"""
-        return [
-            {
-                "id": conv.id,
-                "title": conv.title,
-                "created_at": conv.created_at,
-                "updated_at": conv.updated_at,
-                "message_count": len(conv.messages)
-            }
-            for conv in sorted(
-                self.conversations.values(), 
-                key=lambda x: x.updated_at, 
-                reverse=True
-            )
-        ]
+        """列出所有会话（用于前端展示列表，只读索引）"""
+        with self._lock:
+            return [dict(self._index[conv_id]) for _, conv_id in reversed(self._order)]
+    
+    def list_conversations_page(
+        self,
+        limit: int = 50,
+        cursor: Optional[str] = None,
+        query: Optional[str] = None
+    ) -> Tuple[List[Dict], Optional[str]]:
+        """
+        分页列出会话，按updated_at倒序
+        
+        Args:
+            limit: 每页数量
+            cursor: 上一页返回的游标（None表示第一页）
+            query: 搜索词，在标题、消息和报告中全文搜索（可选）
+            
+        Returns:
+            (本页会话列表, 下一页游标；没有更多时为None)
+        """
+        before = decode_cursor(cursor) if cursor else None
+        
+        if query and query.strip():
+            # 搜索走存储层的全文索引，先写入未落盘的修改
+            self.flush()
+            ids = self.store.search(query.strip(), limit + 1, before)
+            with self._lock:
+                entries = [dict(self._index[conv_id]) for conv_id in ids if conv_id in self._index]
+        else:
+            with self._lock:
+                end = bisect.bisect_left(self._order, before) if before else len(self._order)
+                keys = self._order[max(0, end - limit - 1):end]
+                entries = [dict(self._index[conv_id]) for _, conv_id in reversed(keys)]
+        
+        next_cursor = None
+        if len(entries) > limit:
+            entries = entries[:limit]
+            last = entries[-1]
+            next_cursor = encode_cursor((last["updated_at"], last["id"]))
+        return entries, next_cursor
     
     def delete_conversation(self, conversation_id: str) -> bool:
         """删除会话"""
-        if conversation_id in self.conversations:
-            del self.conversations[conversation_id]
-            self.save_to_file()  # 自动保存
+        with self._lock:
+            if conversation_id not in self._index:
+                return False
+            self._remove_from_order(self._index.pop(conversation_id))
+            self.conversations.pop(conversation_id, None)
+            
+            if self.persister is not None:
+                self.persister.mark_deleted(conversation_id)
+            else:
+                self.store.delete_conversation(conversation_id)
             return True
-        return False
     
     def update_conversation(self, conversation_id: str, updates: Dict) -> bool:
         """更新会话属性（v5.0 新增）"""
-        conversation = self.get_conversation(conversation_id)
-        if not conversation:
-            return False
-        
-        # 更新会话的元数据字段
-        if not hasattr(conversation, 'metadata'):
-            conversation.metadata = {}
-        
-        # 将更新保存到metadata中
-        for key, value in updates.items():
-            conversation.metadata[key] = value
-        
-        conversation.updated_at = datetime.now().isoformat()
-        self.save_to_file()  # 自动保存
-        return True
+        with self._lock:
+            conversation = self.get_conversation(conversation_id)
+            if not conversation:
+                return False
+            
+            # 更新会话的元数据字段
+            if not hasattr(conversation, 'metadata'):
+                conversation.metadata = {}
+            
+            # 将更新保存到metadata中
+            for key, value in updates.items():
+                conversation.metadata[key] = value
+            
+            conversation.updated_at = datetime.now().isoformat()
+            self._update_index(conversation)
+            
+            self._persist(conversation_id, lambda: self.store.update_conversation(conversation_id, {
+                "metadata": conversation.metadata,
+                "updated_at": conversation.updated_at
+            }))
+            return True
     
     def to_dict(self) -> Dict:
-        """导出所有会话为字典（用于序列化）"""
-        return {
-            conv_id: conv.model_dump()
-            for conv_id, conv in self.conversations.items()
-        }
+        """导出所有会话为字典（用于序列化，会逐个加载全部会话）"""
+        result = {}
+        for conv_id in list(self._index.keys()):
+            conv = self.get_conversation(conv_id)
+            if conv is not None:
+                result[conv_id] = conv.model_dump()
+        return result
     
     def load_from_dict(self, data: Dict):
         """从字典加载会话（用于反序列化）"""
-        self.conversations = {}
-        for conv_id, conv_data in data.items():
-            try:
-                self.conversations[conv_id] = Conversation(**conv_data)
-            except Exception as e:
-                print(f"加载会话 {conv_id} 失败: {e}")
+        with self._lock:
+            self.conversations = OrderedDict()
+            self._index = {}
+            self._order = []
+            for conv_id, conv_data in data.items():
+                try:
+                    conversation = Conversation(**conv_data)
+                except Exception as e:
+                    print(f"加载会话 {conv_id} 失败: {e}")
+                    continue
+                self._cache(conversation)
+                self._update_index(conversation)
 
     def save_to_file(self):
-        """保存所有会话到文件"""
+        """把内存中的所有会话完整写入存储（日常修改已自动持久化，无需调用）"""
         try:
-            data = self.to_dict()
-            with open(self.storage_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            with self._lock:
+                conversations = [conv.model_dump(mode="json") for conv in self.conversations.values()]
+            self.store.write_batch(conversations, [])
             return True
         except Exception as e:
-            print(f"保存会话到文件失败: {e}")
+            print(f"保存会话失败: {e}")
             return False
 
     def load_from_file(self):
-        """从文件加载所有会话"""
-        if not os.path.exists(self.storage_file):
-            return
+        """从存储加载会话索引，会话内容在首次访问时加载"""
         try:
-            with open(self.storage_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            self.load_from_dict(data)
-            print(f"从文件加载了 {len(self.conversations)} 个会话")
+            with self._lock:
+                self.conversations = OrderedDict()
+                self._index = {entry["id"]: entry for entry in self.store.load_index()}
+                self._order = sorted((entry["updated_at"], entry["id"]) for entry in self._index.values())
+            print(f"从存储加载了 {len(self._index)} 个会话索引")
         except Exception as e:
-            print(f"从文件加载会话失败: {e}")
+            print(f"加载会话失败: {e}")
 
 
 # 全局对话管理器实例
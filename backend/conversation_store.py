@@ -0,0 +1,729 @@
+"""
+会话存储后端 - ConversationManager的持久化层
+
+存储层只处理普通字典（Conversation.model_dump()的结构），不依赖conversation模块。
+- JsonConversationStore: 旧方式，所有会话写入单个JSON文件，每次修改整体重写
+- SqliteConversationStore: 会话、消息、报告版本分表存储（WAL模式），每次修改只写相关行
+- WriteBehindPersister: 后台线程合并写入，请求路径只标记脏会话
+"""
+import atexit
+import copy
+import json
+import logging
+import os
+import sqlite3
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# trigram分词要求每个词至少3个字符，更短的词退回LIKE匹配
+_FTS_MIN_TERM_LENGTH = 3
+
+# conversations表中直接存储的字段（其余为JSON列）
+_CONVERSATION_COLUMNS = ("title", "created_at", "updated_at", "current_report")
+_CONVERSATION_JSON_COLUMNS = ("search_results", "metadata")
+
+
+class ConversationStore:
+    """会话存储接口"""
+
+    def load_all(self) -> Dict[str, Dict[str, Any]]:
+        """加载全部会话，返回 {conversation_id: 会话字典}"""
+        raise NotImplementedError
+
+    def load_index(self) -> List[Dict[str, Any]]:
+        """加载会话索引（id、title、created_at、updated_at、message_count），不含会话内容"""
+        raise NotImplementedError
+
+    def load_conversation(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        """加载单个完整会话，不存在时返回None"""
+        raise NotImplementedError
+
+    def search(self, query: str, limit: int, before: Optional[Tuple[str, str]] = None) -> List[str]:
+        """
+        在标题、消息和当前报告中全文搜索
+
+        Args:
+            query: 搜索词（空白分隔的多个词需同时命中）
+            limit: 最多返回的会话数
+            before: 游标 (updated_at, id)，只返回排在其后的会话
+
+        Returns:
+            会话ID列表，按updated_at倒序
+        """
+        raise NotImplementedError
+
+    def upsert_conversation(self, conversation: Dict[str, Any]):
+        """写入完整会话（含消息和报告版本），已存在时整体替换"""
+        raise NotImplementedError
+
+    def update_conversation(self, conversation_id: str, fields: Dict[str, Any]):
+        """更新会话自身字段（title/updated_at/current_report/search_results/metadata）"""
+        raise NotImplementedError
+
+    def append_message(self, conversation_id: str, message: Dict[str, Any], keep_last: int):
+        """追加一条消息，只保留最近keep_last条"""
+        raise NotImplementedError
+
+    def append_report_version(self, conversation_id: str, version: Dict[str, Any], keep_last: int):
+        """追加一个报告历史版本，只保留最近keep_last个"""
+        raise NotImplementedError
+
+    def delete_conversation(self, conversation_id: str):
+        """删除会话及其消息和版本"""
+        raise NotImplementedError
+
+    def write_batch(self, upserts: List[Dict[str, Any]], deletes: List[str]):
+        """批量写入完整会话并删除会话（后台合并写入使用）"""
+        for conversation in upserts:
+            self.upsert_conversation(conversation)
+        for conversation_id in deletes:
+            self.delete_conversation(conversation_id)
+
+    def close(self):
+        """释放资源"""
+
+
+class JsonConversationStore(ConversationStore):
+    """单文件JSON存储（兼容旧版本），每次修改重写整个文件"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._data: Dict[str, Dict[str, Any]] = {}
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self._data = json.load(f)
+
+    def load_all(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            self._ensure_loaded()
+            return {conv_id: copy.deepcopy(conv) for conv_id, conv in self._data.items()}
+
+    def load_index(self) -> List[Dict[str, Any]]:
+        # 单文件格式无法只读索引，整个文件仍需解析一次
+        with self._lock:
+            self._ensure_loaded()
+            return [
+                {
+                    "id": conv.get("id", conv_id),
+                    "title": conv.get("title", ""),
+                    "created_at": conv.get("created_at", ""),
+                    "updated_at": conv.get("updated_at", ""),
+                    "message_count": len(conv.get("messages") or [])
+                }
+                for conv_id, conv in self._data.items()
+            ]
+
+    def load_conversation(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            self._ensure_loaded()
+            conversation = self._data.get(conversation_id)
+            return copy.deepcopy(conversation) if conversation is not None else None
+
+    def search(self, query: str, limit: int, before: Optional[Tuple[str, str]] = None) -> List[str]:
+        terms = query.lower().split()
+        matches = []
+        with self._lock:
+            self._ensure_loaded()
+            for conv_id, conv in self._data.items():
+                key = (conv.get("updated_at", ""), conv.get("id", conv_id))
+                if before is not None and key >= tuple(before):
+                    continue
+                text = "\n".join([
+                    conv.get("title", ""),
+                    conv.get("current_report", ""),
+                    *(m.get("content", "") for m in conv.get("messages") or [])
+                ]).lower()
+                if all(term in text for term in terms):
+                    matches.append(key)
+        matches.sort(reverse=True)
+        return [conv_id for _, conv_id in matches[:limit]]
+
+    def _flush(self):
+        # 先写临时文件再替换，避免写到一半时进程退出导致文件损坏
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def upsert_conversation(self, conversation: Dict[str, Any]):
+        with self._lock:
+            self._data[conversation["id"]] = conversation
+            self._flush()
+
+    def update_conversation(self, conversation_id: str, fields: Dict[str, Any]):
+        with self._lock:
+            if conversation_id in self._data:
+                self._data[conversation_id].update(fields)
+                self._flush()
+
+    def append_message(self, conversation_id: str, message: Dict[str, Any], keep_last: int):
+        with self._lock:
+            conversation = self._data.get(conversation_id)
+            if conversation is None:
+                return
+            messages = conversation.setdefault("messages", [])
+            messages.append(message)
+            conversation["messages"] = messages[-keep_last:]
+            self._flush()
+
+    def append_report_version(self, conversation_id: str, version: Dict[str, Any], keep_last: int):
+        with self._lock:
+            conversation = self._data.get(conversation_id)
+            if conversation is None:
+                return
+            versions = conversation.setdefault("report_versions", [])
+            versions.append(version)
+            conversation["report_versions"] = versions[-keep_last:]
+            self._flush()
+
+    def delete_conversation(self, conversation_id: str):
+        with self._lock:
+            if self._data.pop(conversation_id, None) is not None:
+                self._flush()
+
+    def write_batch(self, upserts: List[Dict[str, Any]], deletes: List[str]):
+        with self._lock:
+            for conversation in upserts:
+                self._data[conversation["id"]] = conversation
+            for conversation_id in deletes:
+                self._data.pop(conversation_id, None)
+            self._flush()
+
+
+class SqliteConversationStore(ConversationStore):
+    """SQLite存储：conversations / messages / report_versions 三张表"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("PRAGMA foreign_keys=ON")
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS conversations (
+                id TEXT PRIMARY KEY,
+                title TEXT NOT NULL,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL,
+                current_report TEXT NOT NULL DEFAULT '',
+                search_results TEXT NOT NULL DEFAULT '[]',
+                metadata TEXT NOT NULL DEFAULT '{}'
+            );
+            CREATE TABLE IF NOT EXISTS messages (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                conversation_id TEXT NOT NULL REFERENCES conversations(id) ON DELETE CASCADE,
+                id TEXT NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                type TEXT NOT NULL,
+                timestamp TEXT NOT NULL,
+                metadata TEXT NOT NULL DEFAULT '{}'
+            );
+            CREATE INDEX IF NOT EXISTS idx_messages_conversation ON messages(conversation_id, seq);
+            CREATE TABLE IF NOT EXISTS report_versions (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                conversation_id TEXT NOT NULL REFERENCES conversations(id) ON DELETE CASCADE,
+                version INTEGER NOT NULL,
+                content TEXT NOT NULL,
+                timestamp TEXT NOT NULL,
+                operation TEXT NOT NULL,
+                delta TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_versions_conversation ON report_versions(conversation_id, seq);
+            CREATE INDEX IF NOT EXISTS idx_conversations_updated ON conversations(updated_at, id);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            """
+        )
+        # 旧库的report_versions没有delta列
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(report_versions)")]
+        if "delta" not in columns:
+            self._db.execute("ALTER TABLE report_versions ADD COLUMN delta TEXT")
+        self._db.commit()
+        self._fts = self._init_fts()
+
+    def _init_fts(self) -> bool:
+        """
+        创建全文索引（FTS5 trigram分词，支持中文子串搜索），由触发器与数据表保持同步
+
+        FTS行号: 会话标题+当前报告为 rowid*2+1，消息为 seq*2
+        """
+        exists = self._db.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'conversation_fts'"
+        ).fetchone() is not None
+        try:
+            with self._db:
+                self._db.executescript(
+                    """
+                    CREATE VIRTUAL TABLE IF NOT EXISTS conversation_fts
+                        USING fts5(conversation_id UNINDEXED, content, tokenize='trigram');
+                    CREATE TRIGGER IF NOT EXISTS conversations_fts_ai AFTER INSERT ON conversations BEGIN
+                        INSERT INTO conversation_fts (rowid, conversation_id, content)
+                        VALUES (new.rowid * 2 + 1, new.id, new.title || char(10) || new.current_report);
+                    END;
+                    CREATE TRIGGER IF NOT EXISTS conversations_fts_au AFTER UPDATE OF title, current_report ON conversations BEGIN
+                        DELETE FROM conversation_fts WHERE rowid = old.rowid * 2 + 1;
+                        INSERT INTO conversation_fts (rowid, conversation_id, content)
+                        VALUES (new.rowid * 2 + 1, new.id, new.title || char(10) || new.current_report);
+                    END;
+                    CREATE TRIGGER IF NOT EXISTS conversations_fts_ad AFTER DELETE ON conversations BEGIN
+                        DELETE FROM conversation_fts WHERE rowid = old.rowid * 2 + 1;
+                    END;
+                    CREATE TRIGGER IF NOT EXISTS messages_fts_ai AFTER INSERT ON messages BEGIN
+                        INSERT INTO conversation_fts (rowid, conversation_id, content)
+                        VALUES (new.seq * 2, new.conversation_id, new.content);
+                    END;
+                    CREATE TRIGGER IF NOT EXISTS messages_fts_ad AFTER DELETE ON messages BEGIN
+                        DELETE FROM conversation_fts WHERE rowid = old.seq * 2;
+                    END;
+                    """
+                )
+                if not exists:
+                    # 已有数据库首次建立索引时补齐历史数据
+                    self._db.execute(
+                        "INSERT INTO conversation_fts (rowid, conversation_id, content) "
+                        "SELECT rowid * 2 + 1, id, title || char(10) || current_report FROM conversations"
+                    )
+                    self._db.execute(
+                        "INSERT INTO conversation_fts (rowid, conversation_id, content) "
+                        "SELECT seq * 2, conversation_id, content FROM messages"
+                    )
+            return True
+        except sqlite3.OperationalError as e:
+            logger.warning(f"SQLite不支持FTS5 trigram，会话搜索使用LIKE匹配: {e}")
+            return False
+
+    def is_empty(self) -> bool:
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM conversations LIMIT 1").fetchone() is None
+
+    def get_meta(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: str):
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    @staticmethod
+    def _message_row(conversation_id: str, message: Dict[str, Any]) -> tuple:
+        return (
+            conversation_id, message["id"], message["role"], message["content"],
+            message["type"], message["timestamp"],
+            json.dumps(message.get("metadata") or {}, ensure_ascii=False)
+        )
+
+    @staticmethod
+    def _version_row(conversation_id: str, version: Dict[str, Any]) -> tuple:
+        # 差异版本content为空，delta保存JSON格式的差异
+        delta = version.get("delta")
+        return (
+            conversation_id, version.get("version", 0), version.get("content", ""),
+            version.get("timestamp", ""), version.get("operation", ""),
+            json.dumps(delta, ensure_ascii=False, separators=(',', ':')) if delta is not None else None
+        )
+
+    def _load(self, conversation_id: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+        """加载全部会话，或指定conversation_id的单个会话"""
+        where, params = ("", ()) if conversation_id is None else (" WHERE id = ?", (conversation_id,))
+        child_where = "" if conversation_id is None else " WHERE conversation_id = ?"
+        conversations: Dict[str, Dict[str, Any]] = {}
+        with self._lock:
+            for row in self._db.execute(
+                "SELECT id, title, created_at, updated_at, current_report, search_results, metadata "
+                f"FROM conversations{where}", params
+            ):
+                conversations[row[0]] = {
+                    "id": row[0],
+                    "title": row[1],
+                    "created_at": row[2],
+                    "updated_at": row[3],
+                    "current_report": row[4],
+                    "search_results": json.loads(row[5]),
+                    "metadata": json.loads(row[6]),
+                    "messages": [],
+                    "report_versions": []
+                }
+            if not conversations:
+                return conversations
+
+            for row in self._db.execute(
+                "SELECT conversation_id, id, role, content, type, timestamp, metadata "
+                f"FROM messages{child_where} ORDER BY seq", params
+            ):
+                conversation = conversations.get(row[0])
+                if conversation is not None:
+                    conversation["messages"].append({
+                        "id": row[1],
+                        "role": row[2],
+                        "content": row[3],
+                        "type": row[4],
+                        "timestamp": row[5],
+                        "metadata": json.loads(row[6])
+                    })
+
+            for row in self._db.execute(
+                "SELECT conversation_id, version, content, timestamp, operation, delta "
+                f"FROM report_versions{child_where} ORDER BY seq", params
+            ):
+                conversation = conversations.get(row[0])
+                if conversation is not None:
+                    version = {
+                        "version": row[1],
+                        "timestamp": row[3],
+                        "operation": row[4]
+                    }
+                    if row[5] is not None:
+                        version["delta"] = json.loads(row[5])
+                    else:
+                        version["content"] = row[2]
+                    conversation["report_versions"].append(version)
+
+        return conversations
+
+    def load_all(self) -> Dict[str, Dict[str, Any]]:
+        return self._load()
+
+    def load_conversation(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        return self._load(conversation_id).get(conversation_id)
+
+    def load_index(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT c.id, c.title, c.created_at, c.updated_at, "
+                "(SELECT COUNT(*) FROM messages m WHERE m.conversation_id = c.id) "
+                "FROM conversations c"
+            ).fetchall()
+        return [
+            {"id": r[0], "title": r[1], "created_at": r[2], "updated_at": r[3], "message_count": r[4]}
+            for r in rows
+        ]
+
+    def search(self, query: str, limit: int, before: Optional[Tuple[str, str]] = None) -> List[str]:
+        terms = query.split()
+        if not terms:
+            return []
+
+        if self._fts and all(len(term) >= _FTS_MIN_TERM_LENGTH for term in terms):
+            # 每个词作为短语匹配，多个词同时命中
+            match = " ".join('"' + term.replace('"', '""') + '"' for term in terms)
+            candidates = "SELECT conversation_id FROM conversation_fts WHERE conversation_fts MATCH ?"
+            conditions = [f"c.id IN ({candidates})"]
+            params: List[Any] = [match]
+        else:
+            conditions = []
+            params = []
+            for term in terms:
+                pattern = "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+                conditions.append(
+                    "(c.title LIKE ? ESCAPE '\\' OR c.current_report LIKE ? ESCAPE '\\' OR EXISTS ("
+                    "SELECT 1 FROM messages m WHERE m.conversation_id = c.id AND m.content LIKE ? ESCAPE '\\'))"
+                )
+                params.extend([pattern, pattern, pattern])
+
+        if before is not None:
+            conditions.append("(c.updated_at, c.id) < (?, ?)")
+            params.extend(before)
+
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT c.id FROM conversations c WHERE {' AND '.join(conditions)} "
+                "ORDER BY c.updated_at DESC, c.id DESC LIMIT ?",
+                [*params, limit]
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def _upsert(self, conversation: Dict[str, Any]):
+        """
+        在当前事务内写入完整会话
+
+        消息和报告版本写入后不再修改，只删除已被截断的行、插入新增的行；
+        标题和当前报告有变化时才更新，避免无关的全文索引重建
+        """
+        conversation_id = conversation["id"]
+        fields = {
+            "title": conversation.get("title", ""),
+            "created_at": conversation.get("created_at", ""),
+            "updated_at": conversation.get("updated_at", ""),
+            "current_report": conversation.get("current_report", ""),
+            "search_results": json.dumps(conversation.get("search_results") or [], ensure_ascii=False),
+            "metadata": json.dumps(conversation.get("metadata") or {}, ensure_ascii=False)
+        }
+        stored = self._db.execute(
+            "SELECT title, current_report FROM conversations WHERE id = ?", (conversation_id,)
+        ).fetchone()
+        if stored is None:
+            self._db.execute(
+                f"INSERT INTO conversations (id, {', '.join(fields)}) VALUES (?{', ?' * len(fields)})",
+                [conversation_id, *fields.values()]
+            )
+        else:
+            if (fields["title"], fields["current_report"]) == tuple(stored):
+                del fields["title"], fields["current_report"]
+            self._db.execute(
+                f"UPDATE conversations SET {', '.join(f'{key} = ?' for key in fields)} WHERE id = ?",
+                [*fields.values(), conversation_id]
+            )
+
+        messages = conversation.get("messages") or []
+        self._sync_rows(
+            "messages", "id", conversation_id, [m["id"] for m in messages],
+            "INSERT INTO messages (conversation_id, id, role, content, type, timestamp, metadata) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            {m["id"]: self._message_row(conversation_id, m) for m in messages}
+        )
+        versions = conversation.get("report_versions") or []
+        self._sync_rows(
+            "report_versions", "version", conversation_id, [v.get("version", 0) for v in versions],
+            "INSERT INTO report_versions (conversation_id, version, content, timestamp, operation, delta) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            {v.get("version", 0): self._version_row(conversation_id, v) for v in versions}
+        )
+
+    def _sync_rows(
+        self,
+        table: str,
+        key_column: str,
+        conversation_id: str,
+        keys: List[Any],
+        insert_sql: str,
+        rows: Dict[Any, tuple]
+    ):
+        """按键比较已存储的行：删除不再保留的行，按顺序插入新增的行"""
+        stored = self._db.execute(
+            f"SELECT seq, {key_column} FROM {table} WHERE conversation_id = ? ORDER BY seq", (conversation_id,)
+        ).fetchall()
+        wanted = set(keys)
+        kept = [key for _, key in stored if key in wanted]
+        if kept != keys[:len(kept)]:
+            # 键重复或被重新编号（旧数据），整体重写
+            stored = []
+            self._db.execute(f"DELETE FROM {table} WHERE conversation_id = ?", (conversation_id,))
+        stale = [(seq,) for seq, key in stored if key not in wanted]
+        if stale:
+            self._db.executemany(f"DELETE FROM {table} WHERE seq = ?", stale)
+        existing = {key for _, key in stored}
+        new_rows = [rows[key] for key in keys if key not in existing]
+        if new_rows:
+            self._db.executemany(insert_sql, new_rows)
+
+    def upsert_conversation(self, conversation: Dict[str, Any]):
+        with self._lock, self._db:
+            self._upsert(conversation)
+
+    def import_conversations(self, conversations: List[Dict[str, Any]]):
+        """在一个事务内批量写入（用于迁移）"""
+        with self._lock, self._db:
+            for conversation in conversations:
+                self._upsert(conversation)
+
+    def update_conversation(self, conversation_id: str, fields: Dict[str, Any]):
+        assignments = []
+        values = []
+        for key, value in fields.items():
+            if key in _CONVERSATION_COLUMNS:
+                values.append(value)
+            elif key in _CONVERSATION_JSON_COLUMNS:
+                values.append(json.dumps(value, ensure_ascii=False))
+            else:
+                continue
+            assignments.append(f"{key} = ?")
+        if not assignments:
+            return
+        with self._lock, self._db:
+            self._db.execute(
+                f"UPDATE conversations SET {', '.join(assignments)} WHERE id = ?",
+                [*values, conversation_id]
+            )
+
+    def append_message(self, conversation_id: str, message: Dict[str, Any], keep_last: int):
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT INTO messages (conversation_id, id, role, content, type, timestamp, metadata) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                self._message_row(conversation_id, message)
+            )
+            self._db.execute(
+                "DELETE FROM messages WHERE conversation_id = ? AND seq NOT IN ("
+                "SELECT seq FROM messages WHERE conversation_id = ? ORDER BY seq DESC LIMIT ?)",
+                (conversation_id, conversation_id, keep_last)
+            )
+
+    def append_report_version(self, conversation_id: str, version: Dict[str, Any], keep_last: int):
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT INTO report_versions (conversation_id, version, content, timestamp, operation, delta) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                self._version_row(conversation_id, version)
+            )
+            self._db.execute(
+                "DELETE FROM report_versions WHERE conversation_id = ? AND seq NOT IN ("
+                "SELECT seq FROM report_versions WHERE conversation_id = ? ORDER BY seq DESC LIMIT ?)",
+                (conversation_id, conversation_id, keep_last)
+            )
+
+    def delete_conversation(self, conversation_id: str):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM conversations WHERE id = ?", (conversation_id,))
+
+    def write_batch(self, upserts: List[Dict[str, Any]], deletes: List[str]):
+        with self._lock, self._db:
+            for conversation in upserts:
+                self._upsert(conversation)
+            for conversation_id in deletes:
+                self._db.execute("DELETE FROM conversations WHERE id = ?", (conversation_id,))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class WriteBehindPersister:
+    """
+    会话后台合并写入
+
+    请求路径只调用mark_dirty/mark_deleted，后台线程每隔interval秒，或脏会话数达到
+    batch_size时，取各会话的最新快照在一个批次内写入存储。同一会话的多次修改合并为一次写入。
+    """
+
+    def __init__(
+        self,
+        store: ConversationStore,
+        snapshot: Callable[[str], Optional[Dict[str, Any]]],
+        interval: float = 1.0,
+        batch_size: int = 20
+    ):
+        """
+        Args:
+            store: 底层存储
+            snapshot: 根据conversation_id返回会话当前字典（已删除返回None）
+            interval: 刷新间隔（秒）
+            batch_size: 脏会话达到该数量时立即刷新
+        """
+        self.store = store
+        self.snapshot = snapshot
+        self.interval = interval
+        self.batch_size = batch_size
+        self._dirty: set = set()
+        self._deleted: set = set()
+        self._inflight: set = set()  # 正在写入的会话
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="conversation-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def mark_dirty(self, conversation_id: str):
+        with self._lock:
+            self._deleted.discard(conversation_id)
+            self._dirty.add(conversation_id)
+            pending = len(self._dirty)
+        if pending >= self.batch_size:
+            self._wakeup.set()
+
+    def mark_deleted(self, conversation_id: str):
+        with self._lock:
+            self._dirty.discard(conversation_id)
+            self._deleted.add(conversation_id)
+
+    def is_pending(self, conversation_id: str) -> bool:
+        """会话是否还有未写入存储的修改"""
+        with self._lock:
+            return conversation_id in self._dirty or conversation_id in self._inflight
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._dirty) + len(self._deleted)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self) -> int:
+        """把当前所有脏会话写入存储，返回写入的会话数"""
+        with self._flush_lock:
+            with self._lock:
+                dirty, self._dirty = self._dirty, set()
+                deleted, self._deleted = self._deleted, set()
+                self._inflight = set(dirty)
+            if not dirty and not deleted:
+                return 0
+
+            upserts = []
+            for conversation_id in dirty:
+                conversation = self.snapshot(conversation_id)
+                if conversation is not None:
+                    upserts.append(conversation)
+
+            try:
+                self.store.write_batch(upserts, list(deleted))
+            except Exception as e:
+                logger.error(f"会话写入失败，稍后重试: {e}")
+                with self._lock:
+                    # 失败的会话重新标记，期间又有新修改的以新状态为准
+                    self._dirty |= dirty - self._deleted
+                    self._deleted |= deleted - self._dirty
+                return 0
+            finally:
+                with self._lock:
+                    self._inflight = set()
+
+            return len(upserts) + len(deleted)
+
+    def stop(self):
+        """停止后台线程并写入剩余的修改（应用关闭时调用）"""
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        self._wakeup.set()
+        self._thread.join(timeout=5)
+        self.flush()
+
+
+def migrate_json_to_sqlite(json_path: str, store: SqliteConversationStore) -> int:
+    """
+    把旧版conversations.json一次性导入SQLite
+
+    只在SQLite库为空且尚未迁移过时执行，原JSON文件保持不变
+
+    Args:
+        json_path: 旧JSON文件路径
+        store: 目标SQLite存储
+
+    Returns:
+        导入的会话数
+    """
+    if store.get_meta("migrated_from") is not None or not store.is_empty():
+        return 0
+    if not os.path.exists(json_path):
+        store.set_meta("migrated_from", "")
+        return 0
+
+    with open(json_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    conversations = []
+    for conv_id, conversation in data.items():
+        if isinstance(conversation, dict):
+            conversations.append({**conversation, "id": conversation.get("id", conv_id)})
+
+    store.import_conversations(conversations)
+    store.set_meta("migrated_from", os.path.abspath(json_path))
+    logger.info(f"已从 {json_path} 迁移 {len(conversations)} 个会话到 {store.db_path}")
+    return len(conversations)
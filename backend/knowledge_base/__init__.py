@@ -5,7 +5,8 @@
 
 from .models import Document, DocumentChunk, KnowledgeBase
 from .document_parser import DocumentParser
-from .vector_store import VectorStore
+from .vector_store import VectorStore, create_vector_store
+from .numpy_vector_store import NumpyVectorStore
 from .relevance_checker import RelevanceChecker
 from .knowledge_base_manager import KnowledgeBaseManager, knowledge_base_manager
 
@@ -15,6 +16,8 @@ __all__ = [
     'KnowledgeBase',
     'DocumentParser',
     'VectorStore',
+    'NumpyVectorStore',
+    'create_vector_store',
     'RelevanceChecker',
     'KnowledgeBaseManager',
     'knowledge_base_manager'
@@ -0,0 +1,185 @@
+"""
+嵌入向量缓存模块
+以(模型名, 文本sha256)为键缓存嵌入向量，SQLite持久化 + 内存LRU
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import logging
+
+from backend.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingCache:
+    """嵌入向量缓存类"""
+
+    def __init__(self, db_path: Optional[str] = None, max_memory_entries: int = 4096):
+        """
+        初始化嵌入缓存
+
+        Args:
+            db_path: SQLite文件路径（None表示仅使用内存）
+            max_memory_entries: 内存LRU最多保留的向量数
+        """
+        self.max_memory_entries = max_memory_entries
+        self.hits = 0
+        self.misses = 0
+        # 内存中以float32数组保存，节省内存
+        self._memory: "OrderedDict[tuple, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._model: Optional[str] = None
+
+        if db_path:
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "model TEXT NOT NULL, text_hash TEXT NOT NULL, vector BLOB NOT NULL, "
+                "PRIMARY KEY (model, text_hash))"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+            )
+            self._db.commit()
+
+    @staticmethod
+    def _hash(text: str) -> str:
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def bind_model(self, model: str):
+        """
+        绑定当前使用的嵌入模型
+
+        模型与上次记录的不同时，清除其他模型的缓存向量
+        """
+        with self._lock:
+            if self._model == model:
+                return
+            self._model = model
+            self._memory = OrderedDict((k, v) for k, v in self._memory.items() if k[0] == model)
+
+            if self._db is None:
+                return
+            row = self._db.execute("SELECT value FROM meta WHERE key = 'model'").fetchone()
+            if row and row[0] != model:
+                deleted = self._db.execute(
+                    "DELETE FROM embeddings WHERE model != ?", (model,)
+                ).rowcount
+                logger.info(f"嵌入模型已变更 ({row[0]} -> {model})，清除 {deleted} 条缓存向量")
+            self._db.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('model', ?)", (model,)
+            )
+            self._db.commit()
+
+    def _remember(self, key: tuple, vector: np.ndarray):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def get_many(self, model: str, texts: List[str]) -> List[Optional[List[float]]]:
+        """
+        批量读取缓存
+
+        Returns:
+            与texts等长的列表，未命中的位置为None
+        """
+        keys = [(model, self._hash(text)) for text in texts]
+        results: List[Optional[List[float]]] = [None] * len(texts)
+        missing: Dict[str, List[int]] = {}
+
+        with self._lock:
+            for i, key in enumerate(keys):
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    results[i] = vector.tolist()
+                else:
+                    missing.setdefault(key[1], []).append(i)
+
+            if missing and self._db is not None:
+                hashes = list(missing.keys())
+                # 分批查询，避免超过SQLite参数上限
+                for start in range(0, len(hashes), 500):
+                    part = hashes[start:start + 500]
+                    placeholders = ",".join("?" * len(part))
+                    rows = self._db.execute(
+                        f"SELECT text_hash, vector FROM embeddings "
+                        f"WHERE model = ? AND text_hash IN ({placeholders})",
+                        [model, *part]
+                    ).fetchall()
+                    for text_hash, blob in rows:
+                        vector = np.frombuffer(blob, dtype=np.float32)
+                        self._remember((model, text_hash), vector)
+                        for i in missing.pop(text_hash):
+                            results[i] = vector.tolist()
+
+            miss_count = sum(len(positions) for positions in missing.values())
+            self.hits += len(texts) - miss_count
+            self.misses += miss_count
+
+        return results
+
+    def get(self, model: str, text: str) -> Optional[List[float]]:
+        """读取单条缓存"""
+        return self.get_many(model, [text])[0]
+
+    def set_many(self, model: str, texts: List[str], embeddings: List[List[float]]):
+        """批量写入缓存"""
+        if not texts:
+            return
+        rows = []
+        with self._lock:
+            for text, embedding in zip(texts, embeddings):
+                key = (model, self._hash(text))
+                vector = np.asarray(embedding, dtype=np.float32)
+                self._remember(key, vector)
+                rows.append((model, key[1], vector.tobytes()))
+
+            if self._db is not None:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO embeddings (model, text_hash, vector) VALUES (?, ?, ?)",
+                    rows
+                )
+                self._db.commit()
+
+    def set(self, model: str, text: str, embedding: List[float]):
+        """写入单条缓存"""
+        self.set_many(model, [text], [embedding])
+
+    def stats(self) -> Dict[str, Any]:
+        """命中统计"""
+        total = self.hits + self.misses
+        stored = None
+        if self._db is not None:
+            with self._lock:
+                stored = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        return {
+            "model": self._model,
+            "memory_entries": len(self._memory),
+            "stored_entries": stored,
+            "persistent": self._db is not None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0
+        }
+
+
+# 全局嵌入缓存实例（多个VectorStore共享）
+embedding_cache = (
+    EmbeddingCache(
+        db_path=settings.embedding_cache_db_path or None,
+        max_memory_entries=settings.embedding_cache_memory_entries
+    )
+    if settings.embedding_cache_enabled else None
+)
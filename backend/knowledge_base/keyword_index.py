@@ -0,0 +1,160 @@
+"""
+关键词倒排索引模块
+中文按字二元组切分、英文和数字按词切分，BM25打分；
+与向量检索结果通过RRF（倒数排名融合）合并
+"""
+
+import heapq
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from .models import DocumentChunk
+
+# 连续的汉字，或英文/数字单词（允许 gpt-4o、v1.5 这类连接符）
+_TOKEN_RE = re.compile(r'[\u3400-\u4dbf\u4e00-\u9fff]+|[a-z0-9]+(?:[._-][a-z0-9]+)*')
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    中文感知的分词：汉字序列切成相邻二字组（单字序列保留单字），英文和数字按词
+
+    Args:
+        text: 文本
+
+    Returns:
+        词项列表（保留重复，用于词频统计）
+    """
+    tokens = []
+    for match in _TOKEN_RE.finditer(text.lower()):
+        run = match.group()
+        if run[0].isascii():
+            tokens.append(run)
+        elif len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def reciprocal_rank_fusion(rankings: Iterable[List[str]], k: int = 60) -> List[Tuple[str, float]]:
+    """
+    倒数排名融合：score = Σ 1 / (k + rank)
+
+    Args:
+        rankings: 多路检索结果的ID列表（各自按相关度降序）
+        k: 平滑常数，越大排名靠后的结果权重越接近靠前的结果
+
+    Returns:
+        (ID, 融合分数) 列表，按分数降序
+    """
+    scores: Dict[str, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, item_id in enumerate(ranking, start=1):
+            scores[item_id] += 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda x: x[1], reverse=True)
+
+
+class KeywordIndex:
+    """基于BM25的内存倒排索引（chunk级别）"""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        """
+        初始化关键词索引
+
+        Args:
+            k1: 词频饱和参数
+            b: 文档长度归一化参数
+        """
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Dict[str, int]] = defaultdict(dict)  # 词项 -> {chunk_id: 词频}
+        self._chunk_length: Dict[str, int] = {}
+        self._chunk_terms: Dict[str, Tuple[str, ...]] = {}  # 删除时定位倒排表
+        self._chunk_document: Dict[str, str] = {}
+        self._document_chunks: Dict[str, List[str]] = defaultdict(list)
+        self._total_length = 0
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._chunk_length)
+
+    def add_chunks(self, chunks: Iterable[DocumentChunk]):
+        """把文档块加入索引（已存在的chunk_id会先移除）"""
+        with self._lock:
+            for chunk in chunks:
+                self.add(chunk.chunk_id, chunk.document_id, chunk.content)
+
+    def add(self, chunk_id: str, document_id: str, text: str):
+        """索引单个文档块"""
+        with self._lock:
+            if chunk_id in self._chunk_length:
+                self._remove_chunk(chunk_id)
+            counts = Counter(tokenize(text))
+            for term, tf in counts.items():
+                self._postings[term][chunk_id] = tf
+            length = sum(counts.values())
+            self._chunk_length[chunk_id] = length
+            self._chunk_terms[chunk_id] = tuple(counts)
+            self._chunk_document[chunk_id] = document_id
+            self._document_chunks[document_id].append(chunk_id)
+            self._total_length += length
+
+    def remove_document(self, document_id: str):
+        """移除文档的全部块"""
+        with self._lock:
+            for chunk_id in self._document_chunks.pop(document_id, []):
+                self._remove_chunk(chunk_id)
+
+    def _remove_chunk(self, chunk_id: str):
+        for term in self._chunk_terms.pop(chunk_id, ()):
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(chunk_id, None)
+                if not postings:
+                    del self._postings[term]
+        self._total_length -= self._chunk_length.pop(chunk_id, 0)
+        document_id = self._chunk_document.pop(chunk_id, None)
+        siblings = self._document_chunks.get(document_id)
+        if siblings and chunk_id in siblings:
+            siblings.remove(chunk_id)
+
+    def search(
+        self,
+        query: str,
+        top_k: int = 5,
+        document_ids: Optional[Set[str]] = None
+    ) -> List[Tuple[str, float]]:
+        """
+        BM25检索
+
+        Args:
+            query: 查询文本
+            top_k: 返回结果数量
+            document_ids: 只在这些文档中检索（None表示全部）
+
+        Returns:
+            (chunk_id, BM25分数) 列表，按分数降序
+        """
+        query_terms = Counter(tokenize(query))
+        with self._lock:
+            total = len(self._chunk_length)
+            if not query_terms or total == 0:
+                return []
+            avg_length = self._total_length / total or 1.0
+
+            scores: Dict[str, float] = defaultdict(float)
+            for term, query_tf in query_terms.items():
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+                for chunk_id, tf in postings.items():
+                    if document_ids is not None and self._chunk_document[chunk_id] not in document_ids:
+                        continue
+                    norm = self.k1 * (1 - self.b + self.b * self._chunk_length[chunk_id] / avg_length)
+                    scores[chunk_id] += query_tf * idf * tf * (self.k1 + 1) / (tf + norm)
+
+        return heapq.nlargest(top_k, scores.items(), key=lambda x: x[1])
@@ -6,6 +6,8 @@
 import os
 import uuid
 import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import List, Dict, Any, Optional
 from pathlib import Path
@@ -17,8 +19,10 @@ from .models import (
     KnowledgeBase, SearchResult, RelevanceCheckResult
 )
 from .document_parser import DocumentParser
-from .vector_store import VectorStore
+from .vector_store import create_vector_store, kb_membership_key
 from .relevance_checker import RelevanceChecker
+from .keyword_index import KeywordIndex, reciprocal_rank_fusion
+from backend.config import settings
 
 logger = logging.getLogger(__name__)
 
@@ -29,30 +33,48 @@ class KnowledgeBaseManager:
     def __init__(
         self,
         upload_dir: str = "./uploads",
-        db_path: str = "./knowledge_base_db.json"
+        db_path: str = "./knowledge_base_db.json",
+        content_dir: str = "./kb_content",
+        ingest_workers: int = None
     ):
         """
         初始化知识库管理器
         
         Args:
             upload_dir: 文件上传目录
-            db_path: 元数据数据库路径
+            db_path: 元数据数据库路径（只保存文档和知识库元数据）
+            content_dir: 文档全文及分块文本目录（每个文档一个文件）
+            ingest_workers: 后台文档处理线程数（默认读取配置）
         """
         self.upload_dir = upload_dir
         self.db_path = db_path
+        self.content_dir = content_dir
         self.documents: Dict[str, Document] = {}
         self.knowledge_bases: Dict[str, KnowledgeBase] = {}
+        # 后台处理进度: document_id -> {stage, current, total, updated_at}
+        self.ingest_progress: Dict[str, Dict[str, Any]] = {}
+        # 后台线程与请求线程共享元数据，修改和保存时加锁
+        self._lock = threading.RLock()
+        self._ingest_executor = ThreadPoolExecutor(
+            max_workers=ingest_workers or settings.kb_ingest_workers,
+            thread_name_prefix="kb-ingest"
+        )
         
         # 初始化组件
         self.parser = DocumentParser()
-        self.vector_store = VectorStore()
+        self.vector_store = create_vector_store()
         self.relevance_checker = RelevanceChecker(self.vector_store)
+        # 关键词索引首次检索时从kb_content构建，之后随文档入库/删除增量维护
+        self.keyword_index = KeywordIndex()
+        self._keyword_index_ready = False
         
         # 确保目录存在
         os.makedirs(upload_dir, exist_ok=True)
+        os.makedirs(content_dir, exist_ok=True)
         
         # 加载已有数据
         self._load_db()
+        self._resume_pending_documents()
     
     def _load_db(self):
         """从JSON文件加载数据"""
@@ -60,36 +82,237 @@ class KnowledgeBaseManager:
             try:
                 with open(self.db_path, 'r', encoding='utf-8') as f:
                     data = json.load(f)
-                    
-                    # 加载文档
-                    for doc_data in data.get('documents', []):
-                        doc = Document(**doc_data)
-                        self.documents[doc.document_id] = doc
-                    
-                    # 加载知识库
-                    for kb_data in data.get('knowledge_bases', []):
-                        kb = KnowledgeBase(**kb_data)
-                        self.knowledge_bases[kb.kb_id] = kb
+                
+                migrated = 0
+                
+                # 加载文档
+                for doc_data in data.get('documents', []):
+                    # 旧格式把全文、分块和向量内联在元数据里，迁移到单独的内容文件
+                    if doc_data.get('content') is not None or doc_data.get('chunks'):
+                        self._migrate_legacy_document(doc_data)
+                        migrated += 1
+                    doc = Document(**doc_data)
+                    self.documents[doc.document_id] = doc
+                
+                # 加载知识库
+                for kb_data in data.get('knowledge_bases', []):
+                    kb = KnowledgeBase(**kb_data)
+                    self.knowledge_bases[kb.kb_id] = kb
                 
                 logger.info(f"知识库数据加载完成: {len(self.documents)} 个文档, {len(self.knowledge_bases)} 个知识库")
+                
+                if migrated:
+                    # 保留旧文件备份后改写为精简格式
+                    shutil.copyfile(self.db_path, f"{self.db_path}.bak")
+                    self._save_db()
+                    logger.info(f"已将 {migrated} 个旧格式文档迁移为元数据+内容文件，原文件备份为 {self.db_path}.bak")
+                
+                if data.get('version', 1) < 3:
+                    # 第3版起知识库归属写入块元数据，为已有的归属关系补写一次
+                    for kb in self.knowledge_bases.values():
+                        self.vector_store.set_kb_membership(kb.documents, kb.kb_id, True)
+                    self._save_db()
+                    logger.info("已为已有文档块补写知识库归属标记")
             except Exception as e:
                 logger.error(f"加载知识库数据失败: {str(e)}")
     
+    def _migrate_legacy_document(self, doc_data: Dict[str, Any]):
+        """把旧格式文档的全文和分块写入内容文件，并从元数据中移除（向量已在向量库中）"""
+        content = doc_data.pop('content', None) or ''
+        chunks = [
+            {k: v for k, v in chunk.items() if k != 'embedding'}
+            for chunk in doc_data.pop('chunks', None) or []
+        ]
+        self._write_content(doc_data['document_id'], content, chunks)
+        doc_data['chunk_ids'] = [chunk['chunk_id'] for chunk in chunks]
+        doc_data['chunk_count'] = len(chunks)
+        doc_data['word_count'] = len(content)
+    
+    def _content_path(self, document_id: str) -> str:
+        return os.path.join(self.content_dir, f"{document_id}.json")
+    
+    def _write_content(self, document_id: str, content: str, chunks: List[Dict[str, Any]]):
+        """写入文档全文和分块文本（不含向量）"""
+        path = self._content_path(document_id)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'content': content, 'chunks': chunks}, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, path)
+    
+    def _read_content(self, document_id: str) -> Optional[Dict[str, Any]]:
+        """读取文档全文和分块文本，文件不存在时返回None"""
+        path = self._content_path(document_id)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    
     def _save_db(self):
-        """保存数据到JSON文件"""
+        """保存元数据到JSON文件（全文、分块和向量不写入）"""
         try:
-            data = {
-                'documents': [doc.model_dump() for doc in self.documents.values()],
-                'knowledge_bases': [kb.model_dump() for kb in self.knowledge_bases.values()]
-            }
-            
-            with open(self.db_path, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2, default=str)
+            with self._lock:
+                data = {
+                    'version': 3,
+                    'documents': [
+                        doc.model_dump(exclude={'content', 'chunks'})
+                        for doc in self.documents.values()
+                    ],
+                    'knowledge_bases': [kb.model_dump() for kb in self.knowledge_bases.values()]
+                }
+                
+                tmp_path = f"{self.db_path}.tmp"
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(data, f, ensure_ascii=False, separators=(',', ':'), default=str)
+                os.replace(tmp_path, self.db_path)
             
             logger.info("知识库数据已保存")
         except Exception as e:
             logger.error(f"保存知识库数据失败: {str(e)}")
     
+    def _resume_pending_documents(self):
+        """重新排队上次进程退出时未处理完的文档"""
+        lost = 0
+        for document in list(self.documents.values()):
+            if document.status not in (DocumentStatus.PENDING, DocumentStatus.PROCESSING):
+                continue
+            if not os.path.exists(document.file_path):
+                document.status = DocumentStatus.FAILED
+                document.error_message = "上传文件丢失，无法继续处理"
+                lost += 1
+                continue
+            logger.info(f"重新排队未完成的文档: {document.filename}")
+            # 清理可能已写入一半的向量
+            self.vector_store.delete_by_document_id(document.document_id)
+            document.status = DocumentStatus.PENDING
+            self._set_progress(document.document_id, 'queued')
+            self._ingest_executor.submit(self._process_document, document.document_id)
+        if lost:
+            # 标记为失败的状态需要落盘，否则每次重启都会重新发现
+            self._save_db()
+    
+    def _set_progress(self, document_id: str, stage: str, current: int = 0, total: int = 0):
+        """更新后台处理进度"""
+        self.ingest_progress[document_id] = {
+            'stage': stage,
+            'current': current,
+            'total': total,
+            'updated_at': datetime.now().isoformat()
+        }
+    
+    def get_ingest_progress(self, document_id: str) -> Optional[Dict[str, Any]]:
+        """
+        获取文档处理进度
+        
+        Args:
+            document_id: 文档ID
+            
+        Returns:
+            进度信息（文档不存在时为None）
+        """
+        document = self.documents.get(document_id)
+        if not document:
+            return None
+        
+        progress = self.ingest_progress.get(document_id)
+        if progress is None:
+            # 进程重启前已处理完的文档没有进度记录
+            stage = 'completed' if document.status == DocumentStatus.COMPLETED else document.status.value
+            progress = {'stage': stage, 'current': 0, 'total': 0, 'updated_at': None}
+        
+        return {
+            'document_id': document_id,
+            'status': document.status.value,
+            'error_message': document.error_message,
+            **progress
+        }
+    
+    def _validate_upload(self, file_content: bytes, filename: str) -> Optional[str]:
+        """检查文件类型和大小，返回错误信息（通过时为None）"""
+        if not self.parser.is_supported(filename):
+            return f'不支持的文件类型: {Path(filename).suffix}'
+        
+        if len(file_content) > self.parser.MAX_FILE_SIZE:
+            return f'文件大小超过限制 ({self.parser.MAX_FILE_SIZE / 1024 / 1024}MB)'
+        
+        return None
+    
+    def _create_document(
+        self,
+        document_id: str,
+        file_content: bytes,
+        filename: str,
+        kb_id: Optional[str] = None
+    ) -> Document:
+        """保存上传文件并创建待处理的文档记录"""
+        file_ext = Path(filename).suffix
+        file_path = os.path.join(self.upload_dir, f"{document_id}{file_ext}")
+        
+        with open(file_path, 'wb') as f:
+            f.write(file_content)
+        
+        document = Document(
+            document_id=document_id,
+            filename=filename,
+            file_type=self.parser.get_document_type(filename),
+            file_size=len(file_content),
+            file_path=file_path,
+            status=DocumentStatus.PENDING
+        )
+        # 记录目标知识库，处理完成后加入
+        if kb_id:
+            document.metadata['target_kb_id'] = kb_id
+        
+        with self._lock:
+            self.documents[document_id] = document
+        return document
+    
+    def submit_document(
+        self,
+        file_content: bytes,
+        filename: str,
+        kb_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        提交文档到后台处理队列
+        
+        保存文件后立即返回document_id，解析、分块和嵌入由后台线程完成，
+        可通过get_ingest_progress查询进度
+        
+        Args:
+            file_content: 文件内容
+            filename: 文件名
+            kb_id: 目标知识库ID（可选）
+            
+        Returns:
+            提交结果
+        """
+        error = self._validate_upload(file_content, filename)
+        if error:
+            return {'success': False, 'error': error}
+        
+        document_id = str(uuid.uuid4())
+        try:
+            document = self._create_document(document_id, file_content, filename, kb_id)
+        except Exception as e:
+            logger.error(f"保存上传文件失败: {filename}, 错误: {str(e)}")
+            return {'success': False, 'error': str(e)}
+        
+        result = {
+            'success': True,
+            'document_id': document_id,
+            'filename': filename,
+            'file_type': document.file_type.value,
+            'file_size': document.file_size,
+            'status': document.status.value
+        }
+        
+        self._set_progress(document_id, 'queued')
+        self._save_db()
+        self._ingest_executor.submit(self._process_document, document_id)
+        
+        logger.info(f"文档已加入处理队列: {filename}, ID: {document_id}")
+        return result
+    
     def upload_document(
         self,
         file_content: bytes,
@@ -97,7 +320,7 @@ class KnowledgeBaseManager:
         kb_id: Optional[str] = None
     ) -> Dict[str, Any]:
         """
-        上传并处理文档
+        上传并同步处理文档
         
         Args:
             file_content: 文件内容
@@ -107,55 +330,52 @@ class KnowledgeBaseManager:
         Returns:
             处理结果
         """
-        document_id = str(uuid.uuid4())
+        error = self._validate_upload(file_content, filename)
+        if error:
+            return {'success': False, 'error': error}
         
+        document_id = str(uuid.uuid4())
         try:
-            # 1. 检查文件类型
-            if not self.parser.is_supported(filename):
-                return {
-                    'success': False,
-                    'error': f'不支持的文件类型: {Path(filename).suffix}'
-                }
-            
-            # 2. 检查文件大小
-            file_size = len(file_content)
-            if file_size > self.parser.MAX_FILE_SIZE:
-                return {
-                    'success': False,
-                    'error': f'文件大小超过限制 ({self.parser.MAX_FILE_SIZE / 1024 / 1024}MB)'
-                }
-            
-            # 3. 保存文件
-            file_ext = Path(filename).suffix
-            file_path = os.path.join(self.upload_dir, f"{document_id}{file_ext}")
-            
-            with open(file_path, 'wb') as f:
-                f.write(file_content)
-            
-            # 4. 创建文档记录
-            doc_type = self.parser.get_document_type(filename)
-            document = Document(
-                document_id=document_id,
-                filename=filename,
-                file_type=doc_type,
-                file_size=file_size,
-                file_path=file_path,
-                status=DocumentStatus.PROCESSING
-            )
+            self._create_document(document_id, file_content, filename, kb_id)
+        except Exception as e:
+            logger.error(f"保存上传文件失败: {filename}, 错误: {str(e)}")
+            return {'success': False, 'error': str(e)}
+        
+        return self._process_document(document_id)
+    
+    def _process_document(self, document_id: str) -> Dict[str, Any]:
+        """
+        解析、分块、嵌入并存储文档（后台线程或同步调用）
+        
+        Args:
+            document_id: 文档ID
             
-            self.documents[document_id] = document
+        Returns:
+            处理结果
+        """
+        document = self.documents.get(document_id)
+        if not document:
+            return {'success': False, 'document_id': document_id, 'error': '文档不存在'}
+        
+        filename = document.filename
+        file_path = document.file_path
+        
+        try:
+            document.status = DocumentStatus.PROCESSING
             
-            # 5. 解析文档
+            # 1. 解析文档
             logger.info(f"开始解析文档: {filename}")
+            self._set_progress(document_id, 'parsing')
             parse_result = self.parser.parse(file_path)
             
             # 更新文档状态
-            document.status = parse_result['status']
-            document.content = parse_result.get('content', '')
-            document.metadata = parse_result.get('metadata', {})
+            content = parse_result.get('content', '')
+            document.metadata.update(parse_result.get('metadata', {}))
             
             if parse_result['status'] == DocumentStatus.FAILED:
+                document.status = DocumentStatus.FAILED
                 document.error_message = parse_result.get('error_message', '解析失败')
+                self._set_progress(document_id, 'failed')
                 self._save_db()
                 return {
                     'success': False,
@@ -163,11 +383,12 @@ class KnowledgeBaseManager:
                     'error': document.error_message
                 }
             
-            # 6. 分块处理
+            # 2. 分块处理
             logger.info(f"开始分块处理: {filename}")
-            chunks_data = self.parser.chunk_text(document.content, chunk_size=500, overlap=50)
+            self._set_progress(document_id, 'chunking')
+            chunks_data = self.parser.chunk_text(content, chunk_size=500, overlap=50)
             
-            # 7. 创建文档块并生成嵌入
+            # 3. 创建文档块
             chunks = []
             for i, chunk_data in enumerate(chunks_data):
                 chunk = DocumentChunk(
@@ -180,13 +401,30 @@ class KnowledgeBaseManager:
                 )
                 chunks.append(chunk)
             
-            # 8. 批量生成嵌入并存储
+            if document_id not in self.documents:
+                logger.info(f"文档在处理期间已被删除，停止处理: {filename}")
+                self.ingest_progress.pop(document_id, None)
+                return {'success': False, 'document_id': document_id, 'error': '文档已删除'}
+            
+            # 4. 批量生成嵌入并存储，知识库归属随块元数据一起写入
             logger.info(f"开始生成向量嵌入: {len(chunks)} 个块")
-            success = self.vector_store.add_chunks(chunks)
+            self._set_progress(document_id, 'embedding', 0, len(chunks))
+            kb_ids = self._document_kb_ids(document_id)
+            target_kb_id = document.metadata.get('target_kb_id')
+            if target_kb_id in self.knowledge_bases:
+                kb_ids.add(target_kb_id)
+            success = self.vector_store.add_chunks(
+                chunks,
+                progress_callback=lambda done, total: self._set_progress(
+                    document_id, 'embedding', done, total
+                ),
+                extra_metadata={kb_membership_key(kb_id): True for kb_id in kb_ids}
+            )
             
             if not success:
                 document.status = DocumentStatus.FAILED
                 document.error_message = "向量存储失败"
+                self._set_progress(document_id, 'failed')
                 self._save_db()
                 return {
                     'success': False,
@@ -194,45 +432,79 @@ class KnowledgeBaseManager:
                     'error': '向量存储失败'
                 }
             
-            document.chunks = chunks
-            document.status = DocumentStatus.COMPLETED
-            document.updated_at = datetime.now()
+            # 全文和分块文本单独存放，向量只保存在向量库中
+            self._write_content(
+                document_id,
+                content,
+                [chunk.model_dump(exclude={'embedding'}) for chunk in chunks]
+            )
             
-            # 9. 如果指定了知识库，添加到知识库
-            if kb_id and kb_id in self.knowledge_bases:
-                kb = self.knowledge_bases[kb_id]
-                if document_id not in kb.documents:
-                    kb.documents.append(document_id)
-                    kb.updated_at = datetime.now()
+            with self._lock:
+                # 处理期间文档被删除时，本次写入的向量和内容不属于任何文档，回滚且不加入关键词索引
+                deleted = document_id not in self.documents
+                if not deleted:
+                    document.chunk_ids = [chunk.chunk_id for chunk in chunks]
+                    document.chunk_count = len(chunks)
+                    document.word_count = len(content)
+                    document.status = DocumentStatus.COMPLETED
+                    document.updated_at = datetime.now()
+                    # 与状态更新放在同一把锁内，避免与关键词索引的首次构建重复或遗漏
+                    if self._keyword_index_ready:
+                        self.keyword_index.add_chunks(chunks)
+                
+                    # 5. 如果指定了知识库，添加到知识库
+                    kb_id = document.metadata.pop('target_kb_id', None)
+                    if kb_id and kb_id in self.knowledge_bases:
+                        kb = self.knowledge_bases[kb_id]
+                        if document_id not in kb.documents:
+                            kb.documents.append(document_id)
+                            kb.updated_at = datetime.now()
+                
+                    # 嵌入期间归属发生变化（加入或移出知识库）时补齐标记
+                    current_kb_ids = self._document_kb_ids(document_id)
+            if deleted:
+                logger.info(f"文档在处理期间已被删除，回滚已写入的数据: {filename}")
+                self._discard_document_data(document_id)
+                self.ingest_progress.pop(document_id, None)
+                return {
+                    'success': False,
+                    'document_id': document_id,
+                    'error': '文档已删除'
+                }
+            for added in current_kb_ids - kb_ids:
+                self.vector_store.set_kb_membership([document_id], added, True)
+            for removed in kb_ids - current_kb_ids:
+                self.vector_store.set_kb_membership([document_id], removed, False)
             
-            # 10. 保存数据
+            # 6. 保存数据
+            self._set_progress(document_id, 'completed', len(chunks), len(chunks))
             self._save_db()
             
-            logger.info(f"文档上传成功: {filename}, ID: {document_id}")
+            logger.info(f"文档处理成功: {filename}, ID: {document_id}")
             
             return {
                 'success': True,
                 'document_id': document_id,
                 'filename': filename,
-                'file_type': doc_type.value,
-                'file_size': file_size,
-                'chunk_count': len(chunks),
-                'word_count': len(document.content),
+                'file_type': document.file_type.value,
+                'file_size': document.file_size,
+                'chunk_count': document.chunk_count,
+                'word_count': document.word_count,
                 'status': document.status.value
             }
             
         except Exception as e:
-            logger.error(f"文档上传失败: {filename}, 错误: {str(e)}")
+            logger.error(f"文档处理失败: {filename}, 错误: {str(e)}")
             
             # 清理文件
             if os.path.exists(file_path):
                 os.remove(file_path)
             
-            # 如果有文档记录，更新状态
-            if document_id in self.documents:
-                self.documents[document_id].status = DocumentStatus.FAILED
-                self.documents[document_id].error_message = str(e)
-                self._save_db()
+            # 更新文档状态
+            document.status = DocumentStatus.FAILED
+            document.error_message = str(e)
+            self._set_progress(document_id, 'failed')
+            self._save_db()
             
             return {
                 'success': False,
@@ -240,6 +512,14 @@ class KnowledgeBaseManager:
                 'error': str(e)
             }
     
+    def _discard_document_data(self, document_id: str):
+        """删除文档的向量、关键词索引条目和内容文件"""
+        self.vector_store.delete_by_document_id(document_id)
+        self.keyword_index.remove_document(document_id)
+        content_path = self._content_path(document_id)
+        if os.path.exists(content_path):
+            os.remove(content_path)
+    
     def delete_document(self, document_id: str) -> bool:
         """
         删除文档
@@ -251,27 +531,24 @@ class KnowledgeBaseManager:
             是否成功
         """
         try:
-            if document_id not in self.documents:
-                return False
-            
-            document = self.documents[document_id]
-            
-            # 1. 从向量存储删除
-            self.vector_store.delete_by_document_id(document_id)
-            
-            # 2. 删除文件
+            # 1. 先移除文档记录和知识库引用：处理中的后台任务写入完成后会发现文档已删除并自行回滚
+            with self._lock:
+                document = self.documents.pop(document_id, None)
+                if document is None:
+                    return False
+                for kb in self.knowledge_bases.values():
+                    if document_id in kb.documents:
+                        kb.documents.remove(document_id)
+                self.ingest_progress.pop(document_id, None)
+            
+            # 2. 删除上传文件
             if os.path.exists(document.file_path):
                 os.remove(document.file_path)
             
-            # 3. 从知识库中移除引用
-            for kb in self.knowledge_bases.values():
-                if document_id in kb.documents:
-                    kb.documents.remove(document_id)
+            # 3. 从向量存储、关键词索引删除，并删除内容文件
+            self._discard_document_data(document_id)
             
-            # 4. 删除文档记录
-            del self.documents[document_id]
-            
-            # 5. 保存数据
+            # 4. 保存数据
             self._save_db()
             
             logger.info(f"文档删除成功: {document_id}")
@@ -281,9 +558,29 @@ class KnowledgeBaseManager:
             logger.error(f"文档删除失败: {document_id}, 错误: {str(e)}")
             return False
     
-    def get_document(self, document_id: str) -> Optional[Document]:
-        """获取文档信息"""
-        return self.documents.get(document_id)
+    def get_document(self, document_id: str, with_content: bool = False) -> Optional[Document]:
+        """
+        获取文档信息
+        
+        Args:
+            document_id: 文档ID
+            with_content: 是否加载全文和分块文本（返回副本，不常驻内存）
+            
+        Returns:
+            文档信息
+        """
+        document = self.documents.get(document_id)
+        if document is None or not with_content:
+            return document
+        
+        stored = self._read_content(document_id)
+        if stored is None:
+            return document
+        
+        return document.model_copy(update={
+            'content': stored.get('content', ''),
+            'chunks': [DocumentChunk(**chunk) for chunk in stored.get('chunks', [])]
+        })
     
     def list_documents(
         self,
@@ -317,11 +614,35 @@ class KnowledgeBaseManager:
         
         return docs
     
+    def _document_kb_ids(self, document_id: str) -> set:
+        """文档当前所属的知识库ID集合"""
+        with self._lock:
+            return {kb_id for kb_id, kb in self.knowledge_bases.items() if document_id in kb.documents}
+    
+    def _ensure_keyword_index(self):
+        """首次使用时用已入库文档的分块文本构建关键词索引"""
+        if self._keyword_index_ready:
+            return
+        with self._lock:
+            if self._keyword_index_ready:
+                return
+            for document in list(self.documents.values()):
+                if document.status != DocumentStatus.COMPLETED:
+                    continue
+                stored = self._read_content(document.document_id)
+                if stored is None:
+                    continue
+                for chunk in stored.get('chunks', []):
+                    self.keyword_index.add(chunk['chunk_id'], document.document_id, chunk['content'])
+            self._keyword_index_ready = True
+            logger.info(f"关键词索引构建完成，共 {len(self.keyword_index)} 个文档块")
+    
     def search_knowledge_base(
         self,
         query: str,
         top_k: int = 5,
-        kb_id: Optional[str] = None
+        kb_id: Optional[str] = None,
+        mode: str = "vector"
     ) -> List[SearchResult]:
         """
         搜索知识库
@@ -330,18 +651,23 @@ class KnowledgeBaseManager:
             query: 查询文本
             top_k: 返回结果数量
             kb_id: 知识库ID（可选，None表示搜索全部）
+            mode: vector（向量）、keyword（BM25关键词）或 hybrid（两者RRF融合）
             
         Returns:
             搜索结果列表
         """
         try:
-            # 执行向量搜索
-            results = self.vector_store.search(query, top_k=top_k)
-            
-            # 如果指定了知识库，过滤结果
+            kb_doc_ids = None
+            where = None
             if kb_id and kb_id in self.knowledge_bases:
                 kb_doc_ids = set(self.knowledge_bases[kb_id].documents)
-                results = [r for r in results if r.chunk.document_id in kb_doc_ids]
+                # 知识库范围在向量检索内部过滤，保证返回top_k个该知识库的结果
+                where = {kb_membership_key(kb_id): True}
+            
+            if mode == "vector":
+                results = self.vector_store.search(query, top_k=top_k, where=where)
+            else:
+                results = self._keyword_search(query, top_k, kb_doc_ids, where, hybrid=(mode == "hybrid"))
             
             # 补充文档信息
             for result in results:
@@ -353,6 +679,48 @@ class KnowledgeBaseManager:
             logger.error(f"知识库搜索失败: {str(e)}")
             return []
     
+    def _keyword_search(
+        self,
+        query: str,
+        top_k: int,
+        kb_doc_ids: Optional[set],
+        where: Optional[Dict[str, Any]],
+        hybrid: bool
+    ) -> List[SearchResult]:
+        """
+        关键词检索；hybrid时与向量检索结果做倒数排名融合
+        
+        分数归一化到0-1：关键词模式相对最高BM25分，混合模式相对两路都排第一时的融合分
+        """
+        self._ensure_keyword_index()
+        candidates = max(top_k, settings.kb_hybrid_candidates)
+        keyword_hits = self.keyword_index.search(query, top_k=candidates, document_ids=kb_doc_ids)
+        
+        if not hybrid:
+            ranked = keyword_hits[:top_k]
+            max_score = ranked[0][1] if ranked else 1.0
+            chunks = self.vector_store.get_chunks([chunk_id for chunk_id, _ in ranked])
+            return [
+                SearchResult(chunk=chunks[chunk_id], score=score / max_score)
+                for chunk_id, score in ranked if chunk_id in chunks
+            ]
+        
+        vector_results = self.vector_store.search(query, top_k=candidates, where=where)
+        
+        fused = reciprocal_rank_fusion(
+            [[r.chunk.chunk_id for r in vector_results], [chunk_id for chunk_id, _ in keyword_hits]],
+            k=settings.kb_rrf_k
+        )[:top_k]
+        
+        # 只命中关键词的块需要从向量库补读内容
+        chunks = {r.chunk.chunk_id: r.chunk for r in vector_results}
+        chunks.update(self.vector_store.get_chunks([chunk_id for chunk_id, _ in fused if chunk_id not in chunks]))
+        max_score = 2.0 / (settings.kb_rrf_k + 1)
+        return [
+            SearchResult(chunk=chunks[chunk_id], score=min(score / max_score, 1.0))
+            for chunk_id, score in fused if chunk_id in chunks
+        ]
+    
     def check_relevance(
         self,
         query: str,
@@ -406,8 +774,9 @@ class KnowledgeBaseManager:
         if kb_id not in self.knowledge_bases:
             return False
         
-        del self.knowledge_bases[kb_id]
+        kb = self.knowledge_bases.pop(kb_id)
         self._save_db()
+        self.vector_store.set_kb_membership(kb.documents, kb_id, False)
         
         logger.info(f"知识库删除成功: {kb_id}")
         return True
@@ -439,6 +808,7 @@ class KnowledgeBaseManager:
             kb.documents.append(document_id)
             kb.updated_at = datetime.now()
             self._save_db()
+            self.vector_store.set_kb_membership([document_id], kb_id, True)
         
         return True
     
@@ -461,9 +831,14 @@ class KnowledgeBaseManager:
             kb.documents.remove(document_id)
             kb.updated_at = datetime.now()
             self._save_db()
+            self.vector_store.set_kb_membership([document_id], kb_id, False)
         
         return True
     
+    def shutdown(self):
+        """停止后台文档处理（应用关闭时调用）：未开始的任务取消，下次启动时重新排队"""
+        self._ingest_executor.shutdown(wait=False, cancel_futures=True)
+    
     def get_stats(self) -> Dict[str, Any]:
         """获取统计信息"""
         vector_stats = self.vector_store.get_stats()
@@ -49,8 +49,12 @@ class Document(BaseModel):
     file_size: int
     file_path: str
     status: DocumentStatus = DocumentStatus.PENDING
+    # content和chunks只在按需加载全文时填充，不写入元数据库
     content: Optional[str] = None
     chunks: List[DocumentChunk] = Field(default_factory=list)
+    chunk_ids: List[str] = Field(default_factory=list)  # 向量库中的chunk_id列表
+    chunk_count: int = 0
+    word_count: int = 0
     metadata: Dict[str, Any] = Field(default_factory=dict)
     created_at: datetime = Field(default_factory=datetime.now)
     updated_at: datetime = Field(default_factory=datetime.now)
@@ -0,0 +1,573 @@
+"""
+进程内向量存储模块
+向量保存在内存映射的float32/float16矩阵中，查询时一次矩阵乘法做精确top-k；
+chunk ID、文本和元数据保存在SQLite表中，删除只打墓碑标记，墓碑过多时整体压缩
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+from .models import DocumentChunk, SearchResult
+from .vector_store import VectorStore, kb_membership_key
+from backend.config import settings
+
+logger = logging.getLogger(__name__)
+
+# 矩阵文件初始容量（行），不足时翻倍
+_INITIAL_CAPACITY = 1024
+# 分块做矩阵乘法，float16矩阵每次只转换一块为float32
+_SCORE_BLOCK_ROWS = 65536
+# 墓碑数超过该值且多于有效行时压缩
+_COMPACT_MIN_TOMBSTONES = 1024
+
+
+class NumpyVectorStore(VectorStore):
+    """基于NumPy矩阵的精确检索向量存储，接口与VectorStore一致"""
+
+    def __init__(
+        self,
+        collection_name: str = "knowledge_base",
+        persist_directory: str = None,
+        dtype: str = None,
+        chroma_directory: str = "./chroma_db",
+        **kwargs
+    ):
+        """
+        初始化向量存储
+
+        Args:
+            collection_name: 集合名称（用于从ChromaDB导入已有数据）
+            persist_directory: 矩阵文件和ID表目录（默认读取配置）
+            dtype: 向量精度 float32 或 float16（默认读取配置，已有索引以索引为准）
+            chroma_directory: ChromaDB目录，索引为空时从中导入已有向量
+            **kwargs: 其余参数同VectorStore
+        """
+        self.dtype = np.dtype(dtype or settings.kb_numpy_dtype)
+        if self.dtype not in (np.float32, np.float16):
+            raise ValueError(f"不支持的向量精度: {self.dtype}")
+        self.chroma_directory = chroma_directory
+        self._index_lock = threading.RLock()
+        super().__init__(
+            collection_name=collection_name,
+            persist_directory=persist_directory or settings.kb_numpy_index_dir,
+            **kwargs
+        )
+
+    # ---------- 存储初始化 ----------
+
+    def _init_storage(self):
+        """打开SQLite ID表和内存映射矩阵，加载行信息"""
+        self._db = sqlite3.connect(os.path.join(self.persist_directory, "index.db"), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS chunks (
+                row INTEGER PRIMARY KEY,
+                chunk_id TEXT NOT NULL,
+                document_id TEXT NOT NULL,
+                content TEXT NOT NULL,
+                metadata TEXT NOT NULL,
+                deleted INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS idx_chunks_document ON chunks(document_id);
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+            """
+        )
+        meta = dict(self._db.execute("SELECT key, value FROM meta").fetchall())
+        if meta:
+            # 已有索引的精度和维度以索引为准
+            if meta['dtype'] != self.dtype.name:
+                logger.warning(f"向量索引精度为 {meta['dtype']}，忽略配置的 {self.dtype.name}")
+            self.dtype = np.dtype(meta['dtype'])
+            self.dim = int(meta['dim'])
+            self._generation = int(meta['generation'])
+        else:
+            self.dim = 768
+            self._generation = 0
+            self._save_meta()
+            self._db.commit()
+
+        self._load_rows()
+        self._open_matrix()
+        self._remove_stale_matrices()
+
+        if self._size == 0:
+            self._import_from_chroma()
+
+        logger.info(
+            f"向量索引加载完成: {len(self._row_of)} 个文档块, {self._size - len(self._row_of)} 个墓碑, "
+            f"精度 {self.dtype.name}, 目录 {self.persist_directory}"
+        )
+
+    def _save_meta(self):
+        self._db.executemany(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+            [('dtype', self.dtype.name), ('dim', str(self.dim)), ('generation', str(self._generation))]
+        )
+
+    def _matrix_path(self, generation: int) -> str:
+        return os.path.join(self.persist_directory, f"embeddings.{generation}.{self.dtype.name}")
+
+    def _load_rows(self):
+        """从ID表加载每行的chunk_id、文档ID、元数据和墓碑状态"""
+        self._chunk_ids: List[Optional[str]] = []
+        self._metadatas: List[Optional[Dict[str, Any]]] = []
+        self._row_of: Dict[str, int] = {}
+        self._doc_rows: Dict[str, List[int]] = {}
+        for row, chunk_id, document_id, metadata, deleted in self._db.execute(
+            "SELECT row, chunk_id, document_id, metadata, deleted FROM chunks ORDER BY row"
+        ):
+            # 行号连续追加；异常中断留下的空洞按墓碑处理
+            while len(self._chunk_ids) < row:
+                self._chunk_ids.append(None)
+                self._metadatas.append(None)
+            if deleted:
+                self._chunk_ids.append(None)
+                self._metadatas.append(None)
+                continue
+            self._chunk_ids.append(chunk_id)
+            self._metadatas.append(json.loads(metadata))
+            self._row_of[chunk_id] = row
+            self._doc_rows.setdefault(document_id, []).append(row)
+        self._size = len(self._chunk_ids)
+
+    def _open_matrix(self):
+        """映射矩阵文件，容量不足时扩展"""
+        path = self._matrix_path(self._generation)
+        row_bytes = self.dim * self.dtype.itemsize
+        existing_rows = os.path.getsize(path) // row_bytes if os.path.exists(path) else 0
+        capacity = max(_INITIAL_CAPACITY, existing_rows, self._size)
+        if existing_rows < capacity:
+            with open(path, 'ab') as f:
+                f.truncate(capacity * row_bytes)
+        self._matrix = np.memmap(path, dtype=self.dtype, mode='r+', shape=(capacity, self.dim))
+        self._alive = np.zeros(capacity, dtype=bool)
+        self._alive[[row for row in self._row_of.values()]] = True
+
+    def _remove_stale_matrices(self):
+        """删除压缩中断或完成后遗留的旧矩阵文件"""
+        current = os.path.basename(self._matrix_path(self._generation))
+        for name in os.listdir(self.persist_directory):
+            if name.startswith("embeddings.") and name != current:
+                os.remove(os.path.join(self.persist_directory, name))
+
+    def _ensure_capacity(self, rows: int):
+        """矩阵容量不足rows行时翻倍扩展"""
+        capacity = self._matrix.shape[0]
+        if rows <= capacity:
+            return
+        while capacity < rows:
+            capacity *= 2
+        self._matrix.flush()
+        path = self._matrix.filename
+        self._matrix = None
+        with open(path, 'r+b') as f:
+            f.truncate(capacity * self.dim * self.dtype.itemsize)
+        self._matrix = np.memmap(path, dtype=self.dtype, mode='r+', shape=(capacity, self.dim))
+        alive = np.zeros(capacity, dtype=bool)
+        alive[:len(self._alive)] = self._alive
+        self._alive = alive
+
+    def _import_from_chroma(self):
+        """索引为空时导入ChromaDB中已有的向量，切换后端无需重新嵌入"""
+        if not os.path.isdir(self.chroma_directory):
+            return
+        try:
+            import chromadb
+            from chromadb.config import Settings
+
+            client = chromadb.Client(Settings(
+                persist_directory=self.chroma_directory,
+                anonymized_telemetry=False,
+                is_persistent=True
+            ))
+            collection = client.get_collection(self.collection_name)
+        except Exception as e:
+            logger.info(f"未导入ChromaDB数据: {str(e)}")
+            return
+
+        imported, page_size = 0, 1000
+        while True:
+            page = collection.get(
+                include=['embeddings', 'documents', 'metadatas'],
+                limit=page_size,
+                offset=imported
+            )
+            if not page['ids']:
+                break
+            self._append(
+                page['ids'],
+                page['documents'],
+                [dict(metadata) for metadata in page['metadatas']],
+                np.asarray(page['embeddings'], dtype=np.float32)
+            )
+            imported += len(page['ids'])
+        if imported:
+            logger.info(f"已从ChromaDB导入 {imported} 个文档块")
+
+    # ---------- 写入 ----------
+
+    def _append(
+        self,
+        chunk_ids: List[str],
+        contents: List[str],
+        metadatas: List[Dict[str, Any]],
+        vectors: np.ndarray
+    ):
+        """追加行：先写矩阵再提交ID表，中断时多写的矩阵行不会被引用"""
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        np.divide(vectors, norms, out=vectors, where=norms > 0)
+
+        with self._index_lock:
+            # 与ChromaDB的upsert一致，同ID的旧行打墓碑
+            replaced = [self._row_of[chunk_id] for chunk_id in chunk_ids if chunk_id in self._row_of]
+            if replaced:
+                self._tombstone(replaced)
+
+            start = self._size
+            self._ensure_capacity(start + len(chunk_ids))
+            self._matrix[start:start + len(chunk_ids)] = vectors
+            self._matrix.flush()
+
+            self._db.executemany(
+                "INSERT OR REPLACE INTO chunks (row, chunk_id, document_id, content, metadata) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (start + i, chunk_id, metadata['document_id'], content, json.dumps(metadata, ensure_ascii=False))
+                    for i, (chunk_id, content, metadata) in enumerate(zip(chunk_ids, contents, metadatas))
+                ]
+            )
+            self._db.commit()
+
+            for i, (chunk_id, metadata) in enumerate(zip(chunk_ids, metadatas)):
+                row = start + i
+                self._chunk_ids.append(chunk_id)
+                self._metadatas.append(metadata)
+                self._row_of[chunk_id] = row
+                self._doc_rows.setdefault(metadata['document_id'], []).append(row)
+            self._alive[start:start + len(chunk_ids)] = True
+            self._size = start + len(chunk_ids)
+            self._bump_corpus_version()
+
+    def add_chunks(
+        self,
+        chunks: List[DocumentChunk],
+        progress_callback: Optional[Callable[[int, int], None]] = None,
+        extra_metadata: Optional[Dict[str, Any]] = None
+    ) -> bool:
+        """
+        添加文档块到向量存储
+
+        Args:
+            chunks: 文档块列表
+            progress_callback: 嵌入进度回调 (已完成数, 总数)
+            extra_metadata: 附加到每个块的元数据（如知识库归属标记）
+
+        Returns:
+            是否成功
+        """
+        if not chunks:
+            return True
+
+        try:
+            logger.info(f"开始为 {len(chunks)} 个文档块生成嵌入向量...")
+            self._embed_pending(chunks, progress_callback)
+
+            self._append(
+                [chunk.chunk_id for chunk in chunks],
+                [chunk.content for chunk in chunks],
+                [self._chunk_metadata(chunk, extra_metadata) for chunk in chunks],
+                np.asarray([chunk.embedding for chunk in chunks], dtype=np.float32)
+            )
+
+            logger.info(f"成功添加 {len(chunks)} 个文档块到向量存储")
+            return True
+
+        except Exception as e:
+            logger.error(f"添加文档块失败: {str(e)}")
+            return False
+
+    def _tombstone(self, rows: List[int]):
+        """标记删除（调用方持有锁）"""
+        for row in rows:
+            chunk_id = self._chunk_ids[row]
+            if chunk_id is None:
+                continue
+            document_id = self._metadatas[row]['document_id']
+            siblings = self._doc_rows.get(document_id)
+            if siblings:
+                siblings.remove(row)
+                if not siblings:
+                    del self._doc_rows[document_id]
+            del self._row_of[chunk_id]
+            self._chunk_ids[row] = None
+            self._metadatas[row] = None
+        self._alive[rows] = False
+        self._db.executemany("UPDATE chunks SET deleted = 1 WHERE row = ?", [(row,) for row in rows])
+        self._db.commit()
+        self._bump_corpus_version()
+
+    def delete_by_document_id(self, document_id: str) -> bool:
+        """
+        删除指定文档的所有块
+
+        Args:
+            document_id: 文档ID
+
+        Returns:
+            是否成功
+        """
+        try:
+            with self._index_lock:
+                rows = list(self._doc_rows.get(document_id, []))
+                if rows:
+                    self._tombstone(rows)
+                    logger.info(f"成功删除文档 {document_id} 的 {len(rows)} 个块")
+                tombstones = self._size - len(self._row_of)
+                if tombstones >= _COMPACT_MIN_TOMBSTONES and tombstones > len(self._row_of):
+                    self.compact()
+            return True
+
+        except Exception as e:
+            logger.error(f"删除文档块失败: {str(e)}")
+            return False
+
+    def compact(self):
+        """去掉墓碑行，重写矩阵文件和ID表（新矩阵写完后随ID表在同一事务中切换）"""
+        with self._index_lock:
+            live_rows = np.flatnonzero(self._alive[:self._size])
+            new_generation = self._generation + 1
+            path = self._matrix_path(new_generation)
+            matrix = np.memmap(
+                path, dtype=self.dtype, mode='w+',
+                shape=(max(_INITIAL_CAPACITY, len(live_rows)), self.dim)
+            )
+            for start in range(0, len(live_rows), _SCORE_BLOCK_ROWS):
+                block = live_rows[start:start + _SCORE_BLOCK_ROWS]
+                matrix[start:start + len(block)] = self._matrix[block]
+            matrix.flush()
+            del matrix
+
+            records = self._db.execute(
+                "SELECT chunk_id, document_id, content, metadata FROM chunks WHERE deleted = 0 ORDER BY row"
+            ).fetchall()
+            with self._db:
+                self._db.execute("DELETE FROM chunks")
+                self._db.executemany(
+                    "INSERT INTO chunks (row, chunk_id, document_id, content, metadata) VALUES (?, ?, ?, ?, ?)",
+                    [(row, *record) for row, record in enumerate(records)]
+                )
+                self._generation = new_generation
+                self._save_meta()
+
+            removed = self._size - len(live_rows)
+            self._matrix = None
+            self._load_rows()
+            self._open_matrix()
+            self._remove_stale_matrices()
+            logger.info(f"向量索引压缩完成，清理 {removed} 个墓碑")
+
+    def set_kb_membership(self, document_ids: List[str], kb_id: str, member: bool) -> bool:
+        """
+        更新文档块的知识库归属标记
+
+        Args:
+            document_ids: 文档ID列表
+            kb_id: 知识库ID
+            member: True为加入，False为移除
+
+        Returns:
+            是否成功
+        """
+        key = kb_membership_key(kb_id)
+        try:
+            with self._index_lock:
+                updates = []
+                for document_id in document_ids:
+                    for row in self._doc_rows.get(document_id, []):
+                        metadata = self._metadatas[row]
+                        if member:
+                            metadata[key] = True
+                        else:
+                            metadata.pop(key, None)
+                        updates.append((json.dumps(metadata, ensure_ascii=False), row))
+                if updates:
+                    self._db.executemany("UPDATE chunks SET metadata = ? WHERE row = ?", updates)
+                    self._db.commit()
+                    self._bump_corpus_version()
+            return True
+        except Exception as e:
+            logger.error(f"更新知识库归属标记失败: kb_id={kb_id}, 错误: {str(e)}")
+            return False
+
+    # ---------- 检索 ----------
+
+    @staticmethod
+    def _matches(metadata: Dict[str, Any], where: Dict[str, Any]) -> bool:
+        """按ChromaDB where语法的子集匹配元数据（等值、$eq、$ne、$in、$and、$or）"""
+        for key, condition in where.items():
+            if key == '$and':
+                if not all(NumpyVectorStore._matches(metadata, c) for c in condition):
+                    return False
+            elif key == '$or':
+                if not any(NumpyVectorStore._matches(metadata, c) for c in condition):
+                    return False
+            elif isinstance(condition, dict):
+                value = metadata.get(key)
+                for op, operand in condition.items():
+                    if op == '$eq' and value != operand:
+                        return False
+                    if op == '$ne' and value == operand:
+                        return False
+                    if op == '$in' and value not in operand:
+                        return False
+            elif metadata.get(key) != condition:
+                return False
+        return True
+
+    def _candidate_rows(self, where: Optional[Dict[str, Any]]) -> np.ndarray:
+        """有效且满足过滤条件的行号（调用方持有锁）"""
+        if not where:
+            return np.flatnonzero(self._alive[:self._size])
+        return np.fromiter(
+            (row for row, metadata in enumerate(self._metadatas)
+             if metadata is not None and self._matches(metadata, where)),
+            dtype=np.int64
+        )
+
+    def _scores(self, query: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        """计算候选行与查询向量的余弦相似度（行向量已归一化）"""
+        if len(rows) == self._size:
+            # 全部行都是候选时按连续块计算，避免花式索引复制整个矩阵
+            scores = np.empty(self._size, dtype=np.float32)
+            for start in range(0, self._size, _SCORE_BLOCK_ROWS):
+                block = self._matrix[start:min(start + _SCORE_BLOCK_ROWS, self._size)]
+                scores[start:start + len(block)] = block.astype(np.float32, copy=False) @ query
+            return scores
+        scores = np.empty(len(rows), dtype=np.float32)
+        for start in range(0, len(rows), _SCORE_BLOCK_ROWS):
+            block = rows[start:start + _SCORE_BLOCK_ROWS]
+            scores[start:start + len(block)] = self._matrix[block].astype(np.float32, copy=False) @ query
+        return scores
+
+    def _search(
+        self,
+        query: str,
+        top_k: int,
+        score_threshold: float,
+        where: Optional[Dict[str, Any]]
+    ) -> List[SearchResult]:
+        """精确top-k检索（不经过缓存），where支持ChromaDB语法的常用子集"""
+        try:
+            query_vector = np.asarray(self.encode_text(query), dtype=np.float32)
+            norm = np.linalg.norm(query_vector)
+            if norm == 0 or top_k <= 0:
+                return []
+            query_vector /= norm
+
+            with self._index_lock:
+                rows = self._candidate_rows(where)
+                if len(rows) == 0:
+                    return []
+                scores = self._scores(query_vector, rows)
+                k = min(top_k, len(rows))
+                top = np.argpartition(-scores, k - 1)[:k]
+                top = top[np.argsort(-scores[top])]
+                hits = [
+                    (int(rows[i]), float(scores[i]))
+                    for i in top if scores[i] >= score_threshold
+                ]
+                if not hits:
+                    logger.info("搜索完成，找到 0 个相关结果")
+                    return []
+                contents = dict(self._db.execute(
+                    f"SELECT row, content FROM chunks WHERE row IN ({','.join('?' * len(hits))})",
+                    [row for row, _ in hits]
+                ).fetchall())
+                search_results = [
+                    SearchResult(
+                        chunk=self._to_chunk(self._chunk_ids[row], contents[row], self._metadatas[row]),
+                        score=score
+                    )
+                    for row, score in hits
+                ]
+
+            logger.info(f"搜索完成，找到 {len(search_results)} 个相关结果")
+            return search_results
+
+        except Exception as e:
+            logger.error(f"搜索失败: {str(e)}")
+            return []
+
+    def get_chunks(self, chunk_ids: List[str]) -> Dict[str, DocumentChunk]:
+        """
+        按ID读取文档块（不含向量）
+
+        Args:
+            chunk_ids: 文档块ID列表
+
+        Returns:
+            chunk_id -> 文档块，不存在的ID不返回
+        """
+        if not chunk_ids:
+            return {}
+        try:
+            with self._index_lock:
+                rows = {self._row_of[chunk_id]: chunk_id for chunk_id in chunk_ids if chunk_id in self._row_of}
+                if not rows:
+                    return {}
+                contents = self._db.execute(
+                    f"SELECT row, content FROM chunks WHERE row IN ({','.join('?' * len(rows))})",
+                    list(rows)
+                ).fetchall()
+                return {
+                    rows[row]: self._to_chunk(rows[row], content, self._metadatas[row])
+                    for row, content in contents
+                }
+        except Exception as e:
+            logger.error(f"读取文档块失败: {str(e)}")
+            return {}
+
+    # ---------- 管理 ----------
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取存储统计信息"""
+        with self._index_lock:
+            return {
+                'total_chunks': len(self._row_of),
+                'tombstones': self._size - len(self._row_of),
+                'backend': 'numpy',
+                'dtype': self.dtype.name,
+                'collection_name': self.collection_name,
+                'persist_directory': self.persist_directory,
+                'embedding_model': self.ollama_model,
+                'corpus_version': self.corpus_version,
+                'retrieval_cache': self.retrieval_cache.stats() if self.retrieval_cache else None
+            }
+
+    def clear(self) -> bool:
+        """清空所有数据"""
+        try:
+            with self._index_lock:
+                with self._db:
+                    self._db.execute("DELETE FROM chunks")
+                    self._generation += 1
+                    self._save_meta()
+                self._matrix = None
+                self._load_rows()
+                self._open_matrix()
+                self._remove_stale_matrices()
+                self._bump_corpus_version()
+            logger.info("向量存储已清空")
+            return True
+        except Exception as e:
+            logger.error(f"清空存储失败: {str(e)}")
+            return False
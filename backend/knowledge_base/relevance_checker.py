@@ -3,15 +3,20 @@
 评估知识库内容是否足以回答用户查询
 """
 
+import re
 import time
 from typing import List, Dict, Any
 import logging
 
 from .models import SearchResult, RelevanceCheckResult
-from .vector_store import VectorStore
+from .vector_store import VectorStore, create_vector_store
+from .keyword_index import tokenize
 
 logger = logging.getLogger(__name__)
 
+# 与关键词索引分词一致的英文/数字单词
+_ASCII_WORD_RE = re.compile(r'[a-z0-9]+(?:[._-][a-z0-9]+)*')
+
 
 class RelevanceChecker:
     """相关性检查器类"""
@@ -32,7 +37,7 @@ class RelevanceChecker:
             min_coverage_score: 最小覆盖分数阈值
             confidence_threshold: 置信度阈值
         """
-        self.vector_store = vector_store or VectorStore()
+        self.vector_store = vector_store or create_vector_store()
         self.min_similarity_threshold = min_similarity_threshold
         self.min_coverage_score = min_coverage_score
         self.confidence_threshold = confidence_threshold
@@ -137,18 +142,14 @@ class RelevanceChecker:
         if not query_keywords:
             return 0.5  # 默认中等覆盖
         
-        # 统计被覆盖的关键词
-        covered_keywords = set()
-        total_content = ""
-        
-        for result in results:
-            total_content += result.chunk.content + " "
-        
-        content_keywords = set(self._extract_keywords(total_content))
-        
-        for keyword in query_keywords:
-            if keyword in content_keywords:
-                covered_keywords.add(keyword)
+        # 统计被覆盖的关键词：中文二元组在原文中出现即被覆盖（等价于出现在原文的二元组中），
+        # 英文按完整单词匹配，无需对全部检索内容重新分词
+        total_content = " ".join(result.chunk.content for result in results).lower()
+        content_words = set(_ASCII_WORD_RE.findall(total_content))
+        covered_keywords = {
+            keyword for keyword in query_keywords
+            if (keyword in content_words if keyword[0].isascii() else keyword in total_content)
+        }
         
         # 计算覆盖率
         coverage = len(covered_keywords) / len(query_keywords)
@@ -282,14 +283,8 @@ class RelevanceChecker:
             return f"知识库内容不足以完整回答问题: {reason_str}，将调用API搜索补充"
     
     def _extract_keywords(self, text: str) -> List[str]:
-        """提取关键词（简化实现）"""
-        import re
-        
-        # 移除标点符号和特殊字符
-        text = re.sub(r'[^\w\s]', ' ', text)
-        
-        # 分词并过滤停用词
-        words = text.lower().split()
+        """提取关键词（中文按字二元组，英文按词，与关键词索引的分词一致）"""
+        words = tokenize(text)
         
         # 简单停用词列表
         stop_words = {
@@ -297,7 +292,7 @@ class RelevanceChecker:
             'the', 'a', 'an', 'is', 'are', 'was', 'were', 'be', 'been', 'being', 'have', 'has', 'had', 'do', 'does', 'did', 'will', 'would', 'could', 'should'
         }
         
-        # 过滤短词和停用词
+        # 只过滤短词和完全匹配的停用词；含助词的二元组（如"现在"、"是否"、"以及"）可能是实词，与关键词索引一样保留
         keywords = [w for w in words if len(w) > 1 and w not in stop_words]
         
         return keywords
@@ -314,7 +309,3 @@ class RelevanceChecker:
         """
         result = self.check_relevance(query, top_k=3, max_response_time_ms=300)
         return result.is_sufficient and result.confidence >= self.confidence_threshold
-
-
-# 全局相关性检查器实例
-relevance_checker = RelevanceChecker()
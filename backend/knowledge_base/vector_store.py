@@ -6,16 +6,56 @@
 
 import os
 import uuid
-from typing import List, Dict, Any, Optional, Tuple
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple, Callable
 import numpy as np
 import logging
 import requests
 
 from .models import DocumentChunk, SearchResult
+from .embedding_cache import EmbeddingCache, embedding_cache as default_embedding_cache
+from backend.cache import TTLCache, hash_key
 from backend.config import settings
 
 logger = logging.getLogger(__name__)
 
+# 块元数据中知识库归属标记的键前缀（in_kb_<kb_id>: True），检索时作为where条件
+KB_MEMBERSHIP_PREFIX = "in_kb_"
+
+
+def kb_membership_key(kb_id: str) -> str:
+    """知识库归属标记在块元数据中的键名"""
+    return f"{KB_MEMBERSHIP_PREFIX}{kb_id}"
+
+
+# 备用编码的向量维度（与nomic-embed-text模型一致）
+FALLBACK_VECTOR_DIM = 768
+# 三字组 -> 向量下标的缓存上限，超过后清空重建
+_TRIGRAM_BUCKET_CACHE_SIZE = 1 << 20
+_trigram_buckets: Dict[int, int] = {}
+
+
+def _trigram_keys(text: str) -> np.ndarray:
+    """把文本的全部字符三字组打包成int64（每个码位21位），供去重和查表"""
+    codepoints = np.frombuffer(text.encode('utf-32-le', 'surrogatepass'), dtype=np.uint32).astype(np.int64)
+    if len(codepoints) < 3:
+        return np.empty(0, dtype=np.int64)
+    return (codepoints[:-2] << 42) | (codepoints[1:-1] << 21) | codepoints[2:]
+
+
+def _bucket_of(key: int) -> int:
+    """三字组的向量下标，与原先 md5(trigram) % 768 的映射保持一致，已编码的向量仍可比较"""
+    bucket = _trigram_buckets.get(key)
+    if bucket is None:
+        trigram = chr(key >> 42) + chr((key >> 21) & 0x1FFFFF) + chr(key & 0x1FFFFF)
+        bucket = int(hashlib.md5(trigram.encode()).hexdigest(), 16) % FALLBACK_VECTOR_DIM
+        if len(_trigram_buckets) >= _TRIGRAM_BUCKET_CACHE_SIZE:
+            _trigram_buckets.clear()
+        _trigram_buckets[key] = bucket
+    return bucket
+
 
 class VectorStore:
     """向量存储类"""
@@ -25,7 +65,8 @@ class VectorStore:
         collection_name: str = "knowledge_base",
         persist_directory: str = "./chroma_db",
         ollama_url: str = None,
-        ollama_model: str = None
+        ollama_model: str = None,
+        embedding_cache: EmbeddingCache = None
     ):
         """
         初始化向量存储
@@ -35,6 +76,7 @@ class VectorStore:
             persist_directory: 持久化目录
             ollama_url: Ollama服务地址
             ollama_model: Ollama嵌入模型名称
+            embedding_cache: 嵌入缓存（默认使用全局共享缓存）
         """
         self.collection_name = collection_name
         self.persist_directory = persist_directory
@@ -43,13 +85,32 @@ class VectorStore:
         self.ollama_model = ollama_model or settings.ollama_embed_model
         self.ollama_model_fallback = settings.ollama_embed_model_fallback
         self.collection = None
+        self.embedding_cache = embedding_cache or default_embedding_cache
+        # 语料版本：块的增删、归属变化时递增，检索缓存按版本失效
+        self.corpus_version = 0
+        self._version_lock = threading.Lock()
+        self.retrieval_cache: Optional[TTLCache] = None
+        if settings.kb_retrieval_cache_enabled:
+            self.retrieval_cache = TTLCache(
+                "kb_retrieval",
+                max_entries=settings.kb_retrieval_cache_max_entries,
+                ttl=settings.kb_retrieval_cache_ttl
+            )
         
         # 确保目录存在
         os.makedirs(persist_directory, exist_ok=True)
         
         # 初始化
-        self._init_chroma()
+        self._init_storage()
         self._check_ollama()
+        
+        # 绑定实际使用的嵌入模型，模型变更时旧缓存自动失效
+        if self.embedding_cache is not None:
+            self.embedding_cache.bind_model(self.ollama_model)
+    
+    def _init_storage(self):
+        """初始化底层存储（其他后端覆盖此方法）"""
+        self._init_chroma()
     
     def _init_chroma(self):
         """初始化ChromaDB"""
@@ -78,6 +139,11 @@ class VectorStore:
             logger.error(f"ChromaDB初始化失败: {str(e)}")
             raise
     
+    def _bump_corpus_version(self):
+        """语料发生变化，之前缓存的检索结果不再命中"""
+        with self._version_lock:
+            self.corpus_version += 1
+    
     def _check_ollama(self):
         """检查Ollama服务是否可用"""
         try:
@@ -107,7 +173,21 @@ class VectorStore:
         except Exception as e:
             logger.warning(f"Ollama服务检查失败: {str(e)}，将使用备用嵌入方案")
     
-    def _ollama_embed(self, text: str) -> List[float]:
+    def _fit_dimension(self, embedding: List[float]) -> List[float]:
+        """确保向量维度为768维（截断或补零）"""
+        target_dim = 768
+        current_dim = len(embedding)
+        
+        if current_dim == target_dim:
+            return embedding
+        elif current_dim > target_dim:
+            # 截断到768维
+            return embedding[:target_dim]
+        else:
+            # 填充到768维
+            return embedding + [0.0] * (target_dim - current_dim)
+    
+    def _ollama_embed(self, text: str) -> Optional[List[float]]:
         """
         使用Ollama生成嵌入向量
         
@@ -115,7 +195,7 @@ class VectorStore:
             text: 输入文本
             
         Returns:
-            向量表示（固定768维）
+            向量表示（固定768维），失败时为None
         """
         try:
             response = requests.post(
@@ -131,52 +211,115 @@ class VectorStore:
                 result = response.json()
                 embedding = result.get('embedding', [])
                 if embedding:
-                    # 确保向量维度为768维
-                    target_dim = 768
-                    current_dim = len(embedding)
-                    
-                    if current_dim == target_dim:
-                        return embedding
-                    elif current_dim > target_dim:
-                        # 截断到768维
-                        return embedding[:target_dim]
-                    else:
-                        # 填充到768维
-                        embedding.extend([0.0] * (target_dim - current_dim))
-                        return embedding
+                    return self._fit_dimension(embedding)
             
             logger.warning(f"Ollama嵌入生成失败，状态码: {response.status_code}")
-            return self._fallback_encode(text)
+            return None
             
         except Exception as e:
             logger.warning(f"Ollama嵌入请求失败: {str(e)}")
+            return None
+    
+    def _ollama_embed_batch(self, texts: List[str]) -> Optional[List[List[float]]]:
+        """
+        使用Ollama /api/embed 一次请求生成多条嵌入
+        
+        Args:
+            texts: 文本列表
+            
+        Returns:
+            向量列表；服务返回异常时为None（网络错误直接抛出）
+        """
+        response = requests.post(
+            f"{self.ollama_url}/api/embed",
+            json={
+                "model": self.ollama_model,
+                "input": texts
+            },
+            timeout=60
+        )
+        
+        if response.status_code == 200:
+            embeddings = response.json().get('embeddings', [])
+            if len(embeddings) == len(texts) and all(embeddings):
+                return [self._fit_dimension(e) for e in embeddings]
+        
+        logger.warning(f"Ollama批量嵌入失败，状态码: {response.status_code}")
+        return None
+    
+    def _lookup_cache(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """从嵌入缓存读取，未命中的位置为None"""
+        if self.embedding_cache is None:
+            return [None] * len(texts)
+        return self.embedding_cache.get_many(self.ollama_model, texts)
+    
+    def _store_cache(self, texts: List[str], embeddings: List[List[float]]):
+        """写入嵌入缓存（仅缓存Ollama生成的向量，不缓存备用编码）"""
+        if self.embedding_cache is not None:
+            self.embedding_cache.set_many(self.ollama_model, texts, embeddings)
+    
+    def _embed_one(self, text: str) -> List[float]:
+        """调用Ollama编码单条文本，失败时使用备用编码"""
+        embedding = self._ollama_embed(text)
+        if embedding is None:
             return self._fallback_encode(text)
+        self._store_cache([text], [embedding])
+        return embedding
+    
+    def _encode_batch(self, texts: List[str]) -> List[List[float]]:
+        """编码单个批次，失败时仅对该批次回退"""
+        try:
+            embeddings = self._ollama_embed_batch(texts)
+            if embeddings is not None:
+                self._store_cache(texts, embeddings)
+                return embeddings
+            # 服务可达但批量接口不可用（如旧版Ollama），逐条调用
+            return [self._embed_one(text) for text in texts]
+        except Exception as e:
+            # 服务不可达，直接使用备用编码，避免逐条重复等待超时
+            logger.warning(f"Ollama批量嵌入请求失败: {str(e)}，该批次使用备用编码")
+            return self._fallback_encode_batch(texts)
     
     def _fallback_encode(self, text: str) -> List[float]:
         """
         备用编码方案：基于简单词频的哈希向量
         当Ollama不可用时使用
         """
-        import hashlib
+        return self._fallback_encode_batch([text])[0]
+    
+    def _fallback_encode_batch(self, texts: List[str]) -> List[List[float]]:
+        """
+        批量备用编码：字符三字组哈希到768维后计数并归一化
+        
+        三字组打包为整数后去重，每个不同的三字组只计算一次下标（跨调用缓存），
+        计数用一次bincount完成
+        
+        Args:
+            texts: 文本列表
+            
+        Returns:
+            向量列表（与输入顺序一致）
+        """
+        if not texts:
+            return []
         
-        # 生成768维的向量（与nomic-embed-text模型一致）
-        vector_dim = 768
-        vector = np.zeros(vector_dim)
+        keys_per_text = [_trigram_keys(text.lower()) for text in texts]
+        all_keys = np.concatenate(keys_per_text)
+        unique_keys, inverse = np.unique(all_keys, return_inverse=True)
+        buckets = np.fromiter((_bucket_of(key) for key in unique_keys.tolist()), dtype=np.int64, count=len(unique_keys))
         
-        # 使用字符n-gram生成向量
-        text = text.lower()
-        for i in range(len(text) - 2):
-            trigram = text[i:i+3]
-            hash_val = int(hashlib.md5(trigram.encode()).hexdigest(), 16)
-            idx = hash_val % vector_dim
-            vector[idx] += 1
+        # 每条文本的下标偏移 i*768，一次bincount得到全部计数矩阵
+        rows = np.repeat(np.arange(len(texts)), [len(keys) for keys in keys_per_text])
+        vectors = np.bincount(
+            rows * FALLBACK_VECTOR_DIM + buckets[inverse],
+            minlength=len(texts) * FALLBACK_VECTOR_DIM
+        ).reshape(len(texts), FALLBACK_VECTOR_DIM).astype(np.float64)
         
         # 归一化
-        norm = np.linalg.norm(vector)
-        if norm > 0:
-            vector = vector / norm
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        np.divide(vectors, norms, out=vectors, where=norms > 0)
         
-        return vector.tolist()
+        return vectors.tolist()
     
     def encode_text(self, text: str) -> List[float]:
         """
@@ -188,39 +331,110 @@ class VectorStore:
         Returns:
             向量表示
         """
+        cached = self._lookup_cache([text])[0]
+        if cached is not None:
+            return cached
+        
         try:
             # 优先使用Ollama
-            return self._ollama_embed(text)
+            return self._embed_one(text)
         except Exception as e:
             logger.error(f"文本编码失败: {str(e)}")
             return self._fallback_encode(text)
     
-    def encode_texts(self, texts: List[str]) -> List[List[float]]:
+    def encode_texts(
+        self,
+        texts: List[str],
+        progress_callback: Optional[Callable[[int, int], None]] = None
+    ) -> List[List[float]]:
         """
         批量编码文本
         
+        先查嵌入缓存，未命中的文本去重后按ollama_embed_batch_size分批调用/api/embed，
+        最多ollama_embed_max_inflight批并行
+        
         Args:
             texts: 文本列表
+            progress_callback: 进度回调，每完成一批调用一次 (已完成数, 总数)
             
         Returns:
-            向量列表
+            向量列表（与输入顺序一致）
         """
-        embeddings = []
-        for text in texts:
-            try:
-                embedding = self._ollama_embed(text)
-                embeddings.append(embedding)
-            except Exception as e:
-                logger.warning(f"批量编码中单条失败: {str(e)}")
-                embeddings.append(self._fallback_encode(text))
-        return embeddings
+        if not texts:
+            return []
+        
+        embeddings = self._lookup_cache(texts)
+        missing = list(dict.fromkeys(text for text, e in zip(texts, embeddings) if e is None))
+        total = len(texts)
+        done = total - sum(1 for e in embeddings if e is None)
+        if progress_callback:
+            progress_callback(done, total)
+        if not missing:
+            return embeddings
+        
+        batch_size = max(1, settings.ollama_embed_batch_size)
+        batches = [missing[i:i + batch_size] for i in range(0, len(missing), batch_size)]
+        progress_lock = threading.Lock()
+        
+        def encode_and_report(batch: List[str]) -> List[List[float]]:
+            nonlocal done
+            result = self._encode_batch(batch)
+            if progress_callback:
+                with progress_lock:
+                    done = min(total, done + len(batch))
+                    progress_callback(done, total)
+            return result
+        
+        if len(batches) == 1:
+            results = [encode_and_report(batches[0])]
+        else:
+            max_workers = max(1, min(settings.ollama_embed_max_inflight, len(batches)))
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                results = list(pool.map(encode_and_report, batches))
+        
+        computed = dict(zip(missing, (embedding for batch in results for embedding in batch)))
+        return [e if e is not None else computed[text] for text, e in zip(texts, embeddings)]
     
-    def add_chunks(self, chunks: List[DocumentChunk]) -> bool:
+    def _embed_pending(
+        self,
+        chunks: List[DocumentChunk],
+        progress_callback: Optional[Callable[[int, int], None]] = None
+    ):
+        """为还没有向量的文档块批量生成嵌入"""
+        pending = [chunk for chunk in chunks if not chunk.embedding]
+        if pending:
+            new_embeddings = self.encode_texts(
+                [chunk.content for chunk in pending],
+                progress_callback=progress_callback
+            )
+            for chunk, embedding in zip(pending, new_embeddings):
+                chunk.embedding = embedding
+    
+    @staticmethod
+    def _chunk_metadata(chunk: DocumentChunk, extra_metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """文档块写入存储时的元数据"""
+        return {
+            'document_id': chunk.document_id,
+            'chunk_index': chunk.chunk_index,
+            'start_pos': chunk.start_pos,
+            'end_pos': chunk.end_pos,
+            **chunk.metadata,
+            **(extra_metadata or {})
+        }
+    
+    def add_chunks(
+        self,
+        chunks: List[DocumentChunk],
+        progress_callback: Optional[Callable[[int, int], None]] = None,
+        extra_metadata: Optional[Dict[str, Any]] = None
+    ) -> bool:
         """
         添加文档块到向量存储
         
         Args:
             chunks: 文档块列表
+            progress_callback: 嵌入进度回调 (已完成数, 总数)
+            extra_metadata: 附加到每个块的元数据（如知识库归属标记）
             
         Returns:
             是否成功
@@ -237,21 +451,14 @@ class VectorStore:
             
             logger.info(f"开始为 {len(chunks)} 个文档块生成嵌入向量...")
             
+            # 批量生成缺失的嵌入
+            self._embed_pending(chunks, progress_callback)
+            
             for chunk in chunks:
-                # 生成嵌入
-                if not chunk.embedding:
-                    chunk.embedding = self.encode_text(chunk.content)
-                
                 ids.append(chunk.chunk_id)
                 documents.append(chunk.content)
                 embeddings.append(chunk.embedding)
-                metadatas.append({
-                    'document_id': chunk.document_id,
-                    'chunk_index': chunk.chunk_index,
-                    'start_pos': chunk.start_pos,
-                    'end_pos': chunk.end_pos,
-                    **chunk.metadata
-                })
+                metadatas.append(self._chunk_metadata(chunk, extra_metadata))
             
             # 批量添加到ChromaDB
             self.collection.add(
@@ -260,6 +467,7 @@ class VectorStore:
                 embeddings=embeddings,
                 metadatas=metadatas
             )
+            self._bump_corpus_version()
             
             logger.info(f"成功添加 {len(chunks)} 个文档块到向量存储")
             return True
@@ -272,19 +480,48 @@ class VectorStore:
         self,
         query: str,
         top_k: int = 5,
-        score_threshold: float = 0.5
+        score_threshold: float = 0.5,
+        where: Optional[Dict[str, Any]] = None
     ) -> List[SearchResult]:
         """
         相似度搜索
         
+        同一语料版本下相同的 (查询, top_k, 阈值, 过滤条件) 在缓存有效期内直接返回上次结果，
+        不再重新编码查询和检索
+        
         Args:
             query: 查询文本
             top_k: 返回结果数量
             score_threshold: 相似度阈值 (0-1，越大越相似)
+            where: 元数据过滤条件，在向量检索内部生效（如 {kb_membership_key(kb_id): True}）
             
         Returns:
             搜索结果列表
         """
+        if self.retrieval_cache is None:
+            return self._search(query, top_k, score_threshold, where)
+        
+        # 检索前读取版本：检索期间语料变化时，结果存在旧版本下，不会被之后的查询命中
+        key = hash_key([self.corpus_version, query, top_k, score_threshold, where])
+        cached = self.retrieval_cache.get(key)
+        if cached is None:
+            cached = self._search(query, top_k, score_threshold, where)
+            # 空结果不缓存：检索出错时同样返回空列表，不能让一次临时故障在有效期内持续生效
+            if cached:
+                self.retrieval_cache.set(key, cached)
+        else:
+            logger.info(f"检索缓存命中，{len(cached)} 个结果")
+        # 调用方会在结果上补充文档信息，返回副本
+        return [result.model_copy() for result in cached]
+    
+    def _search(
+        self,
+        query: str,
+        top_k: int,
+        score_threshold: float,
+        where: Optional[Dict[str, Any]]
+    ) -> List[SearchResult]:
+        """执行ChromaDB向量检索（不经过缓存）"""
         try:
             # 编码查询
             query_embedding = self.encode_text(query)
@@ -293,6 +530,7 @@ class VectorStore:
             results = self.collection.query(
                 query_embeddings=[query_embedding],
                 n_results=top_k,
+                where=where,
                 include=['documents', 'metadatas', 'distances']
             )
             
@@ -310,18 +548,10 @@ class VectorStore:
                     if similarity < score_threshold:
                         continue
                     
-                    metadata = results['metadatas'][0][i]
-                    content = results['documents'][0][i]
-                    
-                    chunk = DocumentChunk(
-                        chunk_id=chunk_id,
-                        document_id=metadata['document_id'],
-                        content=content,
-                        chunk_index=metadata['chunk_index'],
-                        start_pos=metadata['start_pos'],
-                        end_pos=metadata['end_pos'],
-                        metadata={k: v for k, v in metadata.items() 
-                                if k not in ['document_id', 'chunk_index', 'start_pos', 'end_pos']}
+                    chunk = self._to_chunk(
+                        chunk_id,
+                        results['documents'][0][i],
+                        results['metadatas'][0][i]
                     )
                     
                     search_results.append(SearchResult(
@@ -339,6 +569,78 @@ class VectorStore:
             logger.error(f"搜索失败: {str(e)}")
             return []
     
+    @staticmethod
+    def _to_chunk(chunk_id: str, content: str, metadata: Dict[str, Any]) -> DocumentChunk:
+        """把ChromaDB的记录还原为文档块"""
+        return DocumentChunk(
+            chunk_id=chunk_id,
+            document_id=metadata['document_id'],
+            content=content,
+            chunk_index=metadata['chunk_index'],
+            start_pos=metadata['start_pos'],
+            end_pos=metadata['end_pos'],
+            metadata={k: v for k, v in metadata.items() 
+                    if k not in ['document_id', 'chunk_index', 'start_pos', 'end_pos']
+                    and not k.startswith(KB_MEMBERSHIP_PREFIX)}
+        )
+    
+    def get_chunks(self, chunk_ids: List[str]) -> Dict[str, DocumentChunk]:
+        """
+        按ID读取文档块（不含向量）
+        
+        Args:
+            chunk_ids: 文档块ID列表
+            
+        Returns:
+            chunk_id -> 文档块，不存在的ID不返回
+        """
+        if not chunk_ids:
+            return {}
+        try:
+            results = self.collection.get(ids=chunk_ids, include=['documents', 'metadatas'])
+            return {
+                chunk_id: self._to_chunk(chunk_id, content, metadata)
+                for chunk_id, content, metadata in zip(
+                    results['ids'], results['documents'], results['metadatas']
+                )
+            }
+        except Exception as e:
+            logger.error(f"读取文档块失败: {str(e)}")
+            return {}
+    
+    def set_kb_membership(self, document_ids: List[str], kb_id: str, member: bool) -> bool:
+        """
+        更新文档块的知识库归属标记（只改元数据，不重新嵌入）
+        
+        Args:
+            document_ids: 文档ID列表
+            kb_id: 知识库ID
+            member: True为加入，False为移除
+            
+        Returns:
+            是否成功
+        """
+        if not document_ids:
+            return True
+        try:
+            where = (
+                {"document_id": document_ids[0]} if len(document_ids) == 1
+                else {"document_id": {"$in": list(document_ids)}}
+            )
+            results = self.collection.get(where=where, include=[])
+            if results['ids']:
+                # ChromaDB的update按键合并元数据，值为None时删除该键
+                value = True if member else None
+                self.collection.update(
+                    ids=results['ids'],
+                    metadatas=[{kb_membership_key(kb_id): value}] * len(results['ids'])
+                )
+                self._bump_corpus_version()
+            return True
+        except Exception as e:
+            logger.error(f"更新知识库归属标记失败: kb_id={kb_id}, 错误: {str(e)}")
+            return False
+    
     def delete_by_document_id(self, document_id: str) -> bool:
         """
         删除指定文档的所有块
@@ -357,6 +659,7 @@ class VectorStore:
             
             if results['ids']:
                 self.collection.delete(ids=results['ids'])
+                self._bump_corpus_version()
                 logger.info(f"成功删除文档 {document_id} 的 {len(results['ids'])} 个块")
             
             return True
@@ -373,7 +676,9 @@ class VectorStore:
                 'total_chunks': count,
                 'collection_name': self.collection_name,
                 'persist_directory': self.persist_directory,
-                'embedding_model': self.ollama_model
+                'embedding_model': self.ollama_model,
+                'corpus_version': self.corpus_version,
+                'retrieval_cache': self.retrieval_cache.stats() if self.retrieval_cache else None
             }
         except Exception as e:
             logger.error(f"获取统计信息失败: {str(e)}")
@@ -387,6 +692,7 @@ class VectorStore:
                 name=self.collection_name,
                 metadata={"hnsw:space": "cosine"}
             )
+            self._bump_corpus_version()
             logger.info("向量存储已清空")
             return True
         except Exception as e:
@@ -394,5 +700,13 @@ class VectorStore:
             return False
 
 
-# 全局向量存储实例
-vector_store = VectorStore()
+def create_vector_store(**kwargs) -> VectorStore:
+    """
+    按配置创建向量存储
+    
+    kb_vector_backend为numpy时使用进程内精确检索（适合10万块以内的语料），否则使用ChromaDB
+    """
+    if settings.kb_vector_backend == "numpy":
+        from .numpy_vector_store import NumpyVectorStore
+        return NumpyVectorStore(**kwargs)
+    return VectorStore(**kwargs)
@@ -3,6 +3,7 @@ from pathlib import Path
 
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
@@ -10,15 +11,40 @@ from backend.routers.stream import router as stream_router
 from backend.routers.export import router as export_router
 from backend.routers.knowledge_base import router as kb_router
 from backend.routers.templates import router as templates_router
+from backend.routers.cache import router as cache_router
+from backend.models.llm import deepseek_client
+from backend.tools.search import search_tool
+from backend.conversation import conversation_manager
+from backend.knowledge_base import knowledge_base_manager
+from backend.agents.graph import workflow
+from backend.config import settings
+import asyncio
 import logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 清理中途放弃、长时间未恢复的工作流检查点
+    await asyncio.to_thread(workflow.checkpointer.prune, settings.workflow_checkpoint_ttl)
+    yield
+    # 关闭时释放连接池
+    await deepseek_client.aclose()
+    await search_tool.aclose()
+    logger.info("LLM与搜索客户端连接池已关闭")
+    # 停止后台文档处理，写入尚未落盘的会话修改
+    knowledge_base_manager.shutdown()
+    conversation_manager.close()
+    workflow.checkpointer.close()
+
+
 app = FastAPI(
     title="个人工作助手 API",
     description="基于LangGraph的AI工作流助手",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 app.add_middleware(
@@ -33,6 +59,7 @@ app.include_router(stream_router, prefix="/api", tags=["stream"])
 app.include_router(export_router, prefix="/api", tags=["export"])
 app.include_router(kb_router, prefix="/api", tags=["knowledge-base"])
 app.include_router(templates_router, prefix="/api", tags=["templates"])
+app.include_router(cache_router, prefix="/api", tags=["cache"])
 
 
 @app.get("/api/health")
@@ -45,7 +72,6 @@ app.mount("/", StaticFiles(directory=".", html=True), name="static")
 
 if __name__ == "__main__":
     import uvicorn
-    from backend.config import settings
     
     uvicorn.run(
         "backend.main:app",
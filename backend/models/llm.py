@@ -1,5 +1,9 @@
-from openai import OpenAI
+import asyncio
+import httpx
+from typing import AsyncIterator, Optional
+from openai import OpenAI, AsyncOpenAI
 from backend.config import settings
+from backend.cache import TTLCache, hash_key
 
 
 class DeepSeekClient:
@@ -8,14 +12,104 @@ class DeepSeekClient:
             api_key=settings.deepseek_api_key,
             base_url=settings.deepseek_base_url
         )
+        # 异步客户端：共享连接池（keep-alive），供工作流节点await调用
+        self.async_client = AsyncOpenAI(
+            api_key=settings.deepseek_api_key,
+            base_url=settings.deepseek_base_url,
+            timeout=settings.llm_timeout,
+            http_client=httpx.AsyncClient(
+                timeout=settings.llm_timeout,
+                limits=httpx.Limits(
+                    max_connections=settings.llm_max_connections,
+                    max_keepalive_connections=settings.llm_max_connections
+                )
+            )
+        )
+        # 限制同时进行的LLM请求数，避免突发并发压垮上游
+        self._semaphore = asyncio.Semaphore(settings.llm_max_concurrency)
+        # 响应缓存：键为模型 + 消息 + 采样参数的内容哈希，调用方按需启用
+        self.cache: Optional[TTLCache] = None
+        if settings.llm_cache_enabled:
+            self.cache = TTLCache(
+                "llm",
+                max_entries=settings.llm_cache_max_entries,
+                ttl=settings.llm_cache_ttl,
+                db_path=settings.llm_cache_db_path or None
+            )
+
+    def _cache_key(self, messages: list, model: str, params: dict, use_cache: bool) -> Optional[str]:
+        if not use_cache or self.cache is None:
+            return None
+        return hash_key({"model": model, "messages": messages, "params": params})
+
+    def _get_cached(self, cache_key: Optional[str]) -> Optional[str]:
+        return self.cache.get(cache_key) if cache_key else None
+
+    def _set_cached(self, cache_key: Optional[str], content: Optional[str]):
+        if cache_key and content:
+            self.cache.set(cache_key, content)
+
+    async def _aget_cached(self, cache_key: Optional[str]) -> Optional[str]:
+        return await self.cache.aget(cache_key) if cache_key else None
+
+    async def _aset_cached(self, cache_key: Optional[str], content: Optional[str]):
+        if cache_key and content:
+            await self.cache.aset(cache_key, content)
+
+    def chat_completion(self, messages: list, model: str = "deepseek-chat",
+                        use_cache: bool = False, **kwargs) -> str:
+        cache_key = self._cache_key(messages, model, kwargs, use_cache)
+        cached = self._get_cached(cache_key)
+        if cached is not None:
+            return cached
 
-    def chat_completion(self, messages: list, model: str = "deepseek-chat", **kwargs) -> str:
         response = self.client.chat.completions.create(
             model=model,
             messages=messages,
             **kwargs
         )
-        return response.choices[0].message.content
+        content = response.choices[0].message.content
+        self._set_cached(cache_key, content)
+        return content
+
+    async def achat_completion(self, messages: list, model: str = "deepseek-chat",
+                               use_cache: bool = False, **kwargs) -> str:
+        """异步调用，不阻塞事件循环；use_cache=True时相同请求直接返回缓存结果"""
+        cache_key = self._cache_key(messages, model, kwargs, use_cache)
+        cached = await self._aget_cached(cache_key)
+        if cached is not None:
+            return cached
+
+        async with self._semaphore:
+            response = await self.async_client.chat.completions.create(
+                model=model,
+                messages=messages,
+                **kwargs
+            )
+        content = response.choices[0].message.content
+        await self._aset_cached(cache_key, content)
+        return content
+
+    async def astream_chat_completion(self, messages: list, model: str = "deepseek-chat",
+                                      **kwargs) -> AsyncIterator[str]:
+        """异步流式调用，逐段产出增量文本"""
+        async with self._semaphore:
+            stream = await self.async_client.chat.completions.create(
+                model=model,
+                messages=messages,
+                stream=True,
+                **kwargs
+            )
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    yield delta
+
+    async def aclose(self):
+        """关闭异步连接池（应用关闭时调用）"""
+        await self.async_client.close()
 
 
 deepseek_client = DeepSeekClient()
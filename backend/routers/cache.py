@@ -0,0 +1,19 @@
+"""
+缓存统计路由 - 查看各缓存层的命中情况
+"""
+from fastapi import APIRouter
+from backend.models.llm import deepseek_client
+from backend.knowledge_base.embedding_cache import embedding_cache
+from backend.tools.search import search_tool
+
+router = APIRouter()
+
+
+@router.get("/cache/stats")
+async def get_cache_stats():
+    """获取缓存命中统计"""
+    return {
+        "search": search_tool.cache.stats() if search_tool.cache else None,
+        "llm": deepseek_client.cache.stats() if deepseek_client.cache else None,
+        "embedding": embedding_cache.stats() if embedding_cache else None
+    }
@@ -6,6 +6,7 @@
 from fastapi import APIRouter, UploadFile, File, HTTPException, Query
 from fastapi.responses import JSONResponse
 from typing import List, Optional
+import asyncio
 import logging
 
 from backend.knowledge_base import knowledge_base_manager
@@ -25,6 +26,9 @@ async def upload_document(
     上传文档到知识库
     
     支持格式: txt, md, doc, docx, xls, xlsx, ppt, pptx, pdf
+    
+    文件保存后立即返回（状态为pending），解析和嵌入在后台进行，
+    可通过 /documents/{document_id}/progress 查询进度
     """
     try:
         # 读取文件内容
@@ -34,8 +38,9 @@ async def upload_document(
         if len(content) > 50 * 1024 * 1024:
             raise HTTPException(400, "文件大小超过50MB限制")
         
-        # 上传并处理文档
-        result = knowledge_base_manager.upload_document(
+        # 保存文件并加入后台处理队列
+        result = await asyncio.to_thread(
+            knowledge_base_manager.submit_document,
             file_content=content,
             filename=file.filename,
             kb_id=kb_id
@@ -81,11 +86,12 @@ async def list_documents(
                     'file_type': doc.file_type.value,
                     'file_size': doc.file_size,
                     'status': doc.status.value,
-                    'chunk_count': len(doc.chunks),
-                    'word_count': len(doc.content) if doc.content else 0,
+                    'chunk_count': doc.chunk_count,
+                    'word_count': doc.word_count,
                     'created_at': doc.created_at.isoformat(),
                     'updated_at': doc.updated_at.isoformat(),
-                    'error_message': doc.error_message
+                    'error_message': doc.error_message,
+                    'progress': knowledge_base_manager.ingest_progress.get(doc.document_id)
                 }
                 for doc in documents
             ],
@@ -99,11 +105,22 @@ async def list_documents(
         raise HTTPException(500, f"查询失败: {str(e)}")
 
 
+@router.get("/documents/{document_id}/progress")
+async def get_document_progress(document_id: str):
+    """获取文档后台处理进度"""
+    progress = knowledge_base_manager.get_ingest_progress(document_id)
+    
+    if progress is None:
+        raise HTTPException(404, "文档不存在")
+    
+    return JSONResponse(content=progress)
+
+
 @router.get("/documents/{document_id}")
 async def get_document(document_id: str):
     """获取文档详情"""
     try:
-        document = knowledge_base_manager.get_document(document_id)
+        document = knowledge_base_manager.get_document(document_id, with_content=True)
         
         if not document:
             raise HTTPException(404, "文档不存在")
@@ -115,8 +132,8 @@ async def get_document(document_id: str):
             'file_size': document.file_size,
             'status': document.status.value,
             'content_preview': document.content[:1000] if document.content else None,
-            'chunk_count': len(document.chunks),
-            'word_count': len(document.content) if document.content else 0,
+            'chunk_count': document.chunk_count,
+            'word_count': document.word_count,
             'metadata': document.metadata,
             'created_at': document.created_at.isoformat(),
             'updated_at': document.updated_at.isoformat(),
@@ -155,22 +172,26 @@ async def delete_document(document_id: str):
 async def search_knowledge_base(
     query: str,
     top_k: int = Query(5, ge=1, le=20),
-    kb_id: Optional[str] = Query(None)
+    kb_id: Optional[str] = Query(None),
+    mode: str = Query("vector", pattern="^(vector|keyword|hybrid)$", description="vector/keyword/hybrid")
 ):
     """
     搜索知识库
     
-    返回与查询最相关的文档片段
+    返回与查询最相关的文档片段。mode=keyword 只用BM25关键词检索（不调用嵌入模型），
+    mode=hybrid 将向量和关键词结果按倒数排名融合
     """
     try:
         results = knowledge_base_manager.search_knowledge_base(
             query=query,
             top_k=top_k,
-            kb_id=kb_id
+            kb_id=kb_id,
+            mode=mode
         )
         
         return JSONResponse(content={
             'query': query,
+            'mode': mode,
             'results': [
                 {
                     'chunk_id': result.chunk.chunk_id,
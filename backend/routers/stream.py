@@ -3,11 +3,15 @@ from fastapi.params import Query
 from sse_starlette.sse import EventSourceResponse
 from backend.agents.graph import workflow
 from backend.models.schemas import StreamRequest
-from backend.conversation import conversation_manager
+from backend.agents.confirmation import confirmation_broker
+from backend.conversation import conversation_manager, MessageType
+from backend.config import settings
+from langgraph.types import Command
 import logging
 import json
 import asyncio
 import traceback
+from typing import Optional
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -15,6 +19,370 @@ logger.setLevel(logging.INFO)
 router = APIRouter()
 
 
+# 各操作类型的最后一个节点，其输出保存到会话并推送给前端
+FINAL_OUTPUT_NODES = {
+    "generate": "report_generator",
+    "follow_up": "qa_handler",
+    "modify": "modify_handler",
+    "supplement": "expand_handler"
+}
+
+
+async def _final_output_events(node_name: str, node_output: dict, conversation_id: str, operation_type: str):
+    """保存最终节点的输出（报告或回答）到会话，并生成对应的SSE事件"""
+    if node_name == "report_generator":
+        final_report = node_output.get("final_report", "")
+        print(f"报告生成完成，长度: {len(final_report)} 字符")
+        logger.info(f"报告生成完成，长度: {len(final_report)} 字符")
+
+        # 更新会话中的报告
+        conversation_manager.update_report(conversation_id, final_report, operation_type)
+
+        # 添加助手消息
+        conversation_manager.add_message(
+            conversation_id=conversation_id,
+            role="assistant",
+            content=final_report,
+            msg_type=MessageType.REPORT
+        )
+
+        yield {
+            "event": "final_report",
+            "data": json.dumps({
+                "content": final_report,
+                "conversation_id": conversation_id
+            })
+        }
+        await asyncio.sleep(0.1)
+
+    elif node_name == "qa_handler":
+        answer = node_output.get("answer", "")
+        print(f"QA回答生成完成，长度: {len(answer)} 字符")
+        logger.info(f"QA回答生成完成，长度: {len(answer)} 字符")
+
+        # 添加助手回答消息
+        conversation_manager.add_message(
+            conversation_id=conversation_id,
+            role="assistant",
+            content=answer,
+            msg_type=MessageType.ANSWER
+        )
+
+        yield {
+            "event": "answer",
+            "data": json.dumps({
+                "content": answer,
+                "conversation_id": conversation_id,
+                "type": "follow_up"
+            })
+        }
+        await asyncio.sleep(0.1)
+
+    elif node_name == "modify_handler":
+        final_report = node_output.get("final_report", "")
+        modification = node_output.get("modification", "")
+        print(f"报告修改完成，长度: {len(final_report)} 字符")
+        logger.info(f"报告修改完成，长度: {len(final_report)} 字符")
+
+        # 更新会话中的报告
+        conversation_manager.update_report(conversation_id, final_report, "modify")
+
+        # 添加助手消息
+        conversation_manager.add_message(
+            conversation_id=conversation_id,
+            role="assistant",
+            content=final_report,
+            msg_type=MessageType.REPORT,
+            metadata={"modification": modification}
+        )
+
+        yield {
+            "event": "final_report",
+            "data": json.dumps({
+                "content": final_report,
+                "conversation_id": conversation_id,
+                "type": "modification",
+                "modification": modification
+            })
+        }
+        await asyncio.sleep(0.1)
+
+    elif node_name == "expand_handler":
+        final_report = node_output.get("final_report", "")
+        expansion = node_output.get("expansion", "")
+        print(f"内容补充完成，长度: {len(final_report)} 字符")
+        logger.info(f"内容补充完成，长度: {len(final_report)} 字符")
+
+        # 更新会话中的报告
+        conversation_manager.update_report(conversation_id, final_report, "supplement")
+
+        # 添加助手消息
+        conversation_manager.add_message(
+            conversation_id=conversation_id,
+            role="assistant",
+            content=final_report,
+            msg_type=MessageType.REPORT,
+            metadata={"expansion": expansion}
+        )
+
+        yield {
+            "event": "final_report",
+            "data": json.dumps({
+                "content": final_report,
+                "conversation_id": conversation_id,
+                "type": "supplement",
+                "expansion": expansion
+            })
+        }
+        await asyncio.sleep(0.1)
+
+
+async def _workflow_events(graph_input, conversation_id: str, operation_type: str):
+    """
+    执行（或恢复）工作流，把节点更新转换为SSE事件并保存结果到会话
+    
+    Args:
+        graph_input: 初始状态，或用户确认后恢复用的 Command(resume=是否同意搜索)
+        conversation_id: 会话ID，同时作为检查点的thread_id
+        operation_type: 操作类型
+    """
+    retry_count = 0
+    config = {"configurable": {"thread_id": conversation_id}}
+    async for stream_mode, event in workflow.astream(graph_input, config, stream_mode=["updates", "custom"]):
+        # 节点推送的增量内容（report_delta）直接转发，不做延时
+        if stream_mode == "custom":
+            yield {
+                "event": event["event"],
+                "data": json.dumps({
+                    "content": event["content"],
+                    "conversation_id": conversation_id,
+                    "type": event["type"]
+                }, ensure_ascii=False)
+            }
+            continue
+        
+        for node_name, node_output in event.items():
+            print(f"收到节点事件: {node_name}")
+            logger.info(f"收到节点事件: {node_name}")
+            
+            # 工作流在用户确认节点中断，记录等待状态（由调用方等待确认后恢复）
+            if node_name == "__interrupt__":
+                payload = node_output[0].value if node_output else {}
+                conversation_manager.update_conversation(
+                    conversation_id=conversation_id,
+                    updates={
+                        "needs_user_confirmation": True,
+                        "user_confirmation_status": None,
+                        "user_confirmed_search": None,
+                        "confirmation_prompt": payload.get("prompt")
+                    }
+                )
+                logger.info("等待用户确认...")
+            
+            # v5.0: 意图识别节点事件
+            elif node_name == "intent_recognizer":
+                intent_analysis = node_output.get("intent_analysis", {})
+                print(f"意图识别完成: {intent_analysis.get('intent_type')}")
+                logger.info(f"意图识别完成: {intent_analysis.get('intent_type')}")
+                yield {
+                    "event": "intent_analysis",
+                    "data": json.dumps(intent_analysis)
+                }
+                await asyncio.sleep(0.1)
+            
+            # v5.0: 知识库检索节点事件
+            elif node_name == "knowledge_base_search":
+                sufficiency_level = node_output.get("kb_sufficiency_level")
+                relevance_score = node_output.get("kb_relevance_score", 0.0)
+                coverage_score = node_output.get("kb_coverage_score", 0.0)
+                needs_confirmation = node_output.get("needs_user_confirmation", False)
+                confirmation_prompt = node_output.get("confirmation_prompt")
+                
+                print(f"知识库评估: {sufficiency_level}, 相关度: {relevance_score:.2f}")
+                logger.info(f"知识库评估: {sufficiency_level}, 相关度: {relevance_score:.2f}")
+                
+                yield {
+                    "event": "kb_evaluation",
+                    "data": json.dumps({
+                        "sufficiency_level": sufficiency_level,
+                        "relevance_score": relevance_score,
+                        "coverage_score": coverage_score,
+                        "needs_confirmation": needs_confirmation,
+                        "prompt": confirmation_prompt
+                    })
+                }
+                await asyncio.sleep(0.1)
+                
+                # v5.0: 如果需要用户确认，发送确认请求事件
+                if needs_confirmation:
+                    print("发送用户确认请求")
+                    logger.info("发送用户确认请求")
+                    yield {
+                        "event": "user_confirmation_required",
+                        "data": json.dumps({
+                            "prompt": confirmation_prompt or "是否需要通过搜索获取更多信息？",
+                            "sufficiency_level": sufficiency_level,
+                            "conversation_id": conversation_id
+                        })
+                    }
+                    await asyncio.sleep(0.1)
+            
+            # v5.0: 用户确认后的路由节点
+            elif node_name == "post_confirmation_router":
+                user_confirmed = node_output.get("user_confirmed_search")
+                sufficiency_level = node_output.get("kb_sufficiency_level")
+                
+                if user_confirmed:
+                    print(f"用户已确认搜索，继续执行")
+                    logger.info(f"用户已确认搜索，继续执行")
+                else:
+                    print(f"用户未确认搜索，sufficiency_level: {sufficiency_level}")
+                    logger.info(f"用户未确认搜索，sufficiency_level: {sufficiency_level}")
+            
+            elif node_name == "planner":
+                plan_steps = node_output.get("plan_steps", [])
+                print(f"规划生成 {len(plan_steps)} 个步骤")
+                logger.info(f"规划生成 {len(plan_steps)} 个步骤")
+                yield {
+                    "event": "planner_update",
+                    "data": json.dumps({
+                        "step": f"已生成 {len(plan_steps)} 个执行步骤",
+                        "plan": plan_steps
+                    })
+                }
+                await asyncio.sleep(0.1)
+            
+            elif node_name == "executor":
+                search_results = node_output.get("search_results", [])
+                print(f"执行器返回 {len(search_results)} 个搜索结果")
+                logger.info(f"执行器返回 {len(search_results)} 个搜索结果")
+                
+                # 保存搜索结果到会话
+                conversation_manager.save_search_results(conversation_id, search_results)
+                
+                for result in search_results:
+                    # 安全截断字符串，避免截断多字节字符导致乱码
+                    snippet = result.get("snippet", "")
+                    if len(snippet) > 200:
+                        # 找到第200个字符之前的最后一个完整字符
+                        snippet = snippet[:200]
+                        # 确保不截断在多字节字符中间
+                        while len(snippet.encode('utf-8')) > 200:
+                            snippet = snippet[:-1]
+                    
+                    yield {
+                        "event": "search_result",
+                        "data": json.dumps({
+                            "query": result.get("query", ""),
+                            "snippet": snippet
+                        }, ensure_ascii=False)
+                    }
+                    await asyncio.sleep(0.1)
+            
+            elif node_name == "verifier":
+                verification = node_output.get("verification", {})
+                is_valid = verification.get("is_valid", False)
+                print(f"验证结果: {'有效' if is_valid else '无效'}")
+                logger.info(f"验证结果: {'有效' if is_valid else '无效'}")
+                yield {
+                    "event": "verification_feedback",
+                    "data": json.dumps(verification)
+                }
+                await asyncio.sleep(0.1)
+                
+                if not is_valid:
+                    retry_count += 1
+                    print(f"触发重试，当前重试次数: {retry_count}")
+                    logger.info(f"触发重试，当前重试次数: {retry_count}")
+                    yield {
+                        "event": "retry_trigger",
+                        "data": json.dumps({
+                            "retry_count": retry_count,
+                            "message": "验证失败，重新规划"
+                        })
+                    }
+                    await asyncio.sleep(0.1)
+            
+            elif node_name in FINAL_OUTPUT_NODES.values():
+                async for item in _final_output_events(node_name, node_output, conversation_id, operation_type):
+                    yield item
+
+async def _stream_workflow(graph_input, conversation_id: str, operation_type: str):
+    """执行工作流并记录推送的事件，断线后恢复时先重放这些事件"""
+    async for item in _workflow_events(graph_input, conversation_id, operation_type):
+        # 增量内容不记录：所在节点完成后会有完整结果，未完成的节点恢复时会重新生成
+        if item["event"] != "report_delta":
+            seq = await workflow.checkpointer.aappend_event(conversation_id, item)
+            item = {**item, "id": str(seq)}
+        yield item
+
+
+async def _is_waiting_confirmation(conversation_id: str) -> bool:
+    """工作流是否停在用户确认中断处"""
+    snapshot = await workflow.aget_state({"configurable": {"thread_id": conversation_id}})
+    return bool(snapshot.interrupts)
+
+
+async def _drive_workflow(graph_input, conversation_id: str, operation_type: str, waiter):
+    """
+    执行工作流直到结束，在用户确认中断处挂起（不占用CPU）等待 /api/confirm 后继续
+    
+    Args:
+        graph_input: 初始状态；为None时从检查点继续
+        conversation_id: 会话ID
+        operation_type: 操作类型
+        waiter: confirmation_broker.open 返回的等待凭据
+    """
+    while True:
+        if graph_input is not None or not await _is_waiting_confirmation(conversation_id):
+            async for item in _stream_workflow(graph_input, conversation_id, operation_type):
+                yield item
+        
+        if not await _is_waiting_confirmation(conversation_id):
+            break
+        # 连接断开时检查点保留，确认后在后台或通过恢复接口继续
+        confirmed = await confirmation_broker.wait(waiter, timeout=settings.confirmation_timeout)
+        if confirmed is None:
+            if waiter.done():
+                # 同一会话开始了新的执行，本次执行作废
+                logger.info("等待确认已被新的执行取代，结束本次执行")
+                return
+            # 超时结束连接，检查点保留，之后确认或调用恢复接口仍可继续
+            logger.info(f"等待用户确认超时: conversation_id={conversation_id}")
+            yield {
+                "event": "error",
+                "data": json.dumps({
+                    "error": "confirmation_timeout",
+                    "message": "等待确认超时，确认后可恢复任务",
+                    "conversation_id": conversation_id,
+                    "resumable": True
+                })
+            }
+            return
+        graph_input = Command(resume=confirmed)
+    
+    # 执行完成，清理检查点和事件记录
+    await workflow.checkpointer.adelete_thread(conversation_id)
+
+
+# 后台恢复的工作流任务，保留引用避免被垃圾回收
+_background_resumes = set()
+
+
+async def _resume_in_background(conversation_id: str, confirmed: bool):
+    """SSE连接已断开时在后台恢复中断的工作流，报告照常保存到会话"""
+    waiter = confirmation_broker.open(conversation_id)
+    try:
+        async for _ in _drive_workflow(Command(resume=confirmed), conversation_id, "generate", waiter):
+            pass
+        logger.info(f"后台恢复的工作流已完成: conversation_id={conversation_id}")
+    except Exception as e:
+        logger.error(f"后台恢复工作流失败: {e}")
+        logger.error(f"错误详情: {traceback.format_exc()}")
+    finally:
+        confirmation_broker.close(conversation_id, waiter)
+
+
 async def event_generator(query: str, conversation_id: str = None, operation_type: str = "generate",
                          selected_text: str = None, position: str = None, template_id: str = None,
                          document_id: str = None):
@@ -54,6 +422,7 @@ async def event_generator(query: str, conversation_id: str = None, operation_typ
         # 知识库文档字段
         "document_id": document_id
     }
+    waiter = None
     
     try:
         print(f"开始处理查询: {query[:100]}...")
@@ -72,7 +441,6 @@ async def event_generator(query: str, conversation_id: str = None, operation_typ
         await asyncio.sleep(0.1)
         
         # 添加用户消息到会话
-        from backend.conversation import MessageType
         msg_type = MessageType.QUERY if is_new_conversation else MessageType.FOLLOW_UP
         if operation_type == "modify":
             msg_type = MessageType.MODIFICATION
@@ -94,259 +462,12 @@ async def event_generator(query: str, conversation_id: str = None, operation_typ
         print("启动工作流执行")
         logger.info("启动工作流执行")
         
-        async for event in workflow.astream(initial_state):
-            for node_name, node_output in event.items():
-                print(f"收到节点事件: {node_name}")
-                logger.info(f"收到节点事件: {node_name}")
-                
-                # v5.0: 意图识别节点事件
-                if node_name == "intent_recognizer":
-                    intent_analysis = node_output.get("intent_analysis", {})
-                    print(f"意图识别完成: {intent_analysis.get('intent_type')}")
-                    logger.info(f"意图识别完成: {intent_analysis.get('intent_type')}")
-                    yield {
-                        "event": "intent_analysis",
-                        "data": json.dumps(intent_analysis)
-                    }
-                    await asyncio.sleep(0.1)
-                
-                # v5.0: 知识库检索节点事件
-                elif node_name == "knowledge_base_search":
-                    sufficiency_level = node_output.get("kb_sufficiency_level")
-                    relevance_score = node_output.get("kb_relevance_score", 0.0)
-                    coverage_score = node_output.get("kb_coverage_score", 0.0)
-                    needs_confirmation = node_output.get("needs_user_confirmation", False)
-                    confirmation_prompt = node_output.get("confirmation_prompt")
-                    
-                    print(f"知识库评估: {sufficiency_level}, 相关度: {relevance_score:.2f}")
-                    logger.info(f"知识库评估: {sufficiency_level}, 相关度: {relevance_score:.2f}")
-                    
-                    yield {
-                        "event": "kb_evaluation",
-                        "data": json.dumps({
-                            "sufficiency_level": sufficiency_level,
-                            "relevance_score": relevance_score,
-                            "coverage_score": coverage_score,
-                            "needs_confirmation": needs_confirmation,
-                            "prompt": confirmation_prompt
-                        })
-                    }
-                    await asyncio.sleep(0.1)
-                    
-                    # v5.0: 如果需要用户确认，发送确认请求事件
-                    if needs_confirmation:
-                        print("发送用户确认请求")
-                        logger.info("发送用户确认请求")
-                        yield {
-                            "event": "user_confirmation_required",
-                            "data": json.dumps({
-                                "prompt": confirmation_prompt or "是否需要通过搜索获取更多信息？",
-                                "sufficiency_level": sufficiency_level,
-                                "conversation_id": conversation_id
-                            })
-                        }
-                        await asyncio.sleep(0.1)
-                
-                # v5.0: 用户确认等待节点
-                elif node_name == "user_confirmation":
-                    needs_confirmation = node_output.get("needs_user_confirmation", False)
-                    confirmation_status = node_output.get("user_confirmation_status")
-                    
-                    if needs_confirmation and confirmation_status is None:
-                        # 正在等待用户确认，更新会话状态
-                        conversation_manager.update_conversation(
-                            conversation_id=conversation_id,
-                            updates={
-                                "needs_user_confirmation": True,
-                                "user_confirmation_status": None,
-                                "confirmation_prompt": node_output.get("confirmation_prompt")
-                            }
-                        )
-                        print("等待用户确认...")
-                        logger.info("等待用户确认...")
-                
-                # v5.0: 用户确认后的路由节点
-                elif node_name == "post_confirmation_router":
-                    user_confirmed = node_output.get("user_confirmed_search")
-                    sufficiency_level = node_output.get("kb_sufficiency_level")
-                    
-                    if user_confirmed:
-                        print(f"用户已确认搜索，继续执行")
-                        logger.info(f"用户已确认搜索，继续执行")
-                    else:
-                        print(f"用户未确认搜索，sufficiency_level: {sufficiency_level}")
-                        logger.info(f"用户未确认搜索，sufficiency_level: {sufficiency_level}")
-                
-                elif node_name == "planner":
-                    plan_steps = node_output.get("plan_steps", [])
-                    print(f"规划生成 {len(plan_steps)} 个步骤")
-                    logger.info(f"规划生成 {len(plan_steps)} 个步骤")
-                    yield {
-                        "event": "planner_update",
-                        "data": json.dumps({
-                            "step": f"已生成 {len(plan_steps)} 个执行步骤",
-                            "plan": plan_steps
-                        })
-                    }
-                    await asyncio.sleep(0.1)
-                
-                elif node_name == "executor":
-                    search_results = node_output.get("search_results", [])
-                    print(f"执行器返回 {len(search_results)} 个搜索结果")
-                    logger.info(f"执行器返回 {len(search_results)} 个搜索结果")
-                    
-                    # 保存搜索结果到会话
-                    conversation_manager.save_search_results(conversation_id, search_results)
-                    
-                    for result in search_results:
-                        # 安全截断字符串，避免截断多字节字符导致乱码
-                        snippet = result.get("snippet", "")
-                        if len(snippet) > 200:
-                            # 找到第200个字符之前的最后一个完整字符
-                            snippet = snippet[:200]
-                            # 确保不截断在多字节字符中间
-                            while len(snippet.encode('utf-8')) > 200:
-                                snippet = snippet[:-1]
-                        
-                        yield {
-                            "event": "search_result",
-                            "data": json.dumps({
-                                "query": result.get("query", ""),
-                                "snippet": snippet
-                            }, ensure_ascii=False)
-                        }
-                        await asyncio.sleep(0.1)
-                
-                elif node_name == "verifier":
-                    verification = node_output.get("verification", {})
-                    is_valid = verification.get("is_valid", False)
-                    print(f"验证结果: {'有效' if is_valid else '无效'}")
-                    logger.info(f"验证结果: {'有效' if is_valid else '无效'}")
-                    yield {
-                        "event": "verification_feedback",
-                        "data": json.dumps(verification)
-                    }
-                    await asyncio.sleep(0.1)
-                    
-                    if not is_valid:
-                        initial_state["retry_count"] += 1
-                        print(f"触发重试，当前重试次数: {initial_state['retry_count']}")
-                        logger.info(f"触发重试，当前重试次数: {initial_state['retry_count']}")
-                        yield {
-                            "event": "retry_trigger",
-                            "data": json.dumps({
-                                "retry_count": initial_state["retry_count"],
-                                "message": "验证失败，重新规划"
-                            })
-                        }
-                        await asyncio.sleep(0.1)
-                
-                elif node_name == "report_generator":
-                    final_report = node_output.get("final_report", "")
-                    print(f"报告生成完成，长度: {len(final_report)} 字符")
-                    logger.info(f"报告生成完成，长度: {len(final_report)} 字符")
-                    
-                    # 更新会话中的报告
-                    conversation_manager.update_report(conversation_id, final_report, operation_type)
-                    
-                    # 添加助手消息
-                    conversation_manager.add_message(
-                        conversation_id=conversation_id,
-                        role="assistant",
-                        content=final_report,
-                        msg_type=MessageType.REPORT
-                    )
-                    
-                    yield {
-                        "event": "final_report",
-                        "data": json.dumps({
-                            "content": final_report,
-                            "conversation_id": conversation_id
-                        })
-                    }
-                    await asyncio.sleep(0.1)
-                
-                # 处理对话节点
-                elif node_name == "qa_handler":
-                    answer = node_output.get("answer", "")
-                    print(f"QA回答生成完成，长度: {len(answer)} 字符")
-                    logger.info(f"QA回答生成完成，长度: {len(answer)} 字符")
-                    
-                    # 添加助手回答消息
-                    conversation_manager.add_message(
-                        conversation_id=conversation_id,
-                        role="assistant",
-                        content=answer,
-                        msg_type=MessageType.ANSWER
-                    )
-                    
-                    yield {
-                        "event": "answer",
-                        "data": json.dumps({
-                            "content": answer,
-                            "conversation_id": conversation_id,
-                            "type": "follow_up"
-                        })
-                    }
-                    await asyncio.sleep(0.1)
-                
-                elif node_name == "modify_handler":
-                    final_report = node_output.get("final_report", "")
-                    modification = node_output.get("modification", "")
-                    print(f"报告修改完成，长度: {len(final_report)} 字符")
-                    logger.info(f"报告修改完成，长度: {len(final_report)} 字符")
-                    
-                    # 更新会话中的报告
-                    conversation_manager.update_report(conversation_id, final_report, "modify")
-                    
-                    # 添加助手消息
-                    conversation_manager.add_message(
-                        conversation_id=conversation_id,
-                        role="assistant",
-                        content=final_report,
-                        msg_type=MessageType.REPORT,
-                        metadata={"modification": modification}
-                    )
-                    
-                    yield {
-                        "event": "final_report",
-                        "data": json.dumps({
-                            "content": final_report,
-                            "conversation_id": conversation_id,
-                            "type": "modification",
-                            "modification": modification
-                        })
-                    }
-                    await asyncio.sleep(0.1)
-                
-                elif node_name == "expand_handler":
-                    final_report = node_output.get("final_report", "")
-                    expansion = node_output.get("expansion", "")
-                    print(f"内容补充完成，长度: {len(final_report)} 字符")
-                    logger.info(f"内容补充完成，长度: {len(final_report)} 字符")
-                    
-                    # 更新会话中的报告
-                    conversation_manager.update_report(conversation_id, final_report, "supplement")
-                    
-                    # 添加助手消息
-                    conversation_manager.add_message(
-                        conversation_id=conversation_id,
-                        role="assistant",
-                        content=final_report,
-                        msg_type=MessageType.REPORT,
-                        metadata={"expansion": expansion}
-                    )
-                    
-                    yield {
-                        "event": "final_report",
-                        "data": json.dumps({
-                            "content": final_report,
-                            "conversation_id": conversation_id,
-                            "type": "supplement",
-                            "expansion": expansion
-                        })
-                    }
-                    await asyncio.sleep(0.1)
+        # 同一会话只保留本次执行的检查点，之前未完成的执行（含未确认的中断）一并放弃
+        waiter = confirmation_broker.open(conversation_id)
+        await workflow.checkpointer.adelete_thread(conversation_id)
+        
+        async for item in _drive_workflow(initial_state, conversation_id, operation_type, waiter):
+            yield item
     
     except Exception as e:
         print(f"工作流执行错误: {e}")
@@ -361,6 +482,7 @@ async def event_generator(query: str, conversation_id: str = None, operation_typ
             })
         }
     finally:
+        confirmation_broker.close(conversation_id, waiter)
         print("处理完成")
         logger.info("处理完成")
         # 发送结束事件
@@ -431,12 +553,137 @@ async def stream_endpoint(
     )
 
 
+async def _finish_completed_run(values: dict, conversation_id: str, operation_type: str):
+    """
+    补存已执行完毕但未保存到会话的最终结果，然后清理检查点
+    
+    Args:
+        values: 检查点中的最终状态
+        conversation_id: 会话ID
+        operation_type: 操作类型
+    """
+    node_name = FINAL_OUTPUT_NODES.get(operation_type, "report_generator")
+    content = values.get("answer" if node_name == "qa_handler" else "final_report") or ""
+    conversation = conversation_manager.get_conversation(conversation_id)
+    last_message = conversation.messages[-1] if conversation and conversation.messages else None
+    saved = last_message is not None and last_message.role == "assistant" and last_message.content == content
+    
+    if content and not saved:
+        logger.info(f"补存已完成任务的结果: conversation_id={conversation_id}, 节点: {node_name}")
+        async for item in _final_output_events(node_name, values, conversation_id, operation_type):
+            yield item
+    
+    await workflow.checkpointer.adelete_thread(conversation_id)
+
+
+async def resume_generator(conversation_id: str, last_event_id: int = 0):
+    """恢复事件生成器 - 重放last_event_id之后已推送的事件，再从最后完成的节点继续执行"""
+    snapshot = await workflow.aget_state({"configurable": {"thread_id": conversation_id}})
+    # 节点结果已写入但所在步骤尚未提交时，该节点不在snapshot.next中，只出现在snapshot.tasks里
+    pending = bool(snapshot.next or snapshot.tasks)
+    if not pending and not snapshot.values:
+        yield {
+            "event": "error",
+            "data": json.dumps({"error": "没有可恢复的任务", "message": "任务已完成或不存在"})
+        }
+        return
+    
+    # 正在执行的任务不能重复恢复；只在等待确认时允许接管（如刷新页面后）
+    if confirmation_broker.is_open(conversation_id) and not snapshot.interrupts:
+        yield {
+            "event": "error",
+            "data": json.dumps({"error": "任务仍在执行中", "message": "请稍后再试"})
+        }
+        return
+    
+    operation_type = snapshot.values.get("operation_type", "generate")
+    waiter = confirmation_broker.open(conversation_id)
+    logger.info(f"恢复任务: conversation_id={conversation_id}, 下一节点: {snapshot.next}")
+    
+    try:
+        yield {
+            "event": "start",
+            "data": json.dumps({
+                "message": "恢复任务",
+                "query": snapshot.values.get("user_query", ""),
+                "conversation_id": conversation_id,
+                "operation_type": operation_type,
+                "resumed": True
+            })
+        }
+        
+        for item in await asyncio.to_thread(workflow.checkpointer.list_events, conversation_id, last_event_id):
+            # 已经确认过的不再弹出确认框
+            if item["event"] == "user_confirmation_required" and not snapshot.interrupts:
+                continue
+            yield item
+        
+        if pending:
+            async for item in _drive_workflow(None, conversation_id, operation_type, waiter):
+                yield item
+        else:
+            # 工作流已到达END，但在结果保存到会话前断开
+            async for item in _finish_completed_run(snapshot.values, conversation_id, operation_type):
+                yield item
+    
+    except Exception as e:
+        logger.error(f"恢复任务失败: {e}")
+        logger.error(f"错误详情: {traceback.format_exc()}")
+        yield {
+            "event": "error",
+            "data": json.dumps({
+                "error": str(e),
+                "message": "恢复任务时发生错误"
+            })
+        }
+    finally:
+        confirmation_broker.close(conversation_id, waiter)
+        yield {
+            "event": "end",
+            "data": json.dumps({
+                "message": "处理完成",
+                "conversation_id": conversation_id
+            })
+        }
+
+
+@router.get("/conversations/{conversation_id}/resume")
+async def resume_endpoint(
+    conversation_id: str,
+    last_event_id: int = Query(0, ge=0, description="前端最后收到的事件ID，之前的事件不再重放")
+):
+    """恢复因断线或服务重启而中断的任务（SSE），不会重做已完成的LLM和搜索调用"""
+    if not conversation_manager.get_conversation(conversation_id):
+        raise HTTPException(status_code=404, detail="会话不存在")
+    
+    return EventSourceResponse(
+        resume_generator(conversation_id, last_event_id),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "X-Accel-Buffering": "no"
+        }
+    )
+
+
 # 会话管理API
 @router.get("/conversations")
-async def list_conversations():
-    """获取会话列表"""
+async def list_conversations(
+    limit: int = Query(50, ge=1, le=200, description="每页数量"),
+    cursor: Optional[str] = Query(None, description="上一页返回的next_cursor"),
+    q: Optional[str] = Query(None, description="在标题、消息和报告中搜索")
+):
+    """获取会话列表（按更新时间倒序，游标分页）"""
+    try:
+        conversations, next_cursor = await asyncio.to_thread(
+            conversation_manager.list_conversations_page, limit, cursor, q
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     return {
-        "conversations": conversation_manager.list_conversations()
+        "conversations": conversations,
+        "next_cursor": next_cursor
     }
 
 
@@ -449,6 +696,37 @@ async def get_conversation(conversation_id: str):
     return conversation.model_dump()
 
 
+@router.get("/conversations/{conversation_id}/versions")
+async def list_report_versions(conversation_id: str):
+    """获取报告版本列表（含当前版本）"""
+    versions = conversation_manager.list_report_versions(conversation_id)
+    if versions is None:
+        raise HTTPException(status_code=404, detail="会话不存在")
+    return {"conversation_id": conversation_id, "versions": versions}
+
+
+@router.get("/conversations/{conversation_id}/versions/diff")
+async def diff_report_versions(
+    conversation_id: str,
+    from_version: int = Query(..., alias="from", description="起始版本号"),
+    to_version: int = Query(..., alias="to", description="目标版本号")
+):
+    """获取两个报告版本之间的unified diff"""
+    diff = conversation_manager.diff_report_versions(conversation_id, from_version, to_version)
+    if diff is None:
+        raise HTTPException(status_code=404, detail="会话或版本不存在")
+    return {"from": from_version, "to": to_version, "diff": diff}
+
+
+@router.get("/conversations/{conversation_id}/versions/{version}")
+async def get_report_version(conversation_id: str, version: int):
+    """获取指定版本的报告全文"""
+    content = conversation_manager.get_report_version(conversation_id, version)
+    if content is None:
+        raise HTTPException(status_code=404, detail="会话或版本不存在")
+    return {"version": version, "content": content}
+
+
 @router.delete("/conversations/{conversation_id}")
 async def delete_conversation(conversation_id: str):
     """删除会话"""
@@ -470,8 +748,8 @@ async def user_confirmation(request: ConfirmationRequest):
     """
     用户确认回调接口
     
-    前端在用户点击确认按钮后调用此接口
-    更新工作流状态，继续执行
+    前端在用户点击确认按钮后调用此接口：SSE连接仍在时立即唤醒等待中的工作流；
+    连接已断开但工作流停在确认中断处时，在后台恢复执行
     """
     conversation_id = request.conversation_id
     confirmed = request.confirmed
@@ -495,10 +773,20 @@ async def user_confirmation(request: ConfirmationRequest):
     
     logger.info(f"用户确认已保存: conversation_id={conversation_id}, confirmed={confirmed}")
     
+    resumed_in_background = False
+    if not confirmation_broker.resolve(conversation_id, confirmed):
+        if await _is_waiting_confirmation(conversation_id):
+            logger.info(f"SSE连接已断开，在后台恢复工作流: conversation_id={conversation_id}")
+            task = asyncio.create_task(_resume_in_background(conversation_id, confirmed))
+            _background_resumes.add(task)
+            task.add_done_callback(_background_resumes.discard)
+            resumed_in_background = True
+    
     return {
         "status": "success",
         "confirmed": confirmed,
-        "conversation_id": conversation_id
+        "conversation_id": conversation_id,
+        "resumed_in_background": resumed_in_background
     }
 
 
@@ -544,8 +832,7 @@ async def restore_conversation(conversation_data: dict):
         )
         
         # 添加到会话管理器
-        conversation_manager.conversations[conversation_id] = conversation
-        conversation_manager.save_to_file()
+        conversation_manager.add_conversation(conversation)
         
         logger.info(f"会话已恢复: {conversation_id}")
         
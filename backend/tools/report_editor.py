@@ -0,0 +1,134 @@
+"""
+报告局部编辑工具 - 定位修改/补充位置，把LLM返回的局部内容拼接回报告
+"""
+import difflib
+import re
+from typing import List, Optional, Tuple
+
+# Markdown标题（# 标题）或中文序号标题（一、标题）
+_HEADING_RE = re.compile(r'^(?:(#{1,6})\s+(.+?)\s*#*|([一二三四五六七八九十]+、.+?))\s*$', re.M)
+# 页面上选中的是渲染后的文本，与原文相比可能缺少这些Markdown标记或空白
+_IGNORABLE = r'[\s*_`#>|~-]*'
+_IGNORABLE_CHARS = set(' \t\r\n*_`#>|~-')
+
+# 位置描述为这些词时插入到报告开头
+_START_POSITIONS = ("开头", "开始", "最前", "前面")
+
+
+def locate_text(report: str, selected: str) -> Optional[Tuple[int, int]]:
+    """
+    在报告中定位选中的文本
+
+    依次尝试：精确匹配 → 忽略空白和Markdown标记的匹配 → 最相似的段落
+
+    Args:
+        report: 报告原文
+        selected: 用户选中的文本
+
+    Returns:
+        (起始位置, 结束位置)，找不到时为None
+    """
+    selected = selected.strip()
+    if not selected or not report:
+        return None
+
+    start = report.find(selected)
+    if start >= 0:
+        return start, start + len(selected)
+
+    chars = [c for c in selected if c not in _IGNORABLE_CHARS]
+    if chars:
+        pattern = _IGNORABLE.join(re.escape(c) for c in chars)
+        match = re.search(pattern, report)
+        if match:
+            return match.start(), match.end()
+
+    # 最后按段落相似度匹配
+    best, best_ratio = None, 0.6
+    for para_start, para_end in _paragraph_spans(report):
+        ratio = difflib.SequenceMatcher(None, report[para_start:para_end], selected, autojunk=False).ratio()
+        if ratio > best_ratio:
+            best, best_ratio = (para_start, para_end), ratio
+    return best
+
+
+def _paragraph_spans(report: str) -> List[Tuple[int, int]]:
+    """按空行切分段落，返回各段落的 (起始, 结束) 位置"""
+    spans = []
+    for match in re.finditer(r'\S(?:.*?\S)?(?=\n\s*\n|\s*$)', report, re.S):
+        spans.append((match.start(), match.end()))
+    return spans
+
+
+def context_window(report: str, start: int, end: int, chars: int) -> Tuple[str, str]:
+    """取 [start, end) 前后各chars个字符作为上下文"""
+    return report[max(0, start - chars):start], report[end:end + chars]
+
+
+def clean_fragment(text: str) -> str:
+    """去掉LLM输出中包裹的代码块标记和首尾空白"""
+    text = text.strip()
+    fenced = re.match(r'^```[\w-]*\n(.*?)\n?```$', text, re.S)
+    if fenced:
+        text = fenced.group(1).strip()
+    return text
+
+
+def splice(report: str, start: int, end: int, replacement: str) -> str:
+    """用replacement替换 [start, end)，保留原片段首尾的空白"""
+    original = report[start:end]
+    leading = original[:len(original) - len(original.lstrip())]
+    trailing = original[len(original.rstrip()):]
+    return report[:start] + leading + clean_fragment(replacement) + trailing + report[end:]
+
+
+def find_insert_position(report: str, position: Optional[str] = None, anchor_text: Optional[str] = None) -> int:
+    """
+    确定补充内容的插入位置
+
+    Args:
+        report: 报告原文
+        position: 位置描述（如"开头"、"末尾"或章节标题）
+        anchor_text: 用户选中的文本，存在时插入到其所在段落之后
+
+    Returns:
+        插入位置（字符下标）
+    """
+    if anchor_text:
+        span = locate_text(report, anchor_text)
+        if span:
+            paragraph_end = report.find("\n\n", span[1])
+            return len(report) if paragraph_end < 0 else paragraph_end
+
+    position = (position or "").strip()
+    headings = [
+        (m.start(), m.end(), len(m.group(1)) if m.group(1) else 1, (m.group(2) or m.group(3)).strip())
+        for m in _HEADING_RE.finditer(report)
+    ]
+
+    if position in _START_POSITIONS:
+        # 跳过开头的报告标题
+        if headings and headings[0][0] == 0:
+            return headings[0][1]
+        return 0
+
+    if position:
+        for i, (_, heading_end, level, title) in enumerate(headings):
+            if position in title or title in position:
+                # 插入到该章节末尾（下一个同级或更高级标题之前）
+                for next_start, _, next_level, _ in headings[i + 1:]:
+                    if next_level <= level:
+                        return next_start
+                return len(report)
+
+    return len(report)
+
+
+def insert(report: str, index: int, content: str) -> str:
+    """在index处插入content，前后用空行分隔"""
+    before = report[:index].rstrip("\n")
+    after = report[index:].lstrip("\n")
+    content = clean_fragment(content)
+    if not before:
+        return content + ("\n\n" + after if after else "\n")
+    return before + "\n\n" + content + ("\n\n" + after if after else "\n")
@@ -1,23 +1,101 @@
 from backend.config import settings
-from typing import List, Dict, Any
+from backend.cache import TTLCache
+from typing import List, Dict, Any, Optional
+from requests.adapters import HTTPAdapter
+import importlib.util
 import logging
+import re
+import unicodedata
+import httpx
 import requests
 
 logger = logging.getLogger(__name__)
 
 
+def normalize_query(query: str) -> str:
+    """
+    归一化查询文本，用作缓存键
+    
+    只统一全角/半角、大小写和空白；编号、符号和标点可能是查询内容本身（如"3.5"、"-1"），一律保留
+    """
+    query = unicodedata.normalize("NFKC", query).lower().strip()
+    query = re.sub(r'\s+', ' ', query)
+    # 中文与其他字符之间的空格不影响语义
+    return re.sub(r'(?<=[\u4e00-\u9fff]) | (?=[\u4e00-\u9fff])', '', query)
+
+
 class SearchTool:
     def __init__(self):
         self.api_key = settings.exa_api_key
         self.base_url = "https://api.exa.ai/search"
-
-    def search(self, query: str, num_results: int = 5) -> List[Dict[str, Any]]:
         headers = {
             "x-api-key": self.api_key,
             "Content-Type": "application/json"
         }
-        
-        payload = {
+
+        # 同步会话：连接池 + keep-alive，避免每次搜索重新建立TLS连接
+        self.session = requests.Session()
+        self.session.headers.update(headers)
+        adapter = HTTPAdapter(
+            pool_connections=settings.search_pool_size,
+            pool_maxsize=settings.search_pool_size
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        # 异步客户端：供工作流节点使用，安装了h2时启用HTTP/2
+        http2 = settings.search_http2 and importlib.util.find_spec("h2") is not None
+        self.async_client = httpx.AsyncClient(
+            headers=headers,
+            timeout=settings.search_timeout,
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=settings.search_pool_size,
+                max_keepalive_connections=settings.search_pool_size
+            )
+        )
+
+        # 搜索结果缓存：键为归一化查询 + 结果数
+        self.cache: Optional[TTLCache] = None
+        if settings.search_cache_enabled:
+            self.cache = TTLCache(
+                "search",
+                max_entries=settings.search_cache_max_entries,
+                ttl=settings.search_cache_ttl,
+                db_path=settings.search_cache_db_path or None
+            )
+
+    def _cache_key(self, query: str, num_results: int) -> str:
+        return f"{normalize_query(query)}|{num_results}"
+
+    def _cache_hit(self, query: str, results: Optional[List[Dict[str, Any]]]) -> Optional[List[Dict[str, Any]]]:
+        if results is None:
+            return None
+        logger.info(f"搜索缓存命中 '{query}'，{len(results)} 条结果")
+        # 返回副本，避免调用方修改缓存内容
+        return [{**r, "query": query} for r in results]
+
+    def _get_cached(self, query: str, num_results: int) -> Optional[List[Dict[str, Any]]]:
+        if self.cache is None:
+            return None
+        return self._cache_hit(query, self.cache.get(self._cache_key(query, num_results)))
+
+    def _set_cached(self, query: str, num_results: int, results: List[Dict[str, Any]]):
+        # 空结果可能是请求失败，不缓存
+        if self.cache is not None and results:
+            self.cache.set(self._cache_key(query, num_results), [dict(r) for r in results])
+
+    async def _aget_cached(self, query: str, num_results: int) -> Optional[List[Dict[str, Any]]]:
+        if self.cache is None:
+            return None
+        return self._cache_hit(query, await self.cache.aget(self._cache_key(query, num_results)))
+
+    async def _aset_cached(self, query: str, num_results: int, results: List[Dict[str, Any]]):
+        if self.cache is not None and results:
+            await self.cache.aset(self._cache_key(query, num_results), [dict(r) for r in results])
+
+    def _build_payload(self, query: str, num_results: int) -> Dict[str, Any]:
+        return {
             "query": query,
             "type": "auto",
             "num_results": num_results,
@@ -27,34 +105,41 @@ class SearchTool:
                 }
             }
         }
+
+    def _parse_results(self, query: str, results: Dict[str, Any]) -> List[Dict[str, Any]]:
+        organic_results = []
+        if "results" in results:
+            for item in results["results"]:
+                # 获取highlights数组的第一个元素作为摘要
+                highlights = item.get("highlights", [])
+                snippet = highlights[0] if highlights else ""
+
+                organic_results.append({
+                    "title": item.get("title", ""),
+                    "link": item.get("url", ""),
+                    "snippet": snippet,
+                    "query": query
+                })
+
+        logger.info(f"搜索 '{query}' 返回 {len(organic_results)} 条结果")
+        return organic_results
+
+    def search(self, query: str, num_results: int = 5) -> List[Dict[str, Any]]:
+        cached = self._get_cached(query, num_results)
+        if cached is not None:
+            return cached
         
         try:
-            response = requests.post(
+            response = self.session.post(
                 self.base_url,
-                headers=headers,
-                json=payload,
-                timeout=30
+                json=self._build_payload(query, num_results),
+                timeout=settings.search_timeout
             )
             response.raise_for_status()
-            results = response.json()
-            
-            organic_results = []
-            if "results" in results:
-                for item in results["results"]:
-                    # 获取highlights数组的第一个元素作为摘要
-                    highlights = item.get("highlights", [])
-                    snippet = highlights[0] if highlights else ""
-                    
-                    organic_results.append({
-                        "title": item.get("title", ""),
-                        "link": item.get("url", ""),
-                        "snippet": snippet,
-                        "query": query
-                    })
-            
-            logger.info(f"搜索 '{query}' 返回 {len(organic_results)} 条结果")
-            return organic_results
-            
+            results = self._parse_results(query, response.json())
+            self._set_cached(query, num_results, results)
+            return results
+
         except requests.exceptions.RequestException as e:
             logger.error(f"搜索请求失败: {e}")
             return []
@@ -62,5 +147,33 @@ class SearchTool:
             logger.error(f"搜索失败: {e}")
             return []
 
+    async def asearch(self, query: str, num_results: int = 5) -> List[Dict[str, Any]]:
+        """异步搜索，复用长连接池"""
+        cached = await self._aget_cached(query, num_results)
+        if cached is not None:
+            return cached
+        
+        try:
+            response = await self.async_client.post(
+                self.base_url,
+                json=self._build_payload(query, num_results)
+            )
+            response.raise_for_status()
+            results = self._parse_results(query, response.json())
+            await self._aset_cached(query, num_results, results)
+            return results
+
+        except httpx.HTTPError as e:
+            logger.error(f"搜索请求失败: {e}")
+            return []
+        except Exception as e:
+            logger.error(f"搜索失败: {e}")
+            return []
+
+    async def aclose(self):
+        """关闭连接池（应用关闭时调用）"""
+        await self.async_client.aclose()
+        self.session.close()
+
 
 search_tool = SearchTool()
@@ -12,6 +12,8 @@ class SSEClient {
         this.retryDelay = 2000;
         this.isAborted = false;  // 新增：中断标志
         this.isCompleted = false; // 新增：任务完成标志
+        this.conversationId = null; // 当前任务所属会话，断线后据此恢复
+        this.lastEventId = null;    // 最后收到的事件序号，恢复时跳过已收到的事件
     }
 
     abort() {
@@ -35,6 +37,8 @@ class SSEClient {
         this.isCompleted = false;
         this.retryCount = 0;
         this.errorHandled = false;
+        this.conversationId = null;
+        this.lastEventId = null;
 
         const { conversationId, operationType, selectedText, position, templateId, documentId } = options;
         
@@ -50,6 +54,30 @@ class SSEClient {
         const url = `http://localhost:8000/api/stream?${params.toString()}`;
         console.log('连接URL:', url);
         
+        this.open(url, callbacks, () => this.connect(query, callbacks, options));
+    }
+
+    // 恢复断线或服务重启前未完成的任务：服务端重放lastEventId之后的事件，再从最后完成的节点继续
+    resume(conversationId, callbacks, lastEventId = null) {
+        if (this.eventSource) {
+            this.disconnect();
+        }
+        
+        this.isAborted = false;
+        this.isCompleted = false;
+        this.errorHandled = false;
+        this.conversationId = conversationId;
+        this.lastEventId = lastEventId;
+        
+        const params = new URLSearchParams();
+        if (lastEventId) params.append('last_event_id', lastEventId);
+        const url = `http://localhost:8000/api/conversations/${conversationId}/resume?${params.toString()}`;
+        console.log('恢复任务URL:', url);
+        
+        this.open(url, callbacks, () => this.resume(conversationId, callbacks, this.lastEventId));
+    }
+
+    open(url, callbacks, reconnect) {
         this.eventSource = new EventSource(url);
 
         this.eventSource.onopen = () => {
@@ -91,10 +119,15 @@ class SSEClient {
             }
 
             // 只有在连接意外断开且未达到最大重试次数时才重连
+            // 任务已开始时恢复该任务，而不是重新提交查询
             this.retryCount++;
             console.log(`尝试重连 (${this.retryCount}/${this.maxRetries})...`);
             setTimeout(() => {
-                this.connect(query, callbacks, options);
+                if (this.conversationId) {
+                    this.resume(this.conversationId, callbacks, this.lastEventId);
+                } else {
+                    reconnect();
+                }
             }, this.retryDelay);
         };
 
@@ -117,6 +150,7 @@ class SSEClient {
             'search_result': 'searchResult',
             'verification_feedback': 'verificationFeedback',
             'retry_trigger': 'retryTrigger',
+            'report_delta': 'reportDelta',
             'final_report': 'finalReport',
             'answer': 'answer',
             'error': 'error',
@@ -129,8 +163,14 @@ class SSEClient {
             const callbackName = eventTypeMap[eventType];
             console.log(`setupEventListeners: 设置 ${eventType} -> ${callbackName}`);
             this.eventSource.addEventListener(eventType, (event) => {
+                if (event.lastEventId) {
+                    this.lastEventId = event.lastEventId;
+                }
                 try {
                     const data = JSON.parse(event.data);
+                    if (eventType === 'start' && data.conversation_id) {
+                        this.conversationId = data.conversation_id;
+                    }
                     console.log(`收到事件: ${eventType}, 回调: ${callbackName}`, data);
                     if (callbacks[callbackName]) {
                         callbacks[callbackName](data);
@@ -471,8 +511,8 @@ class App {
         this.startTimer();
         this.showStatus('processing', '恢复连接中...');
         
-        // 使用与 handleSubmit 相同的 callbacks 重新连接
-        this.connectWorkflowStream(state.queryInput, state.conversationId);
+        // 使用与 handleSubmit 相同的 callbacks 恢复任务（已保存的步骤之后继续）
+        this.connectWorkflowStream(state.queryInput, state.conversationId, state.lastEventId);
     }
     
     // v6.0: 重新启动工作流
@@ -487,7 +527,7 @@ class App {
     }
     
     // v6.0: 连接工作流流（使用 handleSubmit 相同的 callbacks）
-    connectWorkflowStream(query, conversationId) {
+    connectWorkflowStream(query, conversationId, lastEventId = null) {
         console.log('连接工作流流:', { query: query.substring(0, 50), conversationId });
         
         const callbacks = {
@@ -571,6 +611,9 @@ class App {
             retryTrigger: (data) => {
                 this.addRetryStep(data);
             },
+            reportDelta: (data) => {
+                this.appendReportDelta(data);
+            },
             finalReport: (data) => {
                 console.log('finalReport 回调被调用:', data);
                 if (data && data.content) {
@@ -595,6 +638,12 @@ class App {
                     console.log('连接已中断，忽略错误消息');
                     return;
                 }
+                // 服务端没有可恢复的任务（检查点已清理），重新提交查询
+                if (data.error === '没有可恢复的任务') {
+                    console.log('没有可恢复的任务，重新提交查询');
+                    connect(false);
+                    return;
+                }
                 this.addErrorStep(data);
                 this.updateStatus('error', '处理失败');
             },
@@ -615,12 +664,19 @@ class App {
             return;
         }
         
-        this.sseClient.connect(query, callbacks, {
-            operationType: 'generate',
-            conversationId: conversationId,
-            templateId: this.currentTemplateId,
-            documentId: this.currentDocumentId
-        });
+        const connect = (resume) => {
+            if (resume) {
+                this.sseClient.resume(conversationId, callbacks, lastEventId);
+                return;
+            }
+            this.sseClient.connect(query, callbacks, {
+                operationType: 'generate',
+                conversationId: conversationId,
+                templateId: this.currentTemplateId,
+                documentId: this.currentDocumentId
+            });
+        };
+        connect(Boolean(conversationId));
     }
     
     // v6.0: 恢复工作流显示（不重新执行）
@@ -687,6 +743,7 @@ class App {
             isProcessing: this.isProcessing,
             conversationId: this.conversationManager.currentConversationId,
             operationType: this.operationType,
+            lastEventId: this.sseClient?.lastEventId || null,
             workflowSteps: workflowSteps,
             timestamp: Date.now()
         };
@@ -1343,6 +1400,10 @@ class App {
                     type: 'answer'
                 });
             },
+            reportDelta: (data) => {
+                // 在占位消息中实时显示增量内容
+                this.appendLoadingMessageDelta(loadingMessageId, data);
+            },
             finalReport: (data) => {
                 // 移除生成中占位消息
                 this.removeLoadingMessage(loadingMessageId);
@@ -1482,6 +1543,24 @@ class App {
         return messageId;
     }
 
+    appendLoadingMessageDelta(messageId, data) {
+        if (!messageId || !data || !data.content) return;
+        const loadingEl = document.getElementById(messageId);
+        if (!loadingEl) return;
+
+        const contentEl = loadingEl.querySelector('.chat-message-content');
+        if (!contentEl) return;
+
+        // 首个增量到达时移除加载动画
+        if (!loadingEl.dataset.streaming) {
+            loadingEl.dataset.streaming = 'true';
+            contentEl.innerHTML = '';
+            contentEl.style.whiteSpace = 'pre-wrap';
+        }
+        contentEl.textContent += data.content;
+        this.chatContainer.scrollTop = this.chatContainer.scrollHeight;
+    }
+
     removeLoadingMessage(messageId) {
         if (!messageId) return;
         const loadingEl = document.getElementById(messageId);
@@ -1861,6 +1940,9 @@ class App {
             retryTrigger: (data) => {
                 this.addRetryStep(data);
             },
+            reportDelta: (data) => {
+                this.appendReportDelta(data);
+            },
             finalReport: (data) => {
                 console.log('finalReport 回调被调用:', data);
                 if (data && data.content) {
@@ -2255,6 +2337,27 @@ class App {
         this.scrollToBottom();
     }
 
+    appendReportDelta(data) {
+        if (!data || !data.content) return;
+
+        // 流式预览步骤，final_report到达后随clearWorkflow一起清除
+        if (!this.reportStreamEl || !this.reportStreamEl.isConnected) {
+            const stepId = this.addWorkflowStep(
+                'report-stream',
+                '📝',
+                '报告生成中',
+                '',
+                'reporter'
+            );
+            const stepEl = document.getElementById(stepId);
+            if (!stepEl) return;
+            this.reportStreamEl = stepEl.querySelector('.step-content');
+            this.reportStreamEl.style.whiteSpace = 'pre-wrap';
+        }
+        this.reportStreamEl.textContent += data.content;
+        this.scrollToBottom();
+    }
+
     addReportStep(data) {
         console.log('addReportStep 被调用:', data);
         const stepId = this.addWorkflowStep(
@@ -2910,12 +3013,30 @@ class App {
             this.kbDocuments = data.documents || [];
             this.renderKBDocuments();
             this.updateKBStatsFromDocuments();
+            this.scheduleKBDocumentsPoll();
         } catch (error) {
             console.error('加载文档失败:', error);
             this.showToast('加载文档列表失败', 'error');
         }
     }
 
+    // 有文档在后台处理时，定时刷新列表直到处理结束
+    scheduleKBDocumentsPoll() {
+        clearTimeout(this.kbPollTimer);
+        const hasActive = this.kbDocuments.some(doc => doc.status === 'pending' || doc.status === 'processing');
+        if (hasActive && this.kbModal?.classList.contains('show')) {
+            this.kbPollTimer = setTimeout(() => this.loadKBDocuments(), 2000);
+        }
+    }
+
+    formatKBStatus(doc) {
+        const progress = doc.progress;
+        if (doc.status === 'processing' && progress && progress.stage === 'embedding' && progress.total) {
+            return `${this.kbStatusText[doc.status]} ${progress.current}/${progress.total}`;
+        }
+        return this.kbStatusText[doc.status];
+    }
+
     async loadKBStats() {
         try {
             const response = await fetch(`${this.API_BASE}/knowledge-base/stats`);
@@ -2999,7 +3120,7 @@ class App {
                         ${doc.chunk_count ? `· ${doc.chunk_count} 个片段` : ''}
                     </div>
                 </div>
-                <div class="kb-doc-status ${doc.status}">${this.kbStatusText[doc.status]}</div>
+                <div class="kb-doc-status ${doc.status}">${this.formatKBStatus(doc)}</div>
                 <div class="kb-doc-actions">
                     <button class="kb-action-btn view" onclick="app.viewKBDocument('${doc.document_id}')">查看</button>
                     <button class="kb-action-btn delete" onclick="app.deleteKBDocument('${doc.document_id}')">删除</button>
@@ -3048,7 +3169,7 @@ class App {
             throw new Error(error.detail || '上传失败');
         }
 
-        this.showToast(`上传成功: ${file.name}`, 'success');
+        this.showToast(`上传成功，正在后台处理: ${file.name}`, 'success');
         return await response.json();
     }
 
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+测试断线恢复：节点结果已写入但步骤未提交时中断，恢复后不重做已完成的搜索和LLM调用
+"""
+
+import sys
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+import asyncio
+import json
+from types import SimpleNamespace
+
+from langgraph.types import Command
+
+from backend.agents.confirmation import confirmation_broker
+from backend.agents.graph import workflow
+from backend.conversation import conversation_manager
+from backend.knowledge_base import knowledge_base_manager
+from backend.knowledge_base.models import RelevanceCheckResult
+from backend.models.llm import deepseek_client
+from backend.routers import stream
+from backend.tools.search import search_tool
+
+search_calls = []
+
+
+async def fake_llm(model=None, messages=None, stream=False, **kwargs):
+    """按系统提示返回固定内容，不访问真实LLM"""
+    system_prompt = messages[0]["content"]
+    if "意图识别" in system_prompt:
+        text = '{"intent_type": "report_generation", "confidence": 0.9}'
+    elif "任务规划" in system_prompt:
+        text = "步骤一 AI趋势\n步骤二 市场规模"
+    elif "信息验证" in system_prompt:
+        text = "包含相关信息"
+    else:
+        text = "一、概述\n\n报告正文内容。"
+    if stream:
+        async def chunks():
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+        return chunks()
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))])
+
+
+async def fake_search(query, num_results=5):
+    search_calls.append(query)
+    return [{"title": query, "link": "https://example.com", "snippet": f"关于{query}的内容", "query": query}]
+
+
+def fake_relevance(query, top_k=5):
+    # 置信度不足，走用户确认 → 搜索流程
+    return RelevanceCheckResult(is_sufficient=False, confidence=0.5, reason="测试",
+                                relevant_chunks=[], coverage_score=0.5)
+
+
+deepseek_client.async_client.chat.completions.create = fake_llm
+search_tool.asearch = fake_search
+knowledge_base_manager.check_relevance = fake_relevance
+
+
+async def _cancel_after(event_name: str):
+    """开始生成报告（自动确认搜索），收到指定事件后取消SSE任务，返回会话ID"""
+    events = []
+
+    async def consume():
+        async for item in stream.event_generator("生成AI行业趋势报告"):
+            events.append(item)
+            if item["event"] == "user_confirmation_required":
+                conversation_id = json.loads(item["data"])["conversation_id"]
+                asyncio.get_running_loop().call_soon(confirmation_broker.resolve, conversation_id, True)
+
+    task = asyncio.create_task(consume())
+    while not any(item["event"] == event_name for item in events):
+        await asyncio.sleep(0.01)
+    # 此时executor的结果已写入检查点，但所在步骤尚未提交
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    return json.loads(events[0]["data"])["conversation_id"]
+
+
+async def _resume(conversation_id: str):
+    return [item async for item in stream.resume_generator(conversation_id, 0)]
+
+
+def test_resume_after_uncommitted_writes():
+    """在search_result之后断开，恢复时直接从检查点继续"""
+    async def run():
+        search_calls.clear()
+        conversation_id = await _cancel_after("search_result")
+        try:
+            searched = len(search_calls)
+            snapshot = await workflow.aget_state({"configurable": {"thread_id": conversation_id}})
+            assert snapshot.tasks, "检查点中应有已写入结果的任务"
+
+            events = await _resume(conversation_id)
+            names = [item["event"] for item in events]
+            assert "error" not in names, names
+            assert "final_report" in names, names
+            assert len(search_calls) == searched, "恢复时不应重新搜索"
+
+            conversation = conversation_manager.get_conversation(conversation_id)
+            assert [m.role for m in conversation.messages] == ["user", "assistant"]
+            assert conversation.current_report
+            snapshot = await workflow.aget_state({"configurable": {"thread_id": conversation_id}})
+            assert not snapshot.values, "完成后检查点应已清理"
+        finally:
+            conversation_manager.delete_conversation(conversation_id)
+
+    asyncio.run(run())
+
+
+def test_resume_completed_but_unsaved():
+    """工作流已到达END但报告未保存到会话时，恢复只补存结果"""
+    async def run():
+        conversation = conversation_manager.create_conversation("生成AI行业趋势报告")
+        conversation_id = conversation.id
+        try:
+            config = {"configurable": {"thread_id": conversation_id}}
+            state = {
+                "user_query": "生成AI行业趋势报告",
+                "conversation_id": conversation_id,
+                "operation_type": "generate",
+                "document_id": None,
+                "template_id": None
+            }
+            await workflow.ainvoke(state, config)
+            await workflow.ainvoke(Command(resume=True), config)
+            search_calls.clear()
+
+            events = await _resume(conversation_id)
+            names = [item["event"] for item in events]
+            assert "final_report" in names, names
+            assert not search_calls
+
+            conversation = conversation_manager.get_conversation(conversation_id)
+            assert conversation.current_report
+            assert conversation.messages[-1].role == "assistant"
+            assert not (await workflow.aget_state(config)).values
+        finally:
+            conversation_manager.delete_conversation(conversation_id)
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    test_resume_after_uncommitted_writes()
+    print("✅ 步骤未提交时中断后恢复")
+    test_resume_completed_but_unsaved()
+    print("✅ 已完成但未保存的任务补存结果")
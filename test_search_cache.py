@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+"""
+测试搜索缓存键：内容不同的查询不能共用同一个缓存键
+"""
+
+import sys
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+from backend.tools.search import normalize_query
+
+
+def test_distinct_queries_keep_distinct_keys():
+    """数字、负号和编号样式的开头属于查询内容，不能被去掉"""
+    pairs = [
+        ("3.5 版本更新", "5 版本更新"),
+        ("-1 的平方根", "1 的平方根"),
+        ("1) 计划", "10) 计划"),
+        ("1) 计划", "计划"),
+        ("2024. 年度报告", "年度报告"),
+        ("* 通配符用法", "通配符用法"),
+    ]
+    for a, b in pairs:
+        assert normalize_query(a) != normalize_query(b), (a, b)
+
+
+def test_equivalent_queries_share_key():
+    """全角/半角、大小写和空白差异不影响缓存命中"""
+    assert normalize_query("ＡＩ 行业趋势") == normalize_query("ai行业趋势")
+    assert normalize_query("  OpenAI   GPT-4  ") == normalize_query("openai gpt-4")
+    assert normalize_query("2024年 AI 市场规模") == normalize_query("2024年AI市场规模")
+
+
+if __name__ == "__main__":
+    test_distinct_queries_keep_distinct_keys()
+    test_equivalent_queries_share_key()
+    print("✅ 搜索缓存键测试通过")
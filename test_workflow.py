@@ -38,7 +38,9 @@ async def test_workflow():
     
     try:
         # 执行工作流
-        async for event in workflow.astream(initial_state):
+        # 工作流带检查点，需要指定thread_id
+        config = {"configurable": {"thread_id": "test_workflow"}}
+        async for event in workflow.astream(initial_state, config):
             for node_name, node_output in event.items():
                 print(f"\n🔄 执行节点: {node_name}")
                 